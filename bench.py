@@ -0,0 +1,289 @@
+"""
+Benchmarks for loading, reading and editing tables with CSVTableModel.
+
+Synthetic csv files are generated deterministically (from a seed) for a
+set of scenarios that vary the number of rows and columns, how many
+fields are quoted or span several lines, and whether there is a header.
+Each scenario runs in a fresh process, with the offscreen Qt platform,
+so its peak memory use is its own.
+
+    python bench.py                      # run everything, print the results
+    python bench.py -o results.json      # ...and save them
+    python bench.py -b baseline.json     # compare with earlier results
+    python bench.py -s wide -s quoted --scale 0.1
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadstats import current_rss, peak_rss
+
+# name -> (rows, columns, fraction of quoted fields, fraction of fields
+# with line breaks, header)
+SCENARIOS = {
+    "plain": (200000, 8, 0.0, 0.0, True),
+    "wide": (20000, 200, 0.0, 0.0, True),
+    "quoted": (200000, 8, 0.3, 0.0, True),
+    "multiline": (100000, 8, 0.1, 0.05, True),
+    "noheader": (200000, 8, 0.0, 0.0, False),
+}
+
+# number of cells read (or written) by the access benchmarks
+ACCESS_CELLS = 100000
+
+# a change of more than this (relative to the baseline) is reported
+TOLERANCE = 0.10
+
+_WORDS = ["red", "green", "blue", "alpha", "beta", "gamma", "delta", "north", "south"]
+
+
+def generate_csv(path, rows, cols, quoted=0.0, multiline=0.0, header=True, seed=0):
+    """Write a synthetic csv file; the same arguments always give the same file"""
+    rnd = random.Random(seed)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        if header:
+            writer.writerow([f"col{c}" for c in range(cols)])
+
+        for i in range(rows):
+            row = []
+            for c in range(cols):
+                kind = c % 4
+                if kind == 0:
+                    value = str(i)
+                elif kind == 1:
+                    value = f"{rnd.random() * 1000:.2f}"
+                elif kind == 2:
+                    value = rnd.choice(_WORDS)
+                else:
+                    value = " ".join(rnd.choices(_WORDS, k=rnd.randint(1, 4)))
+
+                k = rnd.random()
+                if k < multiline:
+                    value = f"{value}\nline {i}"
+                elif k < multiline + quoted:
+                    # (a delimiter and a quote make the writer quote it)
+                    value = f'{value}, "{c}"'
+                row.append(value)
+            writer.writerow(row)
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _new_model():
+    from model import CSVTableModel
+
+    model = CSVTableModel()
+    # (measure the work itself, not what was cached by an earlier run)
+    model.dialect_cache = None
+    model.index_dir = None
+    return model
+
+
+def _check_loaded(model, rows, cols):
+    """
+    Make sure a model read the whole generated file, as `rows` rows of
+    `cols` columns (a misdetected format would be timed just the same)
+    """
+    from PyQt5.QtCore import QModelIndex
+
+    while model.canFetchMore(QModelIndex()):
+        model.fetchMore(QModelIndex())
+    loaded = (model.rowCount(), model.columnCount())
+    if loaded != (rows, cols):
+        raise AssertionError(f"read {loaded[0]} rows of {loaded[1]} columns, "
+                             f"not {rows} of {cols}")
+
+
+def run_scenario(name, scale=1.0, repeat=3, workdir=None):
+    """
+    Run the benchmarks for a scenario (in this process)
+
+    :return: {benchmark: value}; times are in seconds (the best of
+        `repeat` runs), memory in bytes
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import QApplication
+
+    QApplication.instance() or QApplication([])
+
+    rows, cols, quoted, multiline, header = SCENARIOS[name]
+    rows = max(1, int(rows * scale))
+
+    workdir = workdir or tempfile.gettempdir()
+    path = os.path.join(workdir, f"quicsv-bench-{name}-{rows}.csv")
+    if not os.path.exists(path):
+        generate_csv(path, rows, cols, quoted, multiline, header)
+
+    results = {"rows": rows, "columns": cols, "file_bytes": os.path.getsize(path)}
+
+    # loading (keeping the last model loaded for the memory use; the
+    # model's modules are imported first, so they don't count)
+    _new_model()
+    rss_before = current_rss()
+    times = []
+    model = None
+    for _ in range(repeat):
+        model = None
+        model = _new_model()
+        times.append(_timed(model.load_csv, path, lazy=False))
+    _check_loaded(model, rows, cols)
+    results["load_csv"] = min(times)
+    results["rows_per_second"] = rows / results["load_csv"]
+    results["bytes_per_row"] = max(0, current_rss() - rss_before) / rows
+
+    lazy = _new_model()
+    results["load_csv_lazy"] = min(_timed(lazy.load_csv, path, lazy=True)
+                                   for _ in range(repeat))
+    _check_loaded(lazy, rows, cols)
+    lazy = None
+
+    dialect = csv.excel
+    manual = _new_model()
+    results["load_csv_manual"] = min(
+        _timed(manual.load_csv_manual, path, dialect, header=header, lazy=False)
+        for _ in range(repeat))
+    _check_loaded(manual, rows, cols)
+    manual = None
+
+    # cell access
+    nrows, ncols = model.rowCount(), model.columnCount()
+    ncells = min(ACCESS_CELLS, nrows * ncols)
+    rnd = random.Random(1)
+    indexes = [model.index(rnd.randrange(nrows), rnd.randrange(ncols)) for _ in range(ncells)]
+    results["data_random"] = min(_timed(lambda: [model.data(i) for i in indexes])
+                                 for _ in range(repeat))
+
+    sequential = [model.index(r, c) for r in range(max(1, ncells // ncols))
+                  for c in range(ncols)]
+    results["data_sequential"] = min(_timed(lambda: [model.data(i) for i in sequential])
+                                     for _ in range(repeat))
+
+    # editing (each run writes different values)
+    def edit(run):
+        for n, index in enumerate(indexes):
+            model.setData(index, f"edit{run}-{n}", Qt.EditRole)
+    results["set_data"] = min(_timed(edit, run) for run in range(repeat))
+
+    results["peak_rss"] = peak_rss()
+    return results
+
+
+def run(names, scale=1.0, repeat=3, workdir=None):
+    """Run each scenario in a new process; :return: {scenario: results}"""
+    results = {}
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), "--run-one", name,
+                   "--scale", str(scale), "--repeat", str(repeat)]
+        if workdir:
+            command += ["--workdir", workdir]
+        out = subprocess.run(command, stdout=subprocess.PIPE, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        # (the results are the last line of the output)
+        results[name] = json.loads(out.splitlines()[-1])
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare results with a baseline.
+
+    :return: a list of (scenario, benchmark, baseline value, value,
+        change), and a list of the regressions among them (a time or
+        memory use that went up by more than `tolerance`)
+    """
+    rows, regressions = [], []
+    for name, values in results.items():
+        base = baseline.get(name, {})
+        for key, value in values.items():
+            old = base.get(key)
+            if key in ("rows", "columns", "file_bytes") or not old:
+                continue
+            change = value / old - 1
+            rows.append((name, key, old, value, change))
+
+            # (for rows per second, higher is better)
+            worse = -change if key == "rows_per_second" else change
+            if worse > tolerance:
+                regressions.append((name, key, old, value, change))
+    return rows, regressions
+
+
+def _format(key, value):
+    if key in ("peak_rss",):
+        return f"{value / 2**20:.1f} MiB"
+    if key in ("bytes_per_row", "rows_per_second"):
+        return f"{value:,.0f}"
+    return f"{value * 1000:.1f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading, reading and editing tables")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the number of rows of each scenario by this")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per benchmark (the best is kept)")
+    parser.add_argument("-o", "--output", help="save the results to this JSON file")
+    parser.add_argument("-b", "--baseline", help="compare with results saved earlier")
+    parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE,
+                        help="relative change to report as a regression")
+    parser.add_argument("--workdir", help="where to keep the generated files")
+    # (runs a single scenario in this process, for run())
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        results = run_scenario(args.run_one, args.scale, args.repeat, args.workdir)
+        print(json.dumps(results))
+        return 0
+
+    names = args.scenario or list(SCENARIOS)
+    results = run(names, args.scale, args.repeat, args.workdir)
+
+    for name, values in results.items():
+        print(f"{name} ({values['rows']} rows x {values['columns']} columns)")
+        for key, value in values.items():
+            if key not in ("rows", "columns", "file_bytes"):
+                print(f"  {key:<18} {_format(key, value):>14}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cpus": os.cpu_count(),
+                       "scale": args.scale,
+                       "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        changes, regressions = compare(results, baseline, args.tolerance)
+
+        print("\ncompared with", args.baseline)
+        for name, key, old, value, change in changes:
+            mark = " !" if (name, key, old, value, change) in regressions else ""
+            print(f"  {name:<10} {key:<18} {_format(key, old):>14} -> "
+                  f"{_format(key, value):>14} ({change:+.1%}){mark}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
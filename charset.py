@@ -0,0 +1,200 @@
+"""
+Working out the text encoding of a csv file, and decoding its cells.
+
+detect_encoding() looks for a byte order mark, then checks whether
+samples of the file are valid UTF-8, and falls back to the locale's
+encoding, cp1252 and finally latin-1 (which can decode anything).
+
+Files in an ASCII-compatible encoding (UTF-8, or one byte per character)
+are parsed from their bytes rather than from decoded text: the bytes are
+read as latin-1 -- the "raw" text, in which each character is the byte of
+the same number -- and the cells are only decoded for real when they're
+used, by a CellCodec. Decoding to latin-1 is the cheapest there is, the
+csv parser is faster on it than on text with wide characters, and the
+cells that are never looked at are never decoded.
+"""
+
+import codecs
+import io
+import locale
+from functools import lru_cache
+
+from compressed import compression, open_binary
+
+# the encoding that bytes are read as, to be parsed as raw text
+RAW_ENCODING = "latin-1"
+
+# the size of each of the samples of the file that are checked
+SAMPLE_BYTES = 64 * 1024
+
+# (the longest BOMs first: that of UTF-32-LE starts with that of UTF-16-LE)
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def _samples(csvfile, sample_bytes):
+    """The head of a file and, for a big (uncompressed) one, blocks from its middle and end"""
+    if compression(csvfile):
+        with open_binary(csvfile) as f:
+            return [f.read(3 * sample_bytes)]
+
+    with open(csvfile, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+        f.seek(0)
+        if size <= 3 * sample_bytes:
+            return [f.read()]
+
+        samples = []
+        for start in (0, (size - sample_bytes) // 2, size - sample_bytes):
+            f.seek(start)
+            samples.append(f.read(sample_bytes))
+        return samples
+
+
+def _utf16_order(head):
+    """"le" or "be" if `head` looks like UTF-16 text (without a BOM), else None"""
+    if len(head) < 16:
+        return None
+    # (in mostly-ASCII UTF-16 text, every other byte is zero)
+    even, odd = head[0::2].count(0), head[1::2].count(0)
+    half = len(head) // 2
+    if odd > half * 0.4 and even < half * 0.05:
+        return "le"
+    if even > half * 0.4 and odd < half * 0.05:
+        return "be"
+    return None
+
+
+def _valid_utf8(sample):
+    # a block from the middle of the file may start (and end) partway
+    # through a character
+    start = 0
+    while start < 3 and start < len(sample) and sample[start] & 0xc0 == 0x80:
+        start += 1
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample[start:], final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _decodes(samples, encoding):
+    try:
+        for sample in samples:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def detect_encoding(csvfile, sample_bytes=SAMPLE_BYTES):
+    """
+    Work out the encoding of a csv file from samples of it.
+
+    :return: the name of a codec; "utf-8-sig", "utf-16" or "utf-32" for a
+        file that starts with a byte order mark
+    """
+    samples = _samples(csvfile, sample_bytes)
+    head = samples[0]
+
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    order = _utf16_order(head[:4096])
+    if order:
+        return "utf-16-" + order
+
+    # (all-ASCII samples are as good as UTF-8)
+    if all(s.isascii() for s in samples) or all(map(_valid_utf8, samples)):
+        return "utf-8"
+
+    preferred = codecs.lookup(locale.getpreferredencoding(False)).name
+    for encoding in (preferred, "cp1252"):
+        if encoding == "utf-8":
+            continue
+        # (the blocks from the middle of the file may start partway
+        # through a character of a multi-byte encoding)
+        if _decodes(samples if byte_level(encoding) else samples[:1], encoding):
+            return encoding
+    return RAW_ENCODING
+
+
+@lru_cache(maxsize=None)
+def byte_level(encoding):
+    """
+    True if a file in this encoding can be parsed from its bytes: if it's
+    UTF-8, or has one byte per character and is a superset of ASCII (so
+    that the bytes of the delimiter, quote char and line breaks never
+    turn up inside another character)
+    """
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    if name in ("utf-8", "utf-8-sig"):
+        return True
+
+    ascii_bytes = bytes(range(128))
+    high_bytes = bytes(range(128, 256))
+    try:
+        if ascii_bytes.decode(name) != ascii_bytes.decode("ascii"):
+            return False
+        # (a multi-byte encoding pairs up some of these)
+        return len(high_bytes.decode(name, "replace")) == len(high_bytes)
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def bom_length(head, encoding):
+    """The length of the BOM that `head` (the start of a file) starts with, if `encoding` has one"""
+    if codecs.lookup(encoding).name == "utf-8-sig" and head.startswith(codecs.BOM_UTF8):
+        return len(codecs.BOM_UTF8)
+    return 0
+
+
+class CellCodec:
+    """
+    Converts cells between raw text (bytes read as RAW_ENCODING) and the
+    text they really are, in some byte-level encoding.
+
+    Bytes that aren't valid in the encoding are decoded to surrogates
+    (see the "surrogateescape" error handler), so that they're written
+    back as they were.
+    """
+
+    __slots__ = ("encoding",)
+
+    def __init__(self, encoding):
+        # (the BOM was skipped before parsing)
+        name = codecs.lookup(encoding).name
+        self.encoding = "utf-8" if name == "utf-8-sig" else name
+
+    def decode(self, raw):
+        # (ASCII is the same either way, and checking for it is cheap)
+        if raw is None or raw.isascii():
+            return raw
+        return raw.encode(RAW_ENCODING).decode(self.encoding, "surrogateescape")
+
+    def encode(self, value):
+        """
+        :raises UnicodeEncodeError: if `value` has characters that the
+            encoding doesn't have
+        """
+        if value is None or value.isascii():
+            return value
+        return value.encode(self.encoding, "surrogateescape").decode(RAW_ENCODING)
+
+    def decode_all(self, values):
+        return list(map(self.decode, values))
+
+
+def cell_codec(encoding):
+    """A CellCodec for the cells of a file in `encoding`, if it can be parsed from its bytes, else None"""
+    return CellCodec(encoding) if byte_level(encoding) else None
+
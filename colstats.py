@@ -0,0 +1,584 @@
+"""
+Aggregates of the columns of a table -- the number of empty and
+distinct values, min, max, sum, mean and quantiles -- for the statistics
+panel (see statspanel.py).
+
+The aggregates of a column are computed in bulk from its storage (the
+numbers array of a numeric column, the distinct values and codes of a
+dictionary-encoded one) and kept; after that, editing a cell updates
+them rather than computing them again, and rows added to the table are
+added to them when they're next asked for.
+
+In approximate mode, for tables too big to summarise exactly at every
+turn, the distinct values of a column are counted with a HyperLogLog
+sketch and the quantiles are estimated from an evenly spaced sample of
+the rows, so that the memory used doesn't grow with the number of
+distinct values. A lazily-loaded table is only sampled then.
+"""
+
+import math
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain, compress
+
+from coltypes import INT, NUMERIC, numeric_format, parser
+from store import ColumnStore
+
+# the number of rows that quantiles are estimated from, in approximate
+# mode (and that a lazily-loaded table is sampled by)
+SAMPLE_ROWS = 10000
+
+# a lazily-loaded table is sampled in runs of this many rows (as its
+# records are parsed in blocks)
+SAMPLE_RUN = 250
+
+# the registers of a HyperLogLog are indexed by this many bits of the
+# hash of a value: 4096 registers, for a standard error of 1.6%
+HLL_BITS = 12
+
+# the quantiles worked out for a numeric column
+QUANTILES = (0.25, 0.5, 0.75)
+
+# an edit of more cells of a column than this makes its aggregates be
+# computed again (in bulk) rather than updated a cell at a time
+MAX_UPDATE_CELLS = 1000
+
+# the most common values listed for a text column
+TOP_VALUES = 5
+
+_MASK64 = (1 << 64) - 1
+_INT_MIN, _INT_MAX = -(1 << 63), (1 << 63) - 1
+# (turns a null mask into a mask of the cells that are set)
+_FLIP = bytes.maketrans(b'\0\1', b'\1\0')
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values added to it, in a fixed
+    2 ** `bits` bytes (Flajolet et al., "HyperLogLog: the analysis of a
+    near-optimal cardinality estimation algorithm", 2007). Values can't
+    be taken out again.
+    """
+
+    __slots__ = ("bits", "_registers")
+
+    def __init__(self, bits=HLL_BITS):
+        self.bits = bits
+        self._registers = bytearray(1 << bits)
+
+    def add(self, value):
+        self.update((value,))
+
+    def update(self, values):
+        registers = self._registers
+        shift = 64 - self.bits
+        rest = (1 << shift) - 1
+        for h in map(hash, values):
+            # (mixed, as Python hashes numbers to about themselves)
+            h &= _MASK64
+            h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & _MASK64
+            h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & _MASK64
+            h ^= h >> 33
+            rank = shift - (h & rest).bit_length() + 1
+            if rank > registers[h >> shift]:
+                registers[h >> shift] = rank
+
+    def estimate(self):
+        registers = self._registers
+        m = len(registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / math.fsum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # (counting the empty registers is better for a few values)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class ColumnStats:
+    """
+    The aggregates of a column. A numeric column has numbers for `min`,
+    `max`, `sum`, `mean` and `quantiles`; a text column only has `min`
+    and `max` (compared as text) and, unless it's approximate, its most
+    common values in `top`.
+    """
+
+    def __init__(self, ctype=None):
+        # INT or FLOAT, or None for text
+        self.ctype = ctype
+        self.rows = 0
+        self.empty = 0
+        # cells of a numeric column that aren't numbers
+        self.non_numeric = 0
+        self.distinct = 0
+        self.min = None
+        self.max = None
+        self.sum = None
+        self.mean = None
+        # quantile (0.5...) -> value
+        self.quantiles = {}
+        # (value, count) pairs, most common first
+        self.top = []
+        # True if `distinct` is an estimate, and `quantiles` come from a
+        # sample of the rows
+        self.approximate = False
+        # if everything comes from a sample of the rows, its size
+        self.sampled = None
+
+    @property
+    def null_rate(self):
+        """The fraction of the cells that are empty"""
+        return self.empty / self.rows if self.rows else 0.0
+
+    def as_dict(self):
+        return {
+            "type": self.ctype or "text",
+            "rows": self.rows,
+            "empty": self.empty,
+            "null_rate": self.null_rate,
+            "non_numeric": self.non_numeric,
+            "distinct": self.distinct,
+            "min": self.min,
+            "max": self.max,
+            "sum": self.sum,
+            "mean": self.mean,
+            "quantiles": dict(self.quantiles),
+            "top": list(self.top),
+            "approximate": self.approximate,
+            "sampled": self.sampled,
+        }
+
+    def items(self):
+        """The stats as (name, text) pairs, for showing to the user"""
+        about = "~" if self.approximate or self.sampled else ""
+        items = [
+            ("Type", self.ctype or "text"),
+            ("Rows", f"{self.rows:,}"),
+            ("Empty", f"{self.empty:,} ({self.null_rate:.1%})"),
+            ("Distinct", f"{about}{self.distinct:,}"),
+        ]
+        if self.non_numeric:
+            items.append(("Not numbers", f"{self.non_numeric:,}"))
+        if self.min is not None:
+            items += [("Min", _format(self.min)), ("Max", _format(self.max))]
+        if self.sum is not None:
+            items += [("Sum", _format(self.sum)), ("Mean", _format(self.mean))]
+        for q, value in self.quantiles.items():
+            name = "Median" if q == 0.5 else f"{q:.0%} quantile"
+            items.append((name, about + _format(value)))
+        for value, count in self.top:
+            items.append((f"'{value}'", f"{count:,}"))
+        if self.sampled:
+            items.append(("Sampled", f"{self.sampled:,} rows"))
+        return items
+
+    def summary(self):
+        return [f"{name}: {text}" for name, text in self.items()]
+
+
+def _format(x):
+    if isinstance(x, float):
+        return f"{x:.12g}"
+    if isinstance(x, int):
+        return str(x)
+    return x
+
+
+def _quantile(numbers, q):
+    """The `q` quantile of sorted `numbers` (interpolating between the closest two)"""
+    pos = q * (len(numbers) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(numbers) - 1)
+    return numbers[lo] + (numbers[hi] - numbers[lo]) * (pos - lo)
+
+
+def _remove_sorted(numbers, x):
+    """Take a value out of a sorted array; return False if it's no longer in there at all"""
+    i = bisect_left(numbers, x)
+    if i < len(numbers) and numbers[i] == x:
+        del numbers[i]
+        return (i < len(numbers) and numbers[i] == x) or (i > 0 and numbers[i - 1] == x)
+    return True
+
+
+class _NumberSummary:
+    """The running aggregates of a column of numbers"""
+
+    def __init__(self, ctype, approximate, step):
+        self.ctype = ctype
+        self.approximate = approximate
+        self.rows = 0
+        self.empty = 0
+        self.texts = 0
+        self.total = 0 if ctype == INT else 0.0
+
+        self._parse = parser(ctype)
+        typecode = 'q' if ctype == INT else 'd'
+        # exact: all the numbers, sorted
+        self._sorted = array(typecode)
+        self._distinct = 0
+        # approximate: the numbers of every `step`th row (sorted), and the
+        # min and max (None when they have to be looked for again)
+        self._hll = HyperLogLog() if approximate else None
+        self._step = step
+        self._sample = array(typecode)
+        self._low = self._high = None
+
+    def _classify(self, value):
+        """:return: the number a cell holds, or None (counting it as empty or text)"""
+        if not value:
+            return None
+        try:
+            x = self._parse(value)
+        except ValueError:
+            return None
+        if self.ctype == INT and not _INT_MIN <= x <= _INT_MAX:
+            return None
+        return x
+
+    def add_arrays(self, values, nulls, texts, start):
+        """
+        Add the rows of a NumericColumn from `start` on (see
+        ColumnStore.numeric_data() and numeric_texts())
+        """
+        numbers = array(values.typecode, compress(values[start:], nulls[start:].translate(_FLIP)))
+        # (the cells that aren't numbers are null, too)
+        kept = sum(1 for row in texts if row >= start and nulls[row])
+        self.rows = len(values)
+        self.empty += nulls.count(1, start) - kept
+        self.texts += kept
+        first = start + -start % self._step
+        sample = compress(values[first::self._step], nulls[first::self._step].translate(_FLIP))
+        self._add_numbers(numbers, sample, start)
+
+    def add_cells(self, cells, start):
+        """Add text cells (of the rows from `start` on), parsing them"""
+        numbers = []
+        for value in cells:
+            x = self._classify(value)
+            if x is not None:
+                numbers.append(x)
+            elif value:
+                self.texts += 1
+            else:
+                self.empty += 1
+        self.rows = start + len(cells)
+        sample = filter(None.__ne__, map(self._classify, cells[-start % self._step::self._step]))
+        self._add_numbers(array(self._sorted.typecode, numbers), sample, start)
+
+    def _add_numbers(self, numbers, sample, start):
+        if not numbers:
+            return
+        self.total += sum(numbers) if self.ctype == INT else math.fsum(numbers)
+        if not self.approximate:
+            # (sorting two sorted runs is a merge)
+            self._sorted = array(numbers.typecode, sorted(chain(self._sorted, sorted(numbers))))
+            self._distinct = len(set(self._sorted))
+            return
+
+        self._hll.update(set(numbers))
+        self._sample = array(numbers.typecode, sorted(chain(self._sample, sample)))
+        low, high = min(numbers), max(numbers)
+        if not start:
+            self._low, self._high = low, high
+        elif self._low is not None:
+            self._low, self._high = min(self._low, low), max(self._high, high)
+
+    def change(self, row, old, new):
+        """Update the aggregates for a cell changing from `old` to `new` (text)"""
+        x, y = self._classify(old), self._classify(new)
+        sampled = self.approximate and not row % self._step
+
+        if x is None:
+            if old:
+                self.texts -= 1
+            else:
+                self.empty -= 1
+        else:
+            self.total -= x
+            if not self.approximate:
+                if not _remove_sorted(self._sorted, x):
+                    self._distinct -= 1
+            else:
+                if sampled:
+                    _remove_sorted(self._sample, x)
+                if x == self._low or x == self._high:
+                    self._low = self._high = None
+
+        if y is None:
+            if new:
+                self.texts += 1
+            else:
+                self.empty += 1
+        else:
+            self.total += y
+            if not self.approximate:
+                i = bisect_left(self._sorted, y)
+                if not (i < len(self._sorted) and self._sorted[i] == y):
+                    self._distinct += 1
+                self._sorted.insert(i, y)
+            else:
+                self._hll.add(y)
+                if sampled:
+                    insort(self._sample, y)
+                if self._low is not None:
+                    self._low, self._high = min(self._low, y), max(self._high, y)
+
+    def stats(self, extremes=None):
+        """
+        :param extremes: a function returning the (min, max) of the
+            column, to find them again after they were edited away
+        """
+        stats = ColumnStats(self.ctype)
+        stats.rows = self.rows
+        stats.empty = self.empty
+        stats.non_numeric = self.texts
+        stats.approximate = self.approximate
+
+        if not self.approximate:
+            values = self._sorted
+            stats.distinct = self._distinct
+        else:
+            values = self._sample
+            stats.distinct = self._hll.estimate()
+            if self._low is None and extremes is not None:
+                self._low, self._high = extremes()
+
+        count = self.rows - self.empty - self.texts
+        if count:
+            stats.sum = self.total
+            stats.mean = self.total / count
+            if not self.approximate:
+                stats.min, stats.max = values[0], values[-1]
+            else:
+                stats.min, stats.max = self._low, self._high
+        if values:
+            stats.quantiles = {q: _quantile(values, q) for q in QUANTILES}
+        return stats
+
+
+class _TextSummary:
+    """The running aggregates of a column of text"""
+
+    def __init__(self, approximate):
+        self.approximate = approximate
+        self.rows = 0
+        self.empty = 0
+        # exact: value -> count, of the values that aren't empty
+        self._counts = Counter()
+        # approximate
+        self._hll = HyperLogLog() if approximate else None
+        # (None when they have to be looked for again)
+        self._low = self._high = None
+
+    def add_encoded(self, values, codes, start):
+        """Add the rows of a dictionary-encoded column from `start` on"""
+        counts = self._counts
+        for code, n in Counter(codes[start:]).items():
+            counts[values[code]] += n
+        self.rows = len(codes)
+        self._take_empty()
+
+    def add_cells(self, cells, start):
+        """Add the cells of the rows from `start` on"""
+        self.rows = start + len(cells)
+        if not self.approximate:
+            self._counts.update(cells)
+            self._take_empty()
+            return
+
+        self.empty += cells.count(None) + cells.count('')
+        present = set(cells)
+        present.discard(None)
+        present.discard('')
+        self._hll.update(present)
+        if present:
+            low, high = min(present), max(present)
+            if not start:
+                self._low, self._high = low, high
+            elif self._low is not None:
+                self._low, self._high = min(self._low, low), max(self._high, high)
+
+    def _take_empty(self):
+        counts = self._counts
+        self.empty += counts.pop(None, 0) + counts.pop('', 0)
+        self._low = self._high = None
+
+    def change(self, row, old, new):
+        counts = self._counts
+        if not old:
+            self.empty -= 1
+        elif not self.approximate:
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+                if old == self._low or old == self._high:
+                    self._low = self._high = None
+        elif old == self._low or old == self._high:
+            self._low = self._high = None
+
+        if not new:
+            self.empty += 1
+            return
+        if not self.approximate:
+            counts[new] += 1
+        else:
+            self._hll.add(new)
+        if self._low is not None:
+            self._low, self._high = min(self._low, new), max(self._high, new)
+
+    def stats(self, extremes=None):
+        """:param extremes: see _NumberSummary.stats()"""
+        stats = ColumnStats()
+        stats.rows = self.rows
+        stats.empty = self.empty
+        stats.approximate = self.approximate
+
+        if not self.approximate:
+            counts = self._counts
+            stats.distinct = len(counts)
+            stats.top = counts.most_common(TOP_VALUES)
+            if self._low is None and counts:
+                self._low, self._high = min(counts), max(counts)
+        else:
+            stats.distinct = self._hll.estimate()
+            if self._low is None and extremes is not None:
+                self._low, self._high = extremes()
+
+        stats.min, stats.max = self._low, self._high
+        return stats
+
+
+def _extremes(values):
+    """A function returning the (min, max) of the values that `values()` iterates over, or (None, None)"""
+    def extremes():
+        return min(values(), default=None), max(values(), default=None)
+    return extremes
+
+
+class StatsEngine:
+    """
+    Computes the ColumnStats of the columns of a store (over all of its
+    rows, whether they're shown or not), and keeps them up to date as
+    cells are edited (see cells_changing()) and rows are added.
+
+    The cells of a dictionary-encoded text column are always counted
+    exactly: the distinct values are in memory already.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        # slot -> (approximate, summary) of a column of an in-memory store
+        self._summaries = {}
+
+        # the rows of the store that are in the table (a PieceTable, see
+        # pieces.py), once rows have been inserted, removed or moved; the
+        # stats are then worked out afresh from their cells, and kept
+        # until the column changes
+        self.rows = None
+        # slot -> (approximate, ColumnStats) over those rows
+        self._table_stats = {}
+
+    def invalidate(self, slot=None):
+        """Forget the aggregates of a column (or of all of them), to compute them again when asked"""
+        if slot is None:
+            self._summaries.clear()
+            self._table_stats.clear()
+        else:
+            self._summaries.pop(slot, None)
+            self._table_stats.pop(slot, None)
+
+    def cells_changing(self, rows, slot, values):
+        """Let the engine know that cells of a column are about to be set to `values`"""
+        self._table_stats.pop(slot, None)
+        if slot not in self._summaries:
+            return
+        if len(rows) > MAX_UPDATE_CELLS:
+            del self._summaries[slot]
+            return
+
+        summary = self._summaries[slot][1]
+        get = self._store.get
+        for row, value in zip(rows, values):
+            if row < summary.rows:
+                summary.change(row, get(row, slot), value)
+
+    def column_stats(self, slot, approximate=False):
+        """The ColumnStats of a column"""
+        store = self._store
+        if self.rows is not None:
+            mode, stats = self._table_stats.get(slot, (None, None))
+            if stats is None or mode != approximate:
+                stats = self._cell_stats(slot, approximate, self.rows)
+                self._table_stats[slot] = (approximate, stats)
+            return stats
+        if not isinstance(store, ColumnStore):
+            return self._cell_stats(slot, approximate)
+
+        ctype = store.column_type(slot)
+        mode, summary = self._summaries.get(slot, (None, None))
+        if (summary is None or mode != approximate or summary.rows > len(store)
+                or getattr(summary, "ctype", None) != ctype):
+            # (including a column that has been converted to or from numbers)
+            summary = self._new_summary(slot, ctype, approximate)
+            self._summaries[slot] = (approximate, summary)
+        start = summary.rows
+
+        if ctype in NUMERIC:
+            values, nulls = store.numeric_data(slot)
+            if start < len(values):
+                summary.add_arrays(values, nulls, store.numeric_texts(slot), start)
+            return summary.stats(_extremes(lambda: compress(values, nulls.translate(_FLIP))))
+
+        values, codes = store.column_data(slot)
+        if start < len(store):
+            if codes is not None:
+                summary.add_encoded(values, codes, start)
+            else:
+                summary.add_cells(values[start:], start)
+        return summary.stats(_extremes(lambda: filter(None, values)))
+
+    def _new_summary(self, slot, ctype, approximate):
+        store = self._store
+        if ctype in NUMERIC:
+            return _NumberSummary(ctype, approximate, max(1, len(store) // SAMPLE_ROWS))
+        return _TextSummary(approximate and store.column_data(slot)[1] is None)
+
+    def _cell_stats(self, slot, approximate, rows=None):
+        """
+        The stats of a column, worked out afresh from the cells of the
+        given rows of the store (all of them by default, which for a
+        lazily-loaded store parses every record), or, if `approximate`,
+        from a sample of those rows
+        """
+        store = self._store
+        nrows = len(store) if rows is None else len(rows)
+        if approximate and nrows > SAMPLE_ROWS:
+            span = nrows // (SAMPLE_ROWS // SAMPLE_RUN)
+            get = store.get if rows is None else lambda row, slot: store.get(rows[row], slot)
+            cells = [get(row, slot) for first in range(0, nrows - SAMPLE_RUN + 1, span)
+                     for row in range(first, first + SAMPLE_RUN)]
+        elif rows is None:
+            cells = store.column_data(slot)[0]
+        else:
+            cells = store.get_cells(rows, slot)
+
+        # (the cells are read as text -- those of a lazily-loaded store
+        # are all text anyway -- so numbers are told apart here)
+        fmt = numeric_format(cells[:SAMPLE_ROWS])
+        summary = _TextSummary(False) if fmt is None else _NumberSummary(fmt[0], False, 1)
+        summary.add_cells(cells, 0)
+        stats = summary.stats()
+
+        if len(cells) < nrows:
+            # (scaled up to the whole table)
+            scale = nrows / len(cells)
+            stats.approximate = True
+            stats.sampled = len(cells)
+            stats.rows = nrows
+            stats.empty = round(stats.empty * scale)
+            stats.non_numeric = round(stats.non_numeric * scale)
+            if stats.sum is not None:
+                stats.sum = type(stats.sum)(stats.sum * scale)
+            stats.top = [(value, round(count * scale)) for value, count in stats.top]
+        return stats
@@ -0,0 +1,172 @@
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+# column types, from the most to the least specific
+INT = "int"
+FLOAT = "float"
+DATE = "date"
+TEXT = "text"
+
+TYPES = (INT, FLOAT, DATE, TEXT)
+
+# the types that can be stored as numbers
+NUMERIC = (INT, FLOAT)
+
+# how many non-empty values infer_type() looks at
+SAMPLE_SIZE = 1000
+
+# a column is only stored as numbers if (at least) this fraction of its
+# values are written exactly the way the numbers would be formatted, so
+# that formatting them for display (or saving) gives back the same text
+MIN_EXACT = 0.99
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_int(text):
+    # int() accepts underscores ("1_000"), which would be odd in a csv
+    if '_' in text:
+        raise ValueError(text)
+    return int(text)
+
+
+def parse_float(text):
+    if '_' in text:
+        raise ValueError(text)
+    return float(text)
+
+
+def parse_date(text):
+    """Parse an ISO date (and time) into seconds since the epoch"""
+    dt = datetime.fromisoformat(text.strip())
+    return (dt.replace(tzinfo=None) - _EPOCH).total_seconds()
+
+
+_parsers = {
+    INT: parse_int,
+    FLOAT: parse_float,
+    DATE: parse_date,
+}
+
+
+def parser(ctype):
+    """The function that converts text to a value of the given type (None for TEXT)"""
+    return _parsers.get(ctype)
+
+
+def infer_type(values, sample_size=SAMPLE_SIZE):
+    """
+    Guess the type of a column from (up to `sample_size` of) its
+    non-empty values: the most specific type that all of them parse as.
+    """
+    candidates = [INT, FLOAT, DATE]
+    seen = False
+
+    for value in islice(filter(None, values), sample_size):
+        seen = True
+        candidates = [ctype for ctype in candidates if _parses(ctype, value)]
+        if not candidates:
+            return TEXT
+
+    # (an empty column is just text)
+    return candidates[0] if seen else TEXT
+
+
+def _parses(ctype, value):
+    try:
+        _parsers[ctype](value)
+    except ValueError:
+        return False
+    return True
+
+
+def sort_key(ctype):
+    """
+    Return a function giving a sort key for a cell value of the given
+    type. Empty cells (and values that don't parse) sort first.
+    """
+    parse = _parsers.get(ctype)
+
+    if parse is None:
+        def key(value):
+            return value or ""
+    else:
+        def key(value):
+            if not value:
+                return float("-inf")
+            try:
+                return parse(value)
+            except ValueError:
+                return float("-inf")
+    return key
+
+
+def _format_float(x):
+    text = repr(x)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def formatter(ctype, decimals=None):
+    """
+    The function that formats numbers of a numeric type as text: ints as
+    usual; floats with a fixed number of `decimals`, or, if that's None,
+    with as many digits as needed (and without a trailing ".0").
+    """
+    if ctype == INT:
+        return str
+    if decimals is None:
+        return _format_float
+    return ("%." + str(decimals) + "f").__mod__
+
+
+def _decimals(text):
+    point = text.find('.')
+    return len(text) - point - 1 if point >= 0 else 0
+
+
+def numeric_format(values, ctype=None, min_exact=MIN_EXACT):
+    """
+    Decide whether a sample of values (None for empty cells) could be
+    stored as numbers, and how to format them back: the values must
+    parse as numbers and (mostly) be written the way they'd be formatted.
+
+    :param ctype: INT or FLOAT to only consider that type
+    :return: (INT, None) or (FLOAT, decimals) (see formatter()), or None
+    """
+    values = [v for v in values if v]
+    if not values:
+        return None
+    needed = min_exact * len(values)
+
+    for numtype in (INT, FLOAT):
+        if ctype and numtype != ctype:
+            continue
+
+        parse = _parsers[numtype]
+        numbers = []
+        failed = 0
+        for value in values:
+            try:
+                numbers.append(parse(value))
+            except ValueError:
+                numbers.append(None)
+                failed += 1
+                # (give up as soon as there can't be enough numbers)
+                if len(values) - failed < needed:
+                    break
+        else:
+            formats = [None]
+            if numtype == FLOAT:
+                # the usual number of decimals, for fixed-point values
+                counts = Counter(map(_decimals, values)).most_common(1)
+                if counts[0][0]:
+                    formats.append(counts[0][0])
+
+            for decimals in formats:
+                fmt = formatter(numtype, decimals)
+                exact = sum(1 for x, value in zip(numbers, values)
+                            if x is not None and fmt(x) == value)
+                if exact >= needed:
+                    return numtype, decimals
+    return None
@@ -0,0 +1,153 @@
+import random
+
+from PyQt5.QtCore import Qt, QObject, QTimer
+from PyQt5.QtWidgets import QStyle
+
+
+class ColumnWidths(QObject):
+    """
+    Sizes the columns of a table view to fit their contents, going by
+    the header and a sample of the rows (the first and last few, and some
+    at random) rather than by every cell, as resizeColumnsToContents()
+    does.
+
+    Text is measured once per length: a value is taken to be as wide as
+    the first one of the same length that was measured. Columns are
+    widened (never narrowed) as rows are added to the model, e.g. as a
+    file is loaded in the background or read further lazily, except for
+    the ones resized by hand.
+    """
+
+    # how many rows of the table are measured
+    head_rows = 20
+    random_rows = 60
+    tail_rows = 20
+
+    # no column is made wider than this (in pixels)
+    max_width = 400
+
+    # how long (in ms) to wait for more rows before refining the widths
+    refine_delay = 500
+
+    def __init__(self, view):
+        super().__init__(view)
+        self._view = view
+        self._random = random.Random(0)
+
+        # length of text -> width, for the font the widths were measured in
+        self._lengths = {}
+        self._font = None
+
+        # columns resized by hand, which are left alone from then on
+        self._manual = set()
+        self._resizing = False
+
+        # the rows added since the widths were last refined
+        self._added = None
+        self._timer = QTimer(self, singleShot=True, interval=self.refine_delay,
+                             timeout=self._refine)
+
+        view.model().rowsInserted.connect(self._on_rows_inserted)
+        view.horizontalHeader().sectionResized.connect(self._on_section_resized)
+
+    def fit(self):
+        """Size all the columns for the current contents of the model"""
+        self._manual.clear()
+        self._added = None
+        self._timer.stop()
+
+        model = self._view.model()
+        rows = self._sample(0, model.rowCount())
+        self._apply(self._estimate(rows), widen_only=False)
+
+    def _sample(self, first, end):
+        """A sample of the rows in [first, end): the first and last few, and some at random"""
+        count = end - first
+        if count <= self.head_rows + self.random_rows + self.tail_rows:
+            return range(first, end)
+
+        rows = set(range(first, first + self.head_rows))
+        rows.update(range(end - self.tail_rows, end))
+        rows.update(self._random.sample(range(first, end), self.random_rows))
+        return sorted(rows)
+
+    def _text_width(self, metrics, text):
+        if '\n' in text:
+            text = max(text.split('\n'), key=len)
+
+        length = len(text)
+        width = self._lengths.get(length)
+        if width is None:
+            width = self._lengths[length] = metrics.horizontalAdvance(text)
+        return width
+
+    def _estimate(self, rows, header=True):
+        """The widths the columns need for the given rows (and the header)"""
+        view, model = self._view, self._view.model()
+
+        if view.font() != self._font:
+            self._font = view.font()
+            self._lengths.clear()
+        metrics = view.fontMetrics()
+
+        style = view.style()
+        # (room for the text margins and the grid line)
+        padding = 2 * (style.pixelMetric(QStyle.PM_FocusFrameHMargin, None, view) + 1) + 2
+
+        widths = []
+        for column in range(model.columnCount()):
+            # (the edit role has the value even if the row isn't drawn yet)
+            cells = (model.data(model.index(row, column), Qt.EditRole) for row in rows)
+            width = max((self._text_width(metrics, str(value))
+                         for value in cells if value), default=0)
+            widths.append(width + padding if width else 0)
+
+        if header:
+            hview = view.horizontalHeader()
+            for column in range(len(widths)):
+                widths[column] = max(widths[column], hview.sectionSizeHint(column))
+
+        return widths
+
+    def _apply(self, widths, widen_only):
+        hview = self._view.horizontalHeader()
+        minimum = hview.minimumSectionSize()
+
+        self._resizing = True
+        try:
+            for column, width in enumerate(widths):
+                if column in self._manual:
+                    continue
+                width = max(minimum, min(width, self.max_width))
+                if widen_only and width <= hview.sectionSize(column):
+                    continue
+                hview.resizeSection(column, width)
+        finally:
+            self._resizing = False
+
+    def _on_section_resized(self, column, old, new):
+        if not self._resizing:
+            self._manual.add(column)
+
+    def _on_rows_inserted(self, parent, first, last):
+        if parent.isValid():
+            return
+        if self._added is None:
+            self._added = [first, last + 1]
+        else:
+            self._added[0] = min(self._added[0], first)
+            self._added[1] = max(self._added[1], last + 1)
+
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _refine(self):
+        if self._added is None:
+            return
+        first, end = self._added
+        self._added = None
+
+        end = min(end, self._view.model().rowCount())
+        if first < end:
+            self._apply(self._estimate(self._sample(first, end), header=False),
+                        widen_only=True)
@@ -0,0 +1,419 @@
+"""
+Reading (and writing) compressed csv files: gzip, bzip2, xz and (with the
+zstandard module) zstd. Files are decompressed as they're read, never to
+a temporary file.
+
+For lazily-loaded files, CompressedBuffer gives random access to the
+decompressed data of a gzip or xz file: reading from some point restarts
+decompression from the nearest checkpoint rather than from the start of
+the file. The checkpoints of a gzip file are copies of the decompressor's
+state, taken every CHECKPOINT_BYTES of data as the file is first read;
+those of an xz file are the blocks listed in its index (so only files
+that were compressed in several blocks, e.g. with `xz -T0`, have them).
+"""
+
+import bz2
+import copy
+import gzip
+import io
+import lzma
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_right
+
+GZIP = "gzip"
+BZIP2 = "bzip2"
+XZ = "xz"
+ZSTD = "zstd"
+
+_MAGIC = (
+    (b'\x1f\x8b', GZIP),
+    (b'BZh', BZIP2),
+    (b'\xfd7zXZ\x00', XZ),
+    (b'\x28\xb5\x2f\xfd', ZSTD),
+)
+
+_EXTENSIONS = {
+    ".gz": GZIP,
+    ".gzip": GZIP,
+    ".bz2": BZIP2,
+    ".xz": XZ,
+    ".zst": ZSTD,
+}
+
+# compressed data is read in pieces of this size
+RAW_CHUNK = 64 * 1024
+
+# (decompressed) bytes between the checkpoints of a gzip file
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# how much decompressed data is kept around after a random read, for the
+# reads that follow it
+WINDOW_BYTES = 1024 * 1024
+
+# ...and at the end of the data decompressed so far (for indexing it)
+TAIL_BYTES = 8 * 1024 * 1024
+
+_XZ_HEADER_BYTES = 12
+
+
+def compression(path):
+    """The compression format of a file (going by its first bytes), or None"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, kind in _MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def compression_for_name(path):
+    """The compression format that a file of this name would be written in, or None"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise OSError("zstd-compressed files need the zstandard module") from None
+    return zstandard
+
+
+def _decompressor(kind):
+    if kind == GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if kind == BZIP2:
+        return bz2.BZ2Decompressor()
+    if kind == XZ:
+        return lzma.LZMADecompressor()
+    return _zstandard().ZstdDecompressor().decompressobj()
+
+
+def size_hint(path, kind=None):
+    """
+    The size of the decompressed data of a file, if it's known (from the
+    xz index) or can be guessed, or else an estimate
+    """
+    size = os.path.getsize(path)
+    kind = kind or compression(path)
+    if kind is None:
+        return size
+
+    if kind == XZ:
+        with open(path, 'rb') as f:
+            blocks = _xz_blocks(f)
+        if blocks is not None:
+            return blocks[2]
+    elif kind == GZIP and size >= 4:
+        # the size of the (last) member, modulo 2**32
+        with open(path, 'rb') as f:
+            f.seek(-4, io.SEEK_END)
+            isize = struct.unpack('<I', f.read(4))[0]
+        if isize >= size:
+            return isize
+    # (a typical ratio for csv)
+    return 5 * size
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _xz_blocks(f):
+    """
+    Read the index of a (single-stream) xz file.
+
+    :return: a list of (decompressed offset, file offset) of the blocks,
+        the file offset of the end of the last block, and the
+        decompressed size; or None if the index can't be used
+    """
+    try:
+        size = f.seek(0, io.SEEK_END)
+        f.seek(size - 12)
+        footer = f.read(12)
+        if len(footer) < 12 or footer[10:] != b'YZ':
+            return None
+
+        index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+        index_start = size - 12 - index_size
+        f.seek(index_start)
+        index = f.read(index_size)
+        if not index or index[0] != 0:
+            return None
+
+        count, pos = _varint(index, 1)
+        blocks = []
+        out, raw = 0, _XZ_HEADER_BYTES
+        for _ in range(count):
+            unpadded, pos = _varint(index, pos)
+            usize, pos = _varint(index, pos)
+            blocks.append((out, raw))
+            out += usize
+            raw += (unpadded + 3) & ~3
+    except (OSError, IndexError, struct.error):
+        return None
+
+    # (several streams one after the other have an index each)
+    if raw != index_start:
+        return None
+    return blocks, index_start, out
+
+
+class _Decoder:
+    """Decompresses the data of a file in order, from some point in it"""
+
+    def __init__(self, raw, kind, pos=0, state=None, prefix=b'', end=None):
+        """
+        :param raw: the (compressed) file
+        :param pos: where in the file to start
+        :param state: a decompressor that has been fed the data up to
+            `pos`; if None, a new one is started there
+        :param prefix: data to feed a new decompressor before that at
+            `pos` (the header of an xz stream, to start at a block)
+        :param end: where to stop, if not at the end of the file
+        """
+        self._raw = raw
+        self._kind = kind
+        self.pos = pos
+        self._end = end
+        self._d = state or _decompressor(kind)
+        if prefix:
+            self._d.decompress(prefix)
+        self.eof = False
+
+    def state(self):
+        """A copy of the decompressor, to start again from `pos` (gzip only)"""
+        return None if self._d.eof else self._d.copy()
+
+    def read(self):
+        """:return: the next piece of decompressed data (empty at the end)"""
+        while not self.eof:
+            count = RAW_CHUNK if self._end is None else min(RAW_CHUNK, self._end - self.pos)
+            self._raw.seek(self.pos)
+            data = self._raw.read(count) if count > 0 else b''
+            if not data:
+                self.eof = True
+                break
+            self.pos += len(data)
+
+            out = []
+            while data:
+                if self._d.eof:
+                    # the next member (gzip), stream (bzip2, xz) or frame (zstd)
+                    self._d = _decompressor(self._kind)
+                out.append(self._d.decompress(data))
+                data = self._d.unused_data if self._d.eof else b''
+            out = b''.join(out)
+            if out:
+                return out
+        return b''
+
+
+class DecompressingReader(io.RawIOBase):
+    """A compressed file, read as its decompressed data (see open_binary())"""
+
+    def __init__(self, path, kind):
+        super().__init__()
+        self._raw = open(path, 'rb')
+        self._decoder = _Decoder(self._raw, kind)
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            data = self._decoder.read()
+            if not data:
+                return 0
+            self._pending = memoryview(data)
+
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def compressed_tell(self):
+        """How much of the compressed file has been read"""
+        return self._decoder.pos
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def open_binary(path):
+    """Open a file for reading in binary mode, decompressing it if it's compressed"""
+    kind = compression(path)
+    if kind is None:
+        return open(path, 'rb')
+    return io.BufferedReader(DecompressingReader(path, kind))
+
+
+def disk_position(f):
+    """How far into the file on disk a file opened by open_binary() (or a text file around one) has read"""
+    buffer = getattr(f, 'buffer', f)
+    raw = getattr(buffer, 'raw', None)
+    if isinstance(raw, DecompressingReader):
+        return raw.compressed_tell()
+    return buffer.tell()
+
+
+class CompressedBuffer:
+    """
+    The decompressed data of a compressed file, with random access to it
+    (sliced like a read-only mmap of the data, and with find() and
+    rfind()). Only the part of the data that has been decompressed so far
+    can be accessed: `size` grows as extend() is called, until `eof`.
+    """
+
+    def __init__(self, path, kind=None, checkpoint_bytes=CHECKPOINT_BYTES):
+        self._raw = open(path, 'rb')
+        self._kind = kind or compression(path)
+        self._checkpoint_bytes = checkpoint_bytes
+
+        # (decompressed offset, file offset, decompressor state), in order
+        self._checkpoints = [(0, 0, None)]
+        self._end = None
+        self._prefix = b''
+        if self._kind == XZ:
+            index = _xz_blocks(self._raw)
+            if index is not None:
+                blocks, self._end, _ = index
+                self._checkpoints = [(out, raw, None) for out, raw in blocks] or self._checkpoints
+                self._raw.seek(0)
+                self._prefix = self._raw.read(_XZ_HEADER_BYTES)
+
+        self._offsets = [cp[0] for cp in self._checkpoints]
+        # the decompressor that extend() continues with
+        self._decoder = _Decoder(self._raw, self._kind)
+
+        self.size = 0
+        self.eof = False
+
+        # (offset, data) of the end of what has been decompressed, and of
+        # the latest random read
+        self._tail = (0, b'')
+        self._window = (0, b'')
+
+    def close(self):
+        self._raw.close()
+        self._tail = self._window = (0, b'')
+
+    def reader(self):
+        """
+        Another buffer of the same data, for reading it from another
+        thread while this one goes on decompressing (see prefetch.py): it
+        reads the file through a handle of its own, starting from the
+        checkpoints this one finds. It can't be extended itself.
+        """
+        other = copy.copy(self)
+        other._raw = open(self._raw.name, 'rb')
+        other._decoder = None
+        other._tail = other._window = (0, b'')
+        # (it's only asked for data that has been decompressed here)
+        other.size = sys.maxsize
+        return other
+
+    def extend(self, nbytes):
+        """
+        Decompress (about) `nbytes` more of the data.
+
+        :return: True if there was more
+        """
+        if self.eof:
+            return False
+
+        target = self.size + nbytes
+        parts = []
+        while self.size < target:
+            data = self._decoder.read()
+            if not data:
+                self.eof = True
+                break
+            parts.append(data)
+            self.size += len(data)
+
+            if (self._kind == GZIP
+                    and self.size - self._checkpoints[-1][0] >= self._checkpoint_bytes):
+                self._checkpoints.append((self.size, self._decoder.pos, self._decoder.state()))
+                self._offsets.append(self.size)
+
+        if not parts:
+            return False
+
+        new = b''.join(parts)
+        kept = (self._tail[1] + new)[-max(TAIL_BYTES, len(new)):]
+        self._tail = (self.size - len(kept), kept)
+        return True
+
+    def _read(self, start, stop):
+        """Decompress the data in [start, stop) from the nearest checkpoint before it"""
+        out, pos, state = self._checkpoints[bisect_right(self._offsets, start) - 1]
+
+        if self._kind == XZ and self._end is not None:
+            decoder = _Decoder(self._raw, XZ, pos, prefix=self._prefix, end=self._end)
+        else:
+            decoder = _Decoder(self._raw, self._kind, pos, state and state.copy())
+
+        # (and some of what follows, for the next reads)
+        stop = min(max(stop, start + WINDOW_BYTES), self.size)
+        parts = []
+        while out < stop:
+            data = decoder.read()
+            if not data:
+                break
+            end = out + len(data)
+            if end > start:
+                parts.append(data[max(0, start - out):stop - out])
+            out = end
+
+        self._window = (start, b''.join(parts))
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.size)
+        if start >= stop:
+            return b''
+
+        for wstart, data in (self._tail, self._window):
+            if wstart <= start and stop <= wstart + len(data):
+                return data[start - wstart:stop - wstart]
+
+        self._read(start, stop)
+        wstart, data = self._window
+        return data[start - wstart:stop - wstart]
+
+    def find(self, sub, start=0, end=None):
+        end = self.size if end is None else min(end, self.size)
+        i = self[start:end].find(sub)
+        return i if i < 0 else start + i
+
+    def rfind(self, sub, start=0, end=None):
+        end = self.size if end is None else min(end, self.size)
+        i = self[start:end].rfind(sub)
+        return i if i < 0 else start + i
+
+
+def compressing_writer(f, kind):
+    """
+    Wrap binary file `f` in a file that compresses what's written to it.
+    Closing the wrapper finishes the compressed data, but leaves `f` open.
+    """
+    if kind == GZIP:
+        return gzip.GzipFile(fileobj=f, mode='wb')
+    if kind == BZIP2:
+        return bz2.BZ2File(f, 'wb')
+    if kind == XZ:
+        return lzma.LZMAFile(f, 'wb')
+    return _zstandard().ZstdCompressor().stream_writer(f, closefd=False)
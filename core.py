@@ -0,0 +1,173 @@
+"""
+The parts of reading a csv file that don't need Qt: working out its
+format, and reading its records (into a ColumnStore, or one at a time).
+Used by CSVTableModel and by the command-line tools (see quicsv.py).
+"""
+
+import csv
+import io
+import locale
+from itertools import chain, islice
+
+import tokenizer
+from charset import RAW_ENCODING, bom_length
+from compressed import open_binary
+from sniff import sniff_file
+from store import ColumnStore
+
+
+class BadSniffException(Exception):
+    """Raised when the csv sniffer fails to determine the dialect of a file"""
+
+
+def detect_format(csvfile, delims=None, cache=None, encoding=None):
+    """
+    Work out the format of a csv file: take it from `cache` (a
+    DialectCache) if the file is in there, or else sniff it from samples
+    of the file (and remember it in the cache).
+
+    :param delims: if given, the delimiters to choose from; the cache is
+        not consulted then
+    :param encoding: the encoding of the file (see charset.detect_encoding())
+    :return: tuple of the dialect, whether the file has a header, the
+        number of lines to skip before the header (or first row), and
+        whether the format came from the cache
+    :raises BadSniffException: if the delimiter could not be determined
+    """
+    if cache is not None and not delims:
+        cached = cache.get(csvfile)
+        if cached:
+            return (*cached, True)
+
+    try:
+        dialect, header, skip = sniff_file(csvfile, delims, encoding)
+    except csv.Error as csve:
+        if csve.args[0] == "Could not determine delimiter":
+            # "aligned" files might sometimes cause this, though often
+            # it's due to using odd "quote" characters (like balanced
+            # braces { ... } ) to contain arbitrary text--possibly
+            # including the delimiter, any number of times.
+            raise BadSniffException(str(csve)) from None
+        raise
+
+    if cache is not None:
+        cache.put(csvfile, dialect, header, skip)
+    return dialect, header, skip, False
+
+
+def generic_headers(ncols):
+    """Header names for a table without a header"""
+    return ["Column {}".format(i+1) for i in range(ncols)]
+
+
+def open_records(csvfile, dialect, skip=0, encoding=None, raw=False):
+    """
+    Open a csv file for reading, skipping the first `skip` lines. A
+    compressed file is decompressed as it's read.
+
+    :param raw: read the records as raw text (see charset.py), which
+        `encoding` has to be a byte-level encoding for
+    :return: the (text) file and a csv.reader of its records (or a
+        tokenizer.Reader, for a format the csv module can't read)
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    binary = open_binary(csvfile)
+    if raw:
+        binary.read(bom_length(binary.peek(4), encoding))
+        encoding = RAW_ENCODING
+    # (bytes that aren't valid in the encoding are kept, as surrogates)
+    f = io.TextIOWrapper(binary, encoding=encoding, errors='surrogateescape', newline='')
+    try:
+        for _ in range(skip):
+            f.readline()
+        return f, tokenizer.reader(f, dialect)
+    except:
+        f.close()
+        raise
+
+
+def guess_line_terminator(csvfile, sample_bytes=64 * 1024):
+    """Guess the line terminator used by a file from its first lines"""
+    with open_binary(csvfile) as f:
+        sample = f.read(sample_bytes)
+    nl = sample.find(b'\n')
+    if nl < 0:
+        return '\r\n'
+    return '\r\n' if nl and sample[nl-1:nl] == b'\r' else '\n'
+
+
+def read_table(reader, header, limit=None, codec=None, keep_blank=False):
+    """
+    Read the rows from `reader` into a new ColumnStore. Rows with more
+    fields than the header (or first row) add columns, with generic
+    header names; the short, long and blank rows are counted in the
+    store's `report` as they're read.
+
+    :param limit: if given, stop after reading this many rows
+    :param codec: for a reader of raw text, the CellCodec to decode it
+        with; the store keeps the cells raw
+    :param keep_blank: keep blank rows as rows (without any fields),
+        rather than skipping them
+    :return: the store and the list of header names
+    """
+    rows = iter(reader)
+
+    # (blank lines before the table are always skipped)
+    first_row = next(filter(None, rows), None)
+    if first_row is None:
+        # no data
+        return ColumnStore(codec=codec, keep_blank=keep_blank), []
+
+    if header:
+        # copy the header names
+        headers = codec.decode_all(first_row) if codec else first_row
+        store = ColumnStore(len(headers), codec, keep_blank)
+    else:
+        headers = []
+        store = ColumnStore(len(first_row), codec, keep_blank)
+        store.append_row(first_row)
+
+    store.extend(islice(rows, limit))
+    # (a bigger table has done this after its first rows)
+    store.infer_types()
+
+    return store, widen_headers(headers, store.ncols)
+
+
+def widen_headers(headers, ncols):
+    """`headers`, with generic names added for the columns past their end, up to `ncols`"""
+    return headers + generic_headers(ncols)[len(headers):]
+
+
+class RecordStream:
+    """
+    Iterate over the rows of a csv file one at a time (skipping blank
+    ones), so that a file of any size is read in constant memory. The
+    header names (or generic ones) are available from `headers` as soon
+    as the stream is opened.
+    """
+
+    def __init__(self, csvfile, dialect, header=False, skip=0, encoding=None):
+        self._file, reader = open_records(csvfile, dialect, skip, encoding)
+        self._rows = filter(None, reader)
+
+        first_row = next(self._rows, None)
+        if first_row is None:
+            self.headers = []
+        elif header:
+            self.headers = first_row
+        else:
+            self.headers = generic_headers(len(first_row))
+            self._rows = chain([first_row], self._rows)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self._rows
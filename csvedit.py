@@ -1,13 +1,20 @@
+import csv
+import time
 from pathlib import PurePath
 from csv import Error as csvError
 
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import QSettings, QSize
-from PyQt5.QtWidgets import QAction, QMessageBox
+from PyQt5.QtCore import Qt, QItemSelection, QItemSelectionModel, QMimeData, QSettings, QSize
+from PyQt5.QtWidgets import QAction, QMessageBox, QProgressBar, QToolButton
 from PyQt5.QtGui import QIcon, QKeySequence
 
-from model import CSVTableModel, BadSniffException
+from colwidth import ColumnWidths
+from coltypes import TYPES
+from core import BadSniffException
+from model import CSVTableModel
 from dlg_format import CSVFormatDialog
+from findbar import FindBar
+from statspanel import StatsPanel
 
 VENDOR="kf4btg"
 APPNAME="QuiCSV"
@@ -23,12 +30,50 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.tableview = QtWidgets.QTableView(self)
         self.tableview.setModel(CSVTableModel(self.tableview))
+        # the model keeps track of whether the data has been changed
+        # since it was loaded or saved (undoing changes can take it back)
+        self.tableview.model().cleanChanged.connect(self._on_clean_changed)
+        self.tableview.model().undoStateChanged.connect(self._update_undo_actions)
+
+        self.tableview.selectionModel().selectionChanged.connect(self._update_clipboard_actions)
+        QtWidgets.QApplication.clipboard().dataChanged.connect(self._update_clipboard_actions)
+
+        # clicking a header sorts by that column (the model does the
+        # sorting; start out unsorted)
+        self.tableview.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.tableview.setSortingEnabled(True)
+
+        # right-clicking a header allows changing the type of the column
+        self.tableview.horizontalHeader().setContextMenuPolicy(Qt.CustomContextMenu)
+        self.tableview.horizontalHeader().customContextMenuRequested.connect(self._header_menu)
+
+        # sizes the columns from a sample of the rows
+        self.column_widths = ColumnWidths(self.tableview)
+
+        # big files are read ahead of where the table is scrolled, in
+        # the background
+        self.tableview.model().watch_view(self.tableview)
+
+        # (when following a file, the view keeps to the newest rows if it
+        # was scrolled to the end)
+        self._at_end = False
+        self.tableview.model().rowsAboutToBeInserted.connect(self._before_rows_inserted)
+        self.tableview.model().rowsInserted.connect(self._after_rows_inserted)
 
         self.setCentralWidget(self.tableview)
 
+        self.find_bar = FindBar(self.tableview, self)
+        self.addToolBar(Qt.BottomToolBarArea, self.find_bar)
+        self.find_bar.hide()
+
+        self.stats_panel = StatsPanel(self.tableview, self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.stats_panel)
+        self.stats_panel.hide()
+
         self._create_actions()
         self._create_menus()
         self._create_toolbars()
+        self._create_statusbar()
 
         self.read_settings()
 
@@ -54,10 +99,37 @@ class MainWindow(QtWidgets.QMainWindow):
                 self._load(filename)
 
     def save(self):
-        print("save()")
+        if not self._currfile:
+            return self.saveas()
+        return self._save(self._currfile)
 
     def saveas(self):
-        print("saveas()")
+        filename, _ = QtWidgets.QFileDialog(
+            ).getSaveFileName(self, filter="Comma Separated Values files [csv] (*.csv);;"
+                                           "All files (*)")
+        if filename:
+            return self._save(filename)
+        return False
+
+    def _save(self, filename):
+        """Write the table to the given file"""
+
+        print(f"save({filename})")
+
+        try:
+            saved = self.tableview.model().save_csv(filename)
+        except (IOError, csvError) as e:
+            QMessageBox.critical(self, APPNAME,
+                                 f"The file could not be saved:\n{e}")
+            return False
+
+        if not saved:
+            QMessageBox.information(self, APPNAME,
+                                    "Please wait until the file has finished loading.")
+            return False
+
+        self._set_document(filename, resize=False)
+        return True
 
     # @property
     # def is_modified(self):
@@ -84,9 +156,12 @@ class MainWindow(QtWidgets.QMainWindow):
 
         print(f"load({filename})")
 
+        # (a new file starts out unsorted)
+        self.tableview.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+
         # first, attempt to figure out the format automatically:
         try:
-            self.tableview.model().load_csv(filename)
+            self.tableview.model().load_csv(filename, background=True)
             self._set_document(filename)
         except BadSniffException:
             # if that fails, let the user define the format manually
@@ -96,7 +171,15 @@ class MainWindow(QtWidgets.QMainWindow):
                                              "The structure of the CSV file could not be determined automatically. "
                                              "Please use the following dialog to specify the parameters of the file.")
 
-            fmt_dialog = CSVFormatDialog(self)
+            # start from the last format that was chosen by hand (if
+            # there's a cache to remember it)
+            cache = self.tableview.model().dialect_cache
+            last = cache.last_manual() if cache is not None else None
+            if last:
+                dialect, header, skip = last
+                fmt_dialog = CSVFormatDialog(self, dialect=dialect, header=header, skiplines=skip)
+            else:
+                fmt_dialog = CSVFormatDialog(self)
 
             if fmt_dialog.exec_() == fmt_dialog.Accepted:
                 # cd = fmt_dialog.mdialect
@@ -107,16 +190,177 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.tableview.model().load_csv_manual(filename,
                                                        fmt_dialog.mdialect,
                                                        fmt_dialog.header,
-                                                       fmt_dialog.skiplines)
+                                                       fmt_dialog.skiplines,
+                                                       background=True)
 
                 self._set_document(filename)
 
-    def _set_document(self, filename, set_modified=False):
-        self.tableview.resizeColumnsToContents()
+    def filter_column(self):
+        """Ask for a filter condition for the current column"""
+        model = self.tableview.model()
+        column = self.tableview.currentIndex().column()
+        if column < 0:
+            return
+
+        name = model.headerData(column, Qt.Horizontal)
+        condition, ok = QtWidgets.QInputDialog.getText(
+            self, "Filter Rows",
+            f"Show the rows where \"{name}\" ({model.column_type(column)}) matches:\n"
+            "(text to look for, or =, !=, <, <=, >, >= and a value; empty to remove the filter)",
+            text=model.filter_condition(column))
+        if not ok:
+            return
+
+        try:
+            model.set_filter(column, condition)
+        except ValueError as e:
+            QMessageBox.warning(self, APPNAME, f"Invalid filter:\n{e}")
+            return
+
+        self.statusBar().showMessage(f"Showing {model.rowCount()} rows", 5000)
+
+    def _selected_range(self):
+        """
+        :return: (top, left, bottom, right) of the selected cells (taken
+            as a single rectangle), or None
+        """
+        ranges = self.tableview.selectionModel().selection()
+        if not ranges.isEmpty():
+            return (min(r.top() for r in ranges), min(r.left() for r in ranges),
+                    max(r.bottom() for r in ranges), max(r.right() for r in ranges))
+
+        current = self.tableview.currentIndex()
+        if current.isValid():
+            return current.row(), current.column(), current.row(), current.column()
+        return None
+
+    def copy(self):
+        """Put the selected cells on the clipboard, as tab-separated (and csv) text"""
+        selected = self._selected_range()
+        if selected is None:
+            return False
+
+        model = self.tableview.model()
+        mime = QMimeData()
+        mime.setText(model.copy_text(*selected))
+        mime.setData("text/csv", model.copy_text(*selected, dialect=csv.excel).encode())
+        QtWidgets.QApplication.clipboard().setMimeData(mime)
+        return True
+
+    def cut(self):
+        if self.copy():
+            self.tableview.model().clear_cells(*self._selected_range(), text="Cut")
+
+    def paste(self):
+        """Paste the clipboard into the table, starting at the top-left selected cell"""
+        selected = self._selected_range()
+        mime = QtWidgets.QApplication.clipboard().mimeData()
+        if selected is None or mime is None:
+            return
+
+        if mime.hasText():
+            text, dialect = mime.text(), csv.excel_tab
+        elif mime.hasFormat("text/csv"):
+            text, dialect = bytes(mime.data("text/csv")).decode(), csv.excel
+        else:
+            return
+
+        top, left, bottom, right = selected
+        model = self.tableview.model()
+        pasted = model.paste_text(top, left, text, dialect, bottom, right)
+        if pasted is not None:
+            # select what was pasted
+            self.tableview.selectionModel().select(
+                QItemSelection(model.index(top, left), model.index(*pasted)),
+                QItemSelectionModel.ClearAndSelect)
+
+    def insert_row(self):
+        """Insert an empty row above the current one (or at the top)"""
+        current = self.tableview.currentIndex()
+        row = max(current.row(), 0)
+        model = self.tableview.model()
+        if model.insertRows(row, 1):
+            self.tableview.setCurrentIndex(model.index(row, max(current.column(), 0)))
+
+    def remove_rows(self):
+        """Remove the rows of the selected cells"""
+        selected = self._selected_range()
+        if selected is not None:
+            top, _, bottom, _ = selected
+            self.tableview.model().removeRows(top, bottom - top + 1)
+
+    def insert_column(self):
+        """Insert an empty column left of the current one (or at the left)"""
+        current = self.tableview.currentIndex()
+        column = max(current.column(), 0)
+        model = self.tableview.model()
+        if model.insertColumns(column, 1):
+            self.tableview.setCurrentIndex(model.index(max(current.row(), 0), column))
+
+    def remove_columns(self):
+        """Remove the columns of the selected cells"""
+        selected = self._selected_range()
+        if selected is not None:
+            _, left, _, right = selected
+            self.tableview.model().removeColumns(left, right - left + 1)
+
+    def _update_clipboard_actions(self, *args):
+        selected = self._selected_range() is not None
+        self.action_copy.setEnabled(selected)
+        self.action_cut.setEnabled(selected)
+        self.action_remove_rows.setEnabled(selected)
+        self.action_remove_columns.setEnabled(selected)
+
+        mime = QtWidgets.QApplication.clipboard().mimeData()
+        self.action_paste.setEnabled(selected and mime is not None
+                                     and (mime.hasText() or mime.hasFormat("text/csv")))
+
+    def _header_menu(self, pos):
+        header = self.tableview.horizontalHeader()
+        column = header.logicalIndexAt(pos)
+        if column < 0:
+            return
+
+        model = self.tableview.model()
+        current = model.column_type(column)
+
+        menu = QtWidgets.QMenu(self)
+        types = menu.addMenu("Column &Type")
+        for ctype in TYPES:
+            action = types.addAction(ctype)
+            action.setCheckable(True)
+            action.setChecked(ctype == current)
+            action.setData(ctype)
+
+        chosen = menu.exec_(header.mapToGlobal(pos))
+        if chosen is None or chosen.data() in (None, current):
+            return
+
+        try:
+            model.set_column_type(column, chosen.data())
+        except ValueError as e:
+            QMessageBox.warning(self, APPNAME, f"The type of the column could not be changed:\n{e}")
+
+    def _on_clean_changed(self, clean):
+        self.modified = not clean
+
+    def _update_undo_actions(self):
+        model = self.tableview.model()
+        self.action_undo.setEnabled(model.can_undo())
+        self.action_undo.setText(f"&Undo {model.undo_text()}".rstrip())
+        self.action_redo.setEnabled(model.can_redo())
+        self.action_redo.setText(f"&Redo {model.redo_text()}".rstrip())
+
+    def _set_document(self, filename, set_modified=False, resize=True):
+        if resize:
+            self.column_widths.fit()
 
         self._currfile = filename
         self.modified = set_modified
 
+        self.action_save.setEnabled(True)
+        self.action_saveas.setEnabled(True)
+
         if self._currfile:
             self._display_name = PurePath(filename).name
         else:
@@ -124,6 +368,70 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.setWindowTitle(f"{self._display_name}[*]")
 
+    def _on_load_progress(self, done, total):
+        # (scaled, since the byte counts may not fit in an int)
+        self.load_progress.setValue(int(1000 * done / total) if total else 1000)
+        self.load_progress.show()
+        self.load_cancel.show()
+
+    def _on_load_finished(self, cancelled):
+        # (the message is shown by _on_load_stats)
+        self.load_progress.hide()
+        self.load_cancel.hide()
+
+    def _on_load_stats(self, stats):
+        # time painting the new contents, too
+        start = time.perf_counter()
+        self.tableview.viewport().repaint()
+        stats.add_time("paint", time.perf_counter() - start)
+
+        seconds = stats.times.get("total", 0)
+        if stats.cancelled:
+            message = f"Loading cancelled after {stats.rows} rows"
+        else:
+            message = f"Loaded {stats.rows} rows"
+        self.statusBar().showMessage(
+            f"{message} in {seconds:.2f} s ({stats.rows_per_second:,.0f} rows/s)", 5000)
+        self.action_load_stats.setEnabled(True)
+        self.action_row_report.setEnabled(True)
+
+    def show_load_stats(self):
+        model = self.tableview.model()
+        stats = model.load_stats
+        if stats is not None:
+            lines = stats.summary()
+            hits, misses = model.prefetch_counts
+            if hits or misses:
+                lines.append(f"Rows read ahead of scrolling: {hits:,} of {hits + misses:,} "
+                             f"({100 * hits / (hits + misses):.0f}%)")
+            QMessageBox.information(self, "Load Statistics", "\n".join(lines))
+
+    def show_row_report(self):
+        report = self.tableview.model().scan_report
+        QMessageBox.information(self, "Row Report", "\n".join(report.summary()))
+
+    def _before_rows_inserted(self, *args):
+        bar = self.tableview.verticalScrollBar()
+        self._at_end = bar.value() == bar.maximum()
+
+    def _after_rows_inserted(self, *args):
+        if self._at_end and self.tableview.model().following:
+            self.tableview.scrollToBottom()
+
+    def _on_follow_reloaded(self, reason):
+        self.statusBar().showMessage(f"The file was {reason}; reading it again", 5000)
+
+    def _on_following_changed(self, following):
+        if following != self.action_follow.isChecked():
+            if not following:
+                self.statusBar().showMessage(
+                    "Not following the file: its rows have been rearranged", 5000)
+            self.action_follow.setChecked(following)
+
+    def _on_load_error(self, message):
+        QMessageBox.warning(self, APPNAME,
+                            f"The file could not be read completely:\n{message}")
+
     # region setup
 
     # noinspection PyArgumentList
@@ -160,30 +468,95 @@ class MainWindow(QtWidgets.QMainWindow):
 
         ## edit actions
 
+        self.action_undo = QAction(icon("edit-undo"),
+                                   "&Undo", self,
+                                   shortcut=qks.Undo,
+                                   triggered=self.tableview.model().undo)
+
+        self.action_redo = QAction(icon("edit-redo"),
+                                   "&Redo", self,
+                                   shortcut=qks.Redo,
+                                   triggered=self.tableview.model().redo)
+
         self.action_copy = QAction(icon("edit-copy"),
                                    "&Copy", self,
                                    shortcut=qks.Copy,
-                                   triggered=dummy)
+                                   triggered=self.copy)
 
         self.action_cut = QAction(icon("edit-cut"),
                                   "Cu&t", self,
                                   shortcut=qks.Cut,
-                                  triggered=dummy)
+                                  triggered=self.cut)
 
         self.action_paste = QAction(icon("edit-paste"),
                                     "&Paste", self,
                                     shortcut=qks.Paste,
-                                    triggered=dummy)
+                                    triggered=self.paste)
+
+        self.action_insert_row = QAction("&Insert Row", self,
+                                         triggered=self.insert_row)
+
+        self.action_remove_rows = QAction("Re&move Rows", self,
+                                          triggered=self.remove_rows)
+
+        self.action_insert_column = QAction("Insert C&olumn", self,
+                                            triggered=self.insert_column)
+
+        self.action_remove_columns = QAction("Remove Co&lumns", self,
+                                             triggered=self.remove_columns)
+
+        ## find actions
+
+        self.action_find = QAction(icon("edit-find"),
+                                   "&Find...", self,
+                                   shortcut=qks.Find,
+                                   triggered=self.find_bar.activate)
+
+        self.action_find_next = QAction("Find &Next", self,
+                                        shortcut=qks.FindNext,
+                                        triggered=self.find_bar.find_next)
+
+        self.action_find_previous = QAction("Find Pre&vious", self,
+                                            shortcut=qks.FindPrevious,
+                                            triggered=self.find_bar.find_previous)
+
+        ## view actions
+
+        self.action_filter = QAction(icon("view-filter"),
+                                     "&Filter Column...", self,
+                                     shortcut="Ctrl+Shift+F",
+                                     triggered=self.filter_column)
+
+        self.action_clear_filters = QAction("&Clear Filters", self,
+                                            triggered=self.tableview.model().clear_filters)
+
+        self.action_follow = QAction(icon("media-playback-start"),
+                                     "F&ollow File", self,
+                                     checkable=True,
+                                     toolTip="Show the rows appended to the file as they're written",
+                                     toggled=self.tableview.model().set_following)
+
+        self.action_load_stats = QAction("Load &Statistics...", self,
+                                         triggered=self.show_load_stats)
+        self.action_row_report = QAction("&Row Report...", self,
+                                         triggered=self.show_row_report)
+
+        self.action_stats = self.stats_panel.toggleViewAction()
+        self.action_stats.setText("Column S&tatistics")
 
         ## disable some actions at application start
 
         for a in (self.action_save, self.action_saveas,
-                  self.action_copy, self.action_cut, self.action_paste):
+                  self.action_undo, self.action_redo,
+                  self.action_copy, self.action_cut, self.action_paste,
+                  self.action_remove_rows, self.action_remove_columns,
+                  self.action_load_stats, self.action_row_report):
             a.setEnabled(False)
 
     def _create_menus(self):
         self.menu_file : QtWidgets.QMenu = self.menuBar().addMenu("&File")
         self.menu_edit : QtWidgets.QMenu = self.menuBar().addMenu("&Edit")
+        self.menu_view : QtWidgets.QMenu = self.menuBar().addMenu("&View")
 
         self.menu_file.addAction(self.action_new)
         self.menu_file.addAction(self.action_open)
@@ -192,9 +565,29 @@ class MainWindow(QtWidgets.QMainWindow):
         self.menu_file.addSeparator()
         self.menu_file.addAction(self.action_quit)
 
+        self.menu_edit.addAction(self.action_undo)
+        self.menu_edit.addAction(self.action_redo)
+        self.menu_edit.addSeparator()
         self.menu_edit.addAction(self.action_cut)
         self.menu_edit.addAction(self.action_copy)
         self.menu_edit.addAction(self.action_paste)
+        self.menu_edit.addSeparator()
+        self.menu_edit.addAction(self.action_insert_row)
+        self.menu_edit.addAction(self.action_remove_rows)
+        self.menu_edit.addAction(self.action_insert_column)
+        self.menu_edit.addAction(self.action_remove_columns)
+        self.menu_edit.addSeparator()
+        self.menu_edit.addAction(self.action_find)
+        self.menu_edit.addAction(self.action_find_next)
+        self.menu_edit.addAction(self.action_find_previous)
+
+        self.menu_view.addAction(self.action_filter)
+        self.menu_view.addAction(self.action_clear_filters)
+        self.menu_view.addAction(self.action_stats)
+        self.menu_view.addSeparator()
+        self.menu_view.addAction(self.action_follow)
+        self.menu_view.addAction(self.action_load_stats)
+        self.menu_view.addAction(self.action_row_report)
 
     def _create_toolbars(self):
         self.toolbar_file : QtWidgets.QToolBar = self.addToolBar("File")
@@ -204,11 +597,38 @@ class MainWindow(QtWidgets.QMainWindow):
         self.toolbar_file.addAction(self.action_open)
         self.toolbar_file.addAction(self.action_save)
 
+        self.toolbar_edit.addAction(self.action_undo)
+        self.toolbar_edit.addAction(self.action_redo)
         self.toolbar_edit.addAction(self.action_cut)
         self.toolbar_edit.addAction(self.action_copy)
         self.toolbar_edit.addAction(self.action_paste)
 
 
+    def _create_statusbar(self):
+        model = self.tableview.model()
+
+        self.load_progress = QProgressBar(self, maximum=1000, textVisible=False)
+        self.load_progress.setMaximumWidth(200)
+
+        self.load_cancel = QToolButton(self,
+                                       icon=QIcon().fromTheme("process-stop"),
+                                       text="Cancel",
+                                       toolTip="Stop loading the file")
+        self.load_cancel.clicked.connect(model.cancel_load)
+
+        for w in (self.load_progress, self.load_cancel):
+            self.statusBar().addPermanentWidget(w)
+            w.hide()
+
+        model.loadProgress.connect(self._on_load_progress)
+        model.loadFinished.connect(self._on_load_finished)
+        model.loadError.connect(self._on_load_error)
+        model.loadStats.connect(self._on_load_stats)
+        model.followReloaded.connect(self._on_follow_reloaded)
+        model.followingChanged.connect(self._on_following_changed)
+
+        self.find_bar.message.connect(lambda msg: self.statusBar().showMessage(msg, 5000))
+
     def read_settings(self):
         settings = QSettings(VENDOR, APPNAME)
         pos = settings.value("pos")
@@ -231,6 +651,7 @@ class MainWindow(QtWidgets.QMainWindow):
         to write application settings.
         """
         if self.check_modified():
+            self.tableview.model().cancel_load()
             self.write_settings()
             event.accept()
         else:
@@ -238,9 +659,6 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
-def dummy():
-    print("triggered")
-
 def main():
     import sys
     from PyQt5.QtWidgets import QApplication
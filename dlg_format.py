@@ -3,7 +3,14 @@ from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QDialog, QLabel, QLineEdit, QFormLayout, QDialogButtonBox, QCheckBox, QComboBox, QSpinBox
 import csv
 
-_fields = ["delim", "qchar", "echar", "lineterm", "quoting", "dblquote", "skipspace", "header", "skiplines"]
+from tokenizer import custom_dialect
+
+_fields = ["delim", "qchar", "cquote", "echar", "lineterm", "quoting", "dblquote", "skipspace", "header", "skiplines"]
+
+# the fields that only apply to the formats the csv module reads, not to
+# the ones the tokenizer does (a tokenizer.CustomDialect has no escape
+# character, quotes only when it has to and keeps spaces)
+_csv_fields = ["echar", "quoting", "skipspace"]
 
 # display text for QUOTE enum
 _quoting = {
@@ -16,16 +23,23 @@ _quoting = {
 _params = {
     "delim": {
         "label": "Delimiter",
-        "tip": "The field delimeter for the file",
+        "tip": "The field delimeter for the file (can be several characters, like ||)",
         "type": str,
         "default": ","
     },
     "qchar": {
         "label":"Quote",
-        "tip":"The quoting character for the file",
+        "tip":"The quoting character for the file (can be several characters, like <<)",
         "type": str,
         "default":'"'
     },
+    "cquote": {
+        "label": "Close Quote",
+        "tip": "The closing quote, if it's not the same as the opening one (like } for {); "
+               "quotes like that can be nested",
+        "type": str,
+        "default": ""
+    },
     "echar": {
         "label": "Escape",
         "tip": "Used to escape other special characters",
@@ -78,10 +92,15 @@ _params = {
 
 class CSVFormatDialog(QDialog):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, dialect=None, header=False, skiplines=0, **kwargs):
+        """
+        :param dict dialect: formatting parameters to show initially (as
+            returned by sniff.dialect_params()), e.g. those of the last
+            choice; fields that aren't given show their default
+        """
         super().__init__(*args, **kwargs)
 
-        # TODO: remember last choice for all fields
+        # (the last choice is remembered by the DialectCache, and passed in)
 
         # self._defaults = {
         #     "delim": ',',
@@ -101,8 +120,8 @@ class CSVFormatDialog(QDialog):
 
         # self.delimiter = self._defaults["delim"]
 
-        # TODO: allow and handle setting the quote char to balanced characters, like "{}" or "<<>>"
-        # ( this will require a custom dialect sublcass...and probably a custom reader/writer, too)
+        # quotes and delimiters that the csv module can't handle (like
+        # "{" and "}", or "<<" and ">>") make a tokenizer.CustomDialect
         # self.quotechar = self._defaults["qchar"]
 
         self._labels = dict.fromkeys(_fields)
@@ -114,6 +133,9 @@ class CSVFormatDialog(QDialog):
 
         self._setup_UI()
 
+        if dialect:
+            self._set_values(dialect, header, skiplines)
+        self._update_enabled()
 
     def _setup_UI(self):
         self._layout = QFormLayout(self)
@@ -193,6 +215,46 @@ class CSVFormatDialog(QDialog):
         self._buttonBox.accepted.connect(self.accept)
         self._buttonBox.rejected.connect(self.reject)
 
+        for f in ("delim", "qchar", "cquote"):
+            fields[f].textChanged.connect(self._update_enabled)
+
+    def _update_enabled(self):
+        """Disable the fields that don't apply to the format entered"""
+        fields = self._fields
+        custom = custom_dialect(fields["delim"].text(), fields["qchar"].text(),
+                                fields["cquote"].text()) is not None
+        for f in _csv_fields:
+            tip = _params[f]["tip"]
+            if custom:
+                tip += " (not used with a delimiter or quote like this one)"
+            for w in (self._labels[f], fields[f]):
+                w.setEnabled(not custom)
+                w.setToolTip(tip)
+
+
+    def _set_values(self, dialect, header, skiplines):
+        """Show the given dialect parameters in the fields"""
+        fields = self._fields
+
+        for f, param in (("delim", "delimiter"),
+                         ("qchar", "quotechar"),
+                         ("cquote", "closequote"),
+                         ("echar", "escapechar")):
+            if param in dialect:
+                fields[f].setText(dialect[param] or "")
+
+        if "quoting" in dialect:
+            idx = fields["quoting"].findData(dialect["quoting"])
+            if idx >= 0:
+                fields["quoting"].setCurrentIndex(idx)
+
+        for f, param in (("dblquote", "doublequote"),
+                         ("skipspace", "skipinitialspace")):
+            if param in dialect:
+                fields[f].setChecked(dialect[param])
+
+        fields["header"].setChecked(header)
+        fields["skiplines"].setValue(skiplines)
 
     def accept(self):
 
@@ -230,7 +292,11 @@ class CSVFormatDialog(QDialog):
 
 
         # TODO: allow saving a custom-defined dialect for easy selection later
-        self.mdialect = mdialect
+        # (the tokenizer reads the formats the csv module can't; the fields
+        # it has no use for are disabled then, see _update_enabled())
+        self.mdialect = custom_dialect(mdialect.delimiter, self._fields["qchar"].text(),
+                                       self._fields["cquote"].text(),
+                                       mdialect.doublequote) or mdialect
 
         self.header = self._fields["header"].isChecked()
         self.skiplines = self._fields["skiplines"].value()
@@ -0,0 +1,120 @@
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QIcon, QKeySequence
+from PyQt5.QtWidgets import QToolBar, QLineEdit, QCheckBox, QAction
+
+
+class FindBar(QToolBar):
+    """
+    Tool bar for finding text in a table view (whose model must be a
+    CSVTableModel). Matches are taken one at a time from the iterator
+    returned by the model's find(), so finding the next one is instant.
+    """
+
+    # a message for the status bar
+    message = pyqtSignal(str)
+
+    def __init__(self, view, *args, **kwargs):
+        super().__init__("Find", *args, **kwargs)
+        self.setObjectName("toolbar_find")
+
+        self._view = view
+        # the matches still to visit, and the direction they go in
+        self._matches = None
+        self._backwards = False
+        # (row, column) of the current match
+        self._last = None
+
+        icon = QIcon().fromTheme
+
+        self.edit = QLineEdit(self, placeholderText="Find", clearButtonEnabled=True)
+        self.edit.setMaximumWidth(300)
+        self.edit.textChanged.connect(self._on_query_changed)
+        self.edit.returnPressed.connect(self.find_next)
+
+        self.case = QCheckBox("Match case", self)
+        self.case.toggled.connect(self._on_query_changed)
+
+        self.action_previous = QAction(icon("go-up"), "Previous", self,
+                                       toolTip="Find the previous match",
+                                       triggered=self.find_previous)
+        self.action_next = QAction(icon("go-down"), "Next", self,
+                                   toolTip="Find the next match",
+                                   triggered=self.find_next)
+        self.action_close = QAction(icon("window-close"), "Close", self,
+                                    shortcut=QKeySequence(Qt.Key_Escape),
+                                    shortcutContext=Qt.WidgetWithChildrenShortcut,
+                                    triggered=self.hide)
+
+        self.addWidget(self.edit)
+        self.addAction(self.action_previous)
+        self.addAction(self.action_next)
+        self.addWidget(self.case)
+        self.addSeparator()
+        self.addAction(self.action_close)
+
+        # any change to the table leaves the matches out of date
+        model = view.model()
+        for signal in (model.modelReset, model.layoutChanged, model.rowsInserted,
+                       model.rowsRemoved, model.columnsMoved):
+            signal.connect(self.reset)
+        model.dataChanged.connect(self._on_data_changed)
+
+    def reset(self):
+        """Forget the matches found so far; the next search starts afresh"""
+        self._matches = None
+
+    def activate(self):
+        """Show the bar, ready for typing"""
+        self.show()
+        self.edit.setFocus()
+        self.edit.selectAll()
+        self._on_query_changed()
+
+    def hideEvent(self, event):
+        self._view.model().set_highlight("")
+        super().hideEvent(event)
+
+    def _on_data_changed(self, topLeft, bottomRight, roles=()):
+        # (highlighting doesn't change the matches)
+        if list(roles) != [Qt.BackgroundRole]:
+            self.reset()
+
+    def _on_query_changed(self, *args):
+        self.reset()
+        self._view.model().set_highlight(self.edit.text(), self.case.isChecked())
+
+    def find_next(self):
+        self._find(False)
+
+    def find_previous(self):
+        self._find(True)
+
+    def _find(self, backwards):
+        text = self.edit.text()
+        if not text:
+            return
+
+        model = self._view.model()
+        current = self._view.currentIndex()
+        pos = (current.row(), current.column()) if current.isValid() else None
+
+        # start from the current cell if it was moved to by hand
+        if self._matches is None or backwards != self._backwards or pos != self._last:
+            self._matches = model.find(text, pos, self.case.isChecked(), backwards)
+            self._backwards = backwards
+
+        match = next(self._matches, None)
+        if match is None:
+            # been all the way around
+            self._matches = model.find(text, pos, self.case.isChecked(), backwards)
+            match = next(self._matches, None)
+
+        if match is None:
+            self._matches = None
+            self.message.emit(f'"{text}" was not found')
+            return
+
+        self._last = match
+        index = model.index(*match)
+        self._view.setCurrentIndex(index)
+        self._view.scrollTo(index)
@@ -0,0 +1,117 @@
+from itertools import islice
+
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
+
+from compressed import disk_position
+from store import ColumnChunk
+
+
+class RowBatches:
+    """
+    Read the remaining rows of a csv reader as a sequence of
+    (ColumnChunk, bytes read) pairs of up to `batch_rows` rows each.
+    """
+
+    def __init__(self, f, reader, ncols, batch_rows=20000, keep_blank=False,
+                 chunk_type=ColumnChunk):
+        """
+        :param f: the text file `reader` was created from; closed by
+            close()
+        :param reader: a csv.reader (or similar iterator of rows)
+        :param int ncols: number of columns in the table
+        :param keep_blank: see ColumnChunk.from_rows()
+        :param chunk_type: the class of the chunks, for a store that
+            takes another kind (see sqlstore.RowChunk)
+        """
+        self._file = f
+        self._reader = reader
+        self._ncols = ncols
+        self._batch_rows = batch_rows
+        self._keep_blank = keep_blank
+        self._chunk_type = chunk_type
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        rows = iter(self._reader)
+        while True:
+            chunk = self._chunk_type.from_rows(islice(rows, self._batch_rows), self._ncols,
+                                               self._keep_blank)
+            if not chunk.nrows and not chunk.blanks:
+                return
+            # (better here than in the GUI thread)
+            chunk.parse_numbers()
+            yield chunk, disk_position(self._file)
+
+
+class CSVLoader(QObject):
+    """
+    Worker that reads batches of rows from a source (a RowBatches or a
+    ParallelReader) and hands them back to the GUI thread. Meant to be
+    moved to a QThread (see start_loader()).
+    """
+
+    # a ColumnChunk
+    chunkReady = pyqtSignal(object)
+    # bytes read so far, total bytes
+    progress = pyqtSignal('qint64', 'qint64')
+    # True if the load was cancelled before the end of the file
+    finished = pyqtSignal(bool)
+    # message describing an error that stopped the load
+    error = pyqtSignal(str)
+
+    def __init__(self, source, total, *args, **kwargs):
+        """
+        :param source: iterable of (ColumnChunk, bytes read) pairs; the
+            loader takes ownership and will close() it when it is done
+        :param int total: size of the file in bytes, for progress updates
+        """
+        super().__init__(*args, **kwargs)
+
+        self._source = source
+        self._total = total
+        self._cancelled = False
+
+    def cancel(self):
+        """Stop reading at the end of the current batch. Thread-safe."""
+        self._cancelled = True
+
+    def run(self):
+        cancelled = False
+        try:
+            for chunk, pos in self._source:
+                if self._cancelled:
+                    cancelled = True
+                    break
+                self.chunkReady.emit(chunk)
+                self.progress.emit(pos, self._total)
+            else:
+                self.progress.emit(self._total, self._total)
+
+        # an exception escaping from here would take down the application;
+        # (this covers csv.Error, decoding errors, a broken process pool...)
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            self._source.close()
+            self.finished.emit(cancelled)
+
+
+def start_loader(loader):
+    """
+    Move `loader` to a new QThread and start it. The thread quits once
+    the loader is finished.
+
+    :return: the thread
+    """
+    thread = QThread()
+    loader.moveToThread(thread)
+
+    thread.started.connect(loader.run)
+    # (direct, so that the thread can be stopped while the GUI thread
+    # is blocked waiting for it)
+    loader.finished.connect(thread.quit, Qt.DirectConnection)
+
+    thread.start()
+    return thread
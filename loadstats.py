@@ -0,0 +1,154 @@
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # (there's no such module on Windows, where the memory isn't measured)
+    resource = None
+
+
+def current_rss():
+    """The resident memory of the process, in bytes (0 if it can't be measured)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    """The most resident memory the process has used, in bytes (0 if it can't be measured)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # (bytes on macOS, kilobytes elsewhere)
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoadStats:
+    """
+    Timings and sizes of the phases of loading a file: finding out its
+    format (sniff), reading and parsing it (parse), resetting the model
+    (reset) and, if a view reports it, painting it (paint). Times are in
+    seconds, sizes in bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file_bytes = os.path.getsize(path)
+        # how the file is read: "reader", "parallel", "lazy" or "sqlite"
+        self.method = None
+        self.background = False
+        # the encoding the file was read in
+        self.encoding = None
+        # True if the format came from the dialect cache (no sniffing),
+        # or the record offsets from an index file
+        self.cached_dialect = False
+        self.cached_index = False
+
+        self.bytes_read = 0
+        self.rows = 0
+        self.columns = 0
+        # rows with fewer or more fields than the header (or first row),
+        # and blank rows (see store.ScanReport)
+        self.short_rows = 0
+        self.long_rows = 0
+        self.blank_rows = 0
+
+        # phase -> seconds
+        self.times = {}
+        self.peak_rss = 0
+        # growth of the resident memory while loading
+        self.memory = 0
+        # True if a background load was cancelled
+        self.cancelled = False
+
+        self._start = time.perf_counter()
+        self._rss = current_rss()
+        self._phase = None
+
+    def start(self, phase):
+        """Start timing a phase (ending the one in progress)"""
+        self.end()
+        self._phase = (phase, time.perf_counter())
+
+    def add_time(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0) + seconds
+
+    def end(self):
+        """End the phase in progress, if any"""
+        if self._phase is not None:
+            phase, start = self._phase
+            self.add_time(phase, time.perf_counter() - start)
+            self._phase = None
+
+    def finish(self, rows, columns, bytes_read=None):
+        """Record the final sizes, once the file has been read"""
+        self.end()
+        self.rows = rows
+        self.columns = columns
+        self.bytes_read = self.file_bytes if bytes_read is None else bytes_read
+        self.times["total"] = time.perf_counter() - self._start
+        self.peak_rss = peak_rss()
+        self.memory = max(0, current_rss() - self._rss)
+
+    @property
+    def rows_per_second(self):
+        parse = self.times.get("parse")
+        return self.rows / parse if parse else 0
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "method": self.method,
+            "background": self.background,
+            "encoding": self.encoding,
+            "cached_dialect": self.cached_dialect,
+            "cached_index": self.cached_index,
+            "cancelled": self.cancelled,
+            "file_bytes": self.file_bytes,
+            "bytes_read": self.bytes_read,
+            "rows": self.rows,
+            "columns": self.columns,
+            "short_rows": self.short_rows,
+            "long_rows": self.long_rows,
+            "blank_rows": self.blank_rows,
+            "rows_per_second": self.rows_per_second,
+            "times": dict(self.times),
+            "peak_rss": self.peak_rss,
+            "memory": self.memory,
+        }
+
+    def log(self, path):
+        """Append the stats to a file, as a line of JSON"""
+        with open(path, "a") as f:
+            f.write(json.dumps(dict(self.as_dict(), time=time.time())) + "\n")
+
+    def summary(self):
+        """The stats as lines of text, for showing to the user"""
+        mb = 1024 * 1024
+        lines = [
+            f"File: {self.path}",
+            f"Read with: {self.method}" + (" (in the background)" if self.background else ""),
+            f"Encoding: {self.encoding}",
+            f"Size: {self.file_bytes / mb:.1f} MiB ({self.bytes_read / mb:.1f} MiB read)",
+            f"Rows: {self.rows:,} x {self.columns} columns"
+            + (" (cancelled)" if self.cancelled else ""),
+            f"Rows per second: {self.rows_per_second:,.0f}",
+        ]
+        if self.short_rows or self.long_rows or self.blank_rows:
+            lines.append(f"Ragged rows: {self.short_rows:,} short, {self.long_rows:,} long, "
+                         f"{self.blank_rows:,} blank")
+        for phase in ("sniff", "parse", "reset", "paint", "total"):
+            if phase in self.times:
+                lines.append(f"{phase.capitalize()} time: {self.times[phase] * 1000:,.1f} ms")
+        if self.cached_dialect:
+            lines.append("Format taken from the cache (not sniffed)")
+        if self.cached_index:
+            lines.append("Record offsets taken from an index file")
+        if self.peak_rss:
+            lines.append(f"Memory: {self.memory / mb:.1f} MiB (peak {self.peak_rss / mb:.1f} MiB)")
+        return lines
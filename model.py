@@ -1,29 +1,204 @@
 import csv
-from collections import OrderedDict
-
-from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
-
-class BadSniffException(Exception):
-    """Raised when the csv sniffer fails to determine the dialect of a file"""
-
+import io
+import os
+from array import array
+from itertools import chain, islice, repeat
+
+from PyQt5.QtCore import (Qt, QAbstractItemModel, QAbstractTableModel, QModelIndex,
+                          QCoreApplication, QEvent, QFileSystemWatcher, QTimer, pyqtSignal)
+from PyQt5.QtGui import QColor
+
+from charset import RAW_ENCODING, byte_level, cell_codec, detect_encoding
+from colstats import StatsEngine
+from compressed import compression, disk_position, size_hint
+from core import detect_format, generic_headers, open_records, read_table, widen_headers
+from loader import CSVLoader, RowBatches, start_loader
+from loadstats import LoadStats
+from parallel import ParallelReader, can_split
+from pieces import PieceTable, runs
+from prefetch import RowPrefetcher
+from rowindex import LazyRows
+from search import SearchEngine
+from sidecar import default_index_dir
+from sniff import DialectCache, sniff_sample
+from sortfilter import RowOrder
+from sqlstore import RowChunk, SQLiteRows
+from store import ColumnStore
+from tail import FileTail
+from tokenizer import needs_tokenizer
+from undo import (CellEdits, ColumnInsert, ColumnRemove, HeaderRename, RangeEdit, RowInsert,
+                  RowMove, RowRemove, UndoStack)
+from writer import save_csv
 
 class CSVTableModel(QAbstractTableModel):
 
+    # bytes read, total bytes (during a background load)
+    loadProgress = pyqtSignal('qint64', 'qint64')
+    # emitted at the end of a background load; True if it was cancelled
+    loadFinished = pyqtSignal(bool)
+    # error message, if a background load failed partway through
+    loadError = pyqtSignal(str)
+    # the LoadStats of a load, once it's done (in the background or not)
+    loadStats = pyqtSignal(object)
+    # a followed file was read again from the start, because it was
+    # "truncated" or "replaced" (see FileTail.status()), or "grown" from
+    # being empty
+    followReloaded = pyqtSignal(str)
+    # following the file was turned on or off (or couldn't be turned on;
+    # see set_following())
+    followingChanged = pyqtSignal(bool)
+
+    # something was done, undone or redone (see can_undo(), undo_text()...)
+    undoStateChanged = pyqtSignal()
+    # True when the data is back as it was loaded (or last saved)
+    cleanChanged = pyqtSignal(bool)
+
     # return the field data for any of these roles in data():
     _dataroles=(Qt.DisplayRole, Qt.EditRole)
 
+    # files larger than this (in bytes) are indexed and parsed lazily
+    # rather than being read into memory all at once
+    lazy_threshold = 64 * 1024 * 1024
+
+    # files larger than this are imported into an SQLite database on disk
+    # (see sqlstore.py) instead, unless they're explicitly loaded lazily;
+    # None to never do that
+    sqlite_threshold = None
+
+    # number of rows read up front when loading in the background
+    first_batch = 1000
+
+    # keep blank rows (as rows without any fields) rather than skipping
+    # them like DictReader does; either way, they're in the scan_report
+    keep_blank_rows = False
+
+    # files larger than this (that aren't loaded lazily) are parsed by a
+    # pool of `parallel_workers` processes; None means one per CPU.
+    # Setting the worker count to 1 disables parallel parsing.
+    parallel_threshold = 16 * 1024 * 1024
+    parallel_workers = None
+
+    # if set, the stats of each load are appended to this file, as a
+    # line of JSON
+    stats_log = None
+
+    # how often (in ms) a followed file is checked for new rows, besides
+    # when the file system reports a change (which it doesn't everywhere)
+    follow_interval = 1000
+
+    # new rows of a followed file are read this many bytes at a time (with
+    # a trip through the event loop in between)
+    follow_chunk = 4 * 1024 * 1024
+
+    # tables with at least this many rows get a search index (built in
+    # the background on the first search); None to never build one
+    search_index_rows = 100000
+
+    # the statistics of the columns of tables with more rows than this
+    # are approximate (see colstats.py), unless they're asked for exactly
+    stats_approx_rows = 1000000
+
+    # background of the cells that contain the text being searched for
+    highlight_color = QColor(255, 230, 0, 110)
+
+    # number of rows copied to the clipboard at a time
+    clipboard_rows = 65536
+
+    # the most memory (in bytes) kept for undoing changes; the oldest
+    # changes are forgotten past that
+    undo_limit = 64 * 1024 * 1024
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self._currfile = None
 
+        # remembers the format of files that have been opened before;
+        # set to None to always sniff
+        self.dialect_cache = DialectCache()
+
+        # where the record offset tables of lazily-loaded files are saved,
+        # to make reopening them instant; set to None to disable
+        self.index_dir = default_index_dir()
+
+        # where the databases of the files imported into SQLite are kept,
+        # to make reopening them instant; None for temporary ones
+        self.sqlite_dir = None
+
         # set to True if the header names are included in the file
         self._has_header = False
 
+        # the format the file was read with (and will be saved in)
+        self._dialect = csv.excel
+        self._skip = 0
+        self._encoding = "utf-8"
+
+        # (size, mtime) of the file the data was read from, to make sure
+        # it hasn't changed before copying parts of it when saving
+        self._source_stat = None
+        # the compression of that file (see compressed.py), if any
+        self._compression = None
+        # rows edited since the data was read from (or saved to) the file
+        self._dirty = set()
+        # True if the headers were renamed
+        self._header_dirty = False
+        # True if columns were inserted or removed
+        self._columns_changed = False
+        # the number of rows of the store that are records of that file
+        # (once rows are inserted, which aren't) and, once the rows of the
+        # table have been saved in another order than that of the store,
+        # the record that each row of the store is (-1 for none)
+        self._nrecords = 0
+        self._records = None
+
+        # header names, in display order
         self._headers = []
-        # list of ordered-dicts
-        self._data=[]
-
+        # the store slot holding the data for each displayed column
+        self._columns = []
+        # a ColumnStore (or a LazyRows instance for big files)
+        self._data = ColumnStore()
+        # the rows of the store that are in the table, in order, once rows
+        # have been inserted, removed or moved (see pieces.py); None while
+        # the table is simply the rows of the store
+        self._rows = None
+        # sorting and filtering of the displayed rows
+        self._order = RowOrder()
+        self._search = SearchEngine(self._data)
+        # aggregates of the columns (see column_stats())
+        self._colstats = StatsEngine(self._data)
+        # (text, match case) to highlight the cells containing, if any
+        self._highlight = None
+        # reads the rows of a lazily-loaded store ahead of the view (see
+        # watch_view()), and the first and last of the displayed rows that
+        # were drawn before they were read
+        self._prefetch = RowPrefetcher(self)
+        self._prefetch.blockRead.connect(self._on_block_read)
+        self._view = None
+        self._unread = None
+        # the changes that can be undone (and redone)
+        self._undo = UndoStack(self.undo_limit)
+
+        # the worker and thread for a background load in progress
+        self._loader = None
+        self._thread = None
+        # timings and sizes of the latest load
+        self._stats = None
+        # how much of the file the (in-memory) rows were read from
+        self._read_end = 0
+
+        # following the file for appended rows (see set_following())
+        self._follow = False
+        self._tail = None
+        # True if the last row was read from an unfinished line, and is
+        # to be replaced by the first record that's read next
+        self._tail_partial = False
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._on_file_changed)
+        self._follow_timer = QTimer(self, interval=self.follow_interval,
+                                    timeout=self._check_follow)
+        # (file system notifications come in bursts)
+        self._follow_soon = QTimer(self, singleShot=True, interval=50,
+                                   timeout=self._check_follow)
 
 
     # region overrides
@@ -35,7 +210,7 @@ class CSVTableModel(QAbstractTableModel):
             ## should return 0 when the parent is valid.
             return 0
 
-        return len(self._data)
+        return self._order.count(len(self._data))
 
     def columnCount(self, parent=QModelIndex()):
         if not self._currfile or parent.isValid():
@@ -60,23 +235,51 @@ class CSVTableModel(QAbstractTableModel):
 
         if role in self._dataroles:
             row, col = index.row(), index.column()
+            store_row = self._store_row(row)
 
-            # XXX: so...should we just use a simple 2d-array and access all data by indices? Or should we use keys for the columns to allow the user to easily move columns around while editing?
-            # let's try the keys for now
+            if (role == Qt.DisplayRole and self._view is not None
+                    and not self._row_ready(row, store_row)):
+                # (it's drawn once it's been read)
+                return ""
 
-            val = self._data[row][self._headers[col]]
+            # columns are mapped to store slots by position, so
+            # renaming or moving a column doesn't touch the data (and
+            # rows are mapped to store rows, for sorting and filtering)
+            val = self._data.get(store_row, self._columns[col])
 
             return "" if val is None else val
 
+        if role == Qt.TextAlignmentRole:
+            # line up the numbers of numeric columns
+            if self._data.column_type(self._columns[index.column()]) is not None:
+                return Qt.AlignRight | Qt.AlignVCenter
+
+        if role == Qt.BackgroundRole and self._highlight:
+            # (only ever worked out for the cells that are drawn)
+            needle, case = self._highlight
+            store_row = self._store_row(index.row())
+            if self._view is not None and not self._row_ready(index.row(), store_row):
+                return None
+            val = self._data.get(store_row, self._columns[index.column()])
+            if val and needle in (val if case else val.casefold()):
+                return self.highlight_color
+
     def setData(self, index, value, role=Qt.EditRole):
 
         if role == Qt.EditRole:
-            row, col = index.row(), index.column()
+            row, slot = self._store_row(index.row()), self._columns[index.column()]
 
             # turn empty strings into `None`
-            self._data[row][self._headers[col]] = None if not value else value
-
+            value = None if not value else value
+            old = self._data.get(row, slot)
+            if value == old:
+                return True
+            if not self._encodable([value]):
+                return False
+
+            self._set_cell(row, slot, value)
             self.dataChanged.emit(index, index)
+            self._push(CellEdits([(row, slot, old, value)]))
             return True
 
         return super().setData(index, value, role)
@@ -95,182 +298,1300 @@ class CSVTableModel(QAbstractTableModel):
 
             # just return the row number for the vertical header
             return section + 1
+
+        if (role == Qt.ToolTipRole and orientation == Qt.Horizontal
+                and 0 <= section < len(self._headers)):
+            # show the type of the column
+            return f"{self._headers[section]} ({self.column_type(section)})"
+
         return super().headerData(section, orientation, role)
 
-    # TODO: figure out how to allow changing the headers without having to modify the keys of EVERY SINGLE ROW (OrderedDict) in the model
+    def setHeaderData(self, section, orientation, value, role=Qt.EditRole):
+        """
+        Allow renaming the headers
+
+        :param int section:
+        :param int orientation:
+        :param Any value:
+        :param int role:
+        :return: True if the data was successfully changed
+        """
+
+        if role == Qt.EditRole and orientation == Qt.Horizontal:
+            if not (0 <= section < len(self._headers) and value):
+                return False
+
+            old, value = self._headers[section], str(value)
+            if value != old:
+                self._rename_slot(self._columns[section], value)
+                self._push(HeaderRename(self._columns[section], old, value))
+            return True
+
+        return super().setHeaderData(section, orientation, value, role)
+
+    def moveColumns(self, sourceParent, sourceColumn, count, destinationParent, destinationChild):
+        """Reorder the columns; the underlying data is not moved"""
+
+        ncols = len(self._headers)
+        if (sourceParent.isValid() or destinationParent.isValid()
+                or count < 1 or sourceColumn < 0 or sourceColumn + count > ncols
+                or not 0 <= destinationChild <= ncols):
+            return False
+
+        if not self.beginMoveColumns(sourceParent, sourceColumn, sourceColumn + count - 1,
+                                     destinationParent, destinationChild):
+            # moving a range onto itself
+            return False
+
+        for seq in (self._headers, self._columns):
+            moved = seq[sourceColumn:sourceColumn + count]
+            del seq[sourceColumn:sourceColumn + count]
+            dest = destinationChild if destinationChild < sourceColumn else destinationChild - count
+            seq[dest:dest] = moved
+
+        self.endMoveColumns()
+        return True
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        """
+        Insert `count` empty rows before (displayed) row `row`, as a
+        single undoable step. The rows are added to the end of the store;
+        only the order of the table says where they are (see pieces.py).
+        """
+        if (parent.isValid() or count < 1 or not 0 <= row <= self.rowCount()
+                or not self._restructure()):
+            return False
+
+        pos = self._table_position(row)
+        first = len(self._data)
+        self._data.add_rows(count)
+        # (the sort keys don't cover the new rows)
+        self._order.invalidate()
+        self._insert_rows(pos, [(first, count)])
+        self._push(RowInsert(pos, [(first, count)]))
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        """Remove the (displayed) rows [row, row + count), as a single undoable step"""
+        if (parent.isValid() or count < 1 or row < 0 or row + count > self.rowCount()
+                or not self._restructure()):
+            return False
+
+        table = self._table()
+        if self._order.rows is None:
+            steps = [(row, self._remove_rows(row, count))]
+        else:
+            # (rows shown next to each other can be anywhere in the table;
+            # they're taken out from the last one up)
+            positions = sorted(table.positions(self._order.rows[row:row + count]), reverse=True)
+            steps = [(pos, table.remove(pos, n)) for pos, n in runs(positions)]
+            self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+            self._order.remove(row, row + count)
+            self.endRemoveRows()
+            self._rows_changed()
+
+        self._push(RowRemove(steps))
+        return True
+
+    def moveRows(self, sourceParent, sourceRow, count, destinationParent, destinationChild):
+        """
+        Move rows to another place in the table (not while the rows are
+        sorted or filtered, when they aren't shown in the table's order)
+        """
+        nrows = self.rowCount()
+        if (sourceParent.isValid() or destinationParent.isValid()
+                or count < 1 or sourceRow < 0 or sourceRow + count > nrows
+                or not 0 <= destinationChild <= nrows
+                # (moving a range onto itself)
+                or sourceRow <= destinationChild <= sourceRow + count
+                or self._order.rows is not None or not self._restructure()):
+            return False
+
+        self._table()
+        self._move_rows(sourceRow, count, destinationChild)
+        self._push(RowMove(sourceRow, count, destinationChild))
+        return True
+
+    def insertColumns(self, column, count, parent=QModelIndex()):
+        """Insert `count` empty columns before `column`, as a single undoable step"""
+        ncols = len(self._headers)
+        if parent.isValid() or count < 1 or not 0 <= column <= ncols or not self._restructure():
+            return False
+
+        slots = [self._data.add_column() for _ in range(count)]
+        names = generic_headers(ncols + count)[ncols:]
+        self._insert_columns(column, slots, names)
+        self._push(ColumnInsert(column, slots, names))
+        return True
+
+    def removeColumns(self, column, count, parent=QModelIndex()):
+        """
+        Remove the columns [column, column + count), as a single undoable
+        step. Their data stays in the store (to be put back by undo).
+        """
+        if (parent.isValid() or count < 1 or column < 0 or column + count > len(self._headers)
+                or not self._restructure()):
+            return False
+
+        slots, names = self._columns[column:column + count], self._headers[column:column + count]
+        self._remove_columns(column, count)
+        self._push(ColumnRemove(column, slots, names))
+        return True
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return not self._data.complete
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        self._index_more()
+
+    def _index_more(self):
+        """Index more of a LazyRows store, and add the records found to the model"""
+        pending = self._data.index_more()
+        if pending:
+            first = self.rowCount()
+            self.beginInsertRows(QModelIndex(), first, first + pending - 1)
+            end = len(self._data)
+            self._data.commit()
+            self._order.extend(end, len(self._data))
+            self.endInsertRows()
+            self._widen()
+
+    def _widen(self):
+        """Add the columns that rows with extra fields have added to the store"""
+        ncols = self._data.ncols
+        first = len(self._columns)
+        if ncols <= first:
+            return
+
+        # (as the last columns, whatever order the others are in)
+        self.beginInsertColumns(QModelIndex(), first, ncols - 1)
+        self._headers = widen_headers(self._headers, ncols)
+        self._columns.extend(range(first, ncols))
+        self.endInsertColumns()
+
+    @property
+    def scan_report(self):
+        """The ScanReport of the short, long and blank rows of the file"""
+        return self._data.report
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        Sort the rows by the values of `column`, compared as the column's
+        (inferred) type. A column of -1 restores the original order.
+        Sorting only changes the order the rows are shown in, not the
+        order they are saved in.
+        """
+        slot = self._columns[column] if 0 <= column < len(self._columns) else None
+        if slot is None and self._order.sort_slot is None:
+            return
+
+        # sort everything, not just the part of a big file that has
+        # been indexed so far
+        if slot is not None:
+            self._fetch_all()
 
-    # def setHeaderData(self, section, orientation, value, role=Qt.EditRole):
-    #     """
-    #     Allow renaming the headers
-    #
-    #     :param int section:
-    #     :param int orientation:
-    #     :param Any value:
-    #     :param int role:
-    #     :return: True if the data was successfully changed
-    #     """
-    #
-    #     if role==Qt.EditRole and orientation == Qt.Horizontal:
-    #         self._headers[]
+        self.layoutAboutToBeChanged.emit([], QAbstractItemModel.VerticalSortHint)
 
+        # remember where the persistent indexes (selection, current
+        # cell...) point in the store, to move them along with the rows
+        persistent = self.persistentIndexList()
+        rows = [self._store_row(index.row()) for index in persistent]
 
+        self._order.sort_slot = slot
+        self._order.descending = order == Qt.DescendingOrder
+        self._order.update(self._data)
+
+        self.changePersistentIndexList(persistent, [
+            self.index(row, index.column())
+            for row, index in zip(self._order.positions(rows), persistent)])
+
+        self.layoutChanged.emit([], QAbstractItemModel.VerticalSortHint)
 
     # endregion
 
-    @staticmethod
-    def sniff(sample, delims):
-        """Determine the dialect of a csv file"""
-        sniffer = csv.Sniffer()
-        if delims:
-            dialect = sniffer.sniff(sample, delims)
+    # region inserting and removing rows and columns
+
+    def _restructure(self):
+        """
+        Get ready to insert, remove or move rows or columns: False while
+        loading. Following the file stops, as its records no longer line up
+        with the rows (see set_following()).
+        """
+        if self.loading:
+            return False
+        # (rows can only be added after the records of a lazily-loaded file)
+        self._fetch_all()
+        if self._follow:
+            self.set_following(False)
+        return True
+
+    def _table(self):
+        """The PieceTable of the rows of the table (made when it's first needed)"""
+        if self._rows is None:
+            self._rows = PieceTable(len(self._data))
+            self._order.base = self._colstats.rows = self._rows
+            self._nrecords = len(self._data)
+        return self._rows
+
+    def _table_position(self, row):
+        """The position in the table of displayed row `row` (or of the end of the table)"""
+        table = self._table()
+        if self._order.rows is None:
+            return row
+        if row >= len(self._order.rows):
+            return len(table)
+        return table.positions([self._order.rows[row]])[0]
+
+    def _rows_changed(self):
+        self._order.rebase()
+        self._colstats.invalidate()
+
+    def _insert_rows(self, pos, pieces):
+        """Put pieces of store rows into the table at position `pos`"""
+        table = self._table()
+        count = sum(n for _, n in pieces)
+        if self._order.rows is None:
+            self.beginInsertRows(QModelIndex(), pos, pos + count - 1)
+            table.insert(pos, pieces)
+            self.endInsertRows()
+        else:
+            # (shown where the row they go before is, if that's shown,
+            # until the next sort)
+            shown = self._order.positions([table[pos]])[0] if pos < len(table) else -1
+            if shown < 0:
+                shown = len(self._order.rows)
+            self.beginInsertRows(QModelIndex(), shown, shown + count - 1)
+            table.insert(pos, pieces)
+            self._order.insert(shown, chain.from_iterable(
+                range(first, first + n) for first, n in pieces))
+            self.endInsertRows()
+        self._rows_changed()
+
+    def _remove_rows(self, pos, count):
+        """Take the rows [pos, pos + count) out of the table, and return their pieces"""
+        table = self._table()
+        if self._order.rows is None:
+            self.beginRemoveRows(QModelIndex(), pos, pos + count - 1)
+            pieces = table.remove(pos, count)
+            self.endRemoveRows()
         else:
-            dialect = sniffer.sniff(sample)
-        has_header = sniffer.has_header(sample)
+            pieces = table.remove(pos, count)
+            rows = [row for first, n in pieces for row in range(first, first + n)]
+            shown = sorted((p for p in self._order.positions(rows) if p >= 0), reverse=True)
+            for first, n in runs(shown):
+                self.beginRemoveRows(QModelIndex(), first, first + n - 1)
+                self._order.remove(first, first + n)
+                self.endRemoveRows()
+        self._rows_changed()
+        return pieces
+
+    def _move_rows(self, pos, count, dest):
+        """Move the rows [pos, pos + count) of the table to before position `dest`"""
+        table = self._table()
+        if self._order.rows is None:
+            self.beginMoveRows(QModelIndex(), pos, pos + count - 1, QModelIndex(), dest)
+            table.move(pos, count, dest)
+            self.endMoveRows()
+        else:
+            # (the rows are shown in their sorted order all the same)
+            table.move(pos, count, dest)
+        self._order.rebase()
+
+    def _insert_columns(self, pos, slots, names):
+        self.beginInsertColumns(QModelIndex(), pos, pos + len(slots) - 1)
+        self._columns[pos:pos] = slots
+        self._headers[pos:pos] = names
+        self._columns_changed = True
+        self.endInsertColumns()
+
+    def _remove_columns(self, pos, count):
+        self.beginRemoveColumns(QModelIndex(), pos, pos + count - 1)
+        for slot in self._columns[pos:pos + count]:
+            # (the rows stay as they're shown until they're sorted or
+            # filtered again)
+            self._order.filters.pop(slot, None)
+            if self._order.sort_slot == slot:
+                self._order.sort_slot = None
+        del self._columns[pos:pos + count]
+        del self._headers[pos:pos + count]
+        self._columns_changed = True
+        self.endRemoveColumns()
 
-        return dialect, has_header
+    # endregion
 
+    # region sorting and filtering
 
+    def _store_row(self, row):
+        """The row of the store shown as row `row`"""
+        rows = self._order.store_rows
+        return row if rows is None else rows[row]
 
-    def load_csv(self, csvfile, delims=None):
-        """Load a csv file into memory to back the model"""
+    def _fetch_all(self):
+        while self.canFetchMore():
+            self.fetchMore()
 
-        # XXX: should we actually load the entire file into memory? What's the alternative?
+    def column_type(self, column):
+        """The type of the values of `column` (see coltypes)"""
+        return self._order.column_type(self._data, self._columns[column])
+
+    def set_column_type(self, column, ctype):
+        """
+        Override the type of `column`. Columns of numbers (int or float)
+        are stored as such; the type also decides how the column is sorted
+        and filtered.
+
+        :raises ValueError: if the column's values aren't of that type
+        """
+        slot = self._columns[column]
+        self._data.set_column_type(slot, ctype)
+        self._order.set_type(slot, ctype)
+
+        current = self._order.filters.get(slot)
+        if current is not None:
+            # the condition may not make sense for the new type
+            try:
+                self._order.set_filter(self._data, slot, current.condition)
+            except ValueError:
+                self._order.set_filter(self._data, slot, "")
+            self.beginResetModel()
+            self._order.update(self._data)
+            self.endResetModel()
+        elif self._order.sort_slot == slot:
+            self.sort(column, Qt.DescendingOrder if self._order.descending else Qt.AscendingOrder)
+
+    def filter_condition(self, column):
+        """The filter condition set on `column`, or an empty string"""
+        current = self._order.filters.get(self._columns[column])
+        return "" if current is None else current.condition
+
+    def set_filter(self, column, condition):
+        """
+        Only show the rows whose value in `column` matches `condition`
+        (see sortfilter.Filter), along with the filters on the
+        other columns. An empty condition removes the column's filter.
+
+        :raises ValueError: if the condition is invalid
+        """
+        self._fetch_all()
+        self._order.set_filter(self._data, self._columns[column], condition)
+
+        self.beginResetModel()
+        self._order.update(self._data)
+        self.endResetModel()
+
+    def clear_filters(self):
+        """Show all rows again (keeping the sort order)"""
+        if self._order.filters:
+            self._order.filters.clear()
+            self.beginResetModel()
+            self._order.update(self._data)
+            self.endResetModel()
+
+    # endregion
+
+    # region searching
+
+    def find(self, text, start=None, case=False, backwards=False):
+        """
+        Iterate over the (row, column) positions of the cells that contain
+        `text`, row by row, starting after (or, if `backwards`, before) the
+        cell at `start` and wrapping around. The iterator goes stale when
+        the rows or columns are rearranged.
+
+        :param start: (row, column); None to start at the beginning (or end)
+        """
+        if (self.search_index_rows is not None and not self.loading
+                and len(self._data) >= self.search_index_rows):
+            # to make the next searches quicker
+            self._search.build_index()
+
+        return self._search.matches(text, self._columns, self._order.store_rows,
+                                    start or (-1, -1), case, backwards)
+
+    def set_highlight(self, text, case=False):
+        """Highlight the cells containing `text` (or nothing, if it's empty)"""
+        self._highlight = (text if case else text.casefold(), case) if text else None
+        if self.rowCount() and self.columnCount():
+            self.dataChanged.emit(self.index(0, 0),
+                                  self.index(self.rowCount() - 1, self.columnCount() - 1),
+                                  [Qt.BackgroundRole])
+
+    # endregion
 
+    # region statistics
+
+    def column_stats(self, column, approximate=None):
+        """
+        The aggregates of the values of `column` (see colstats.ColumnStats),
+        over all the rows, shown or not. They're kept, and updated as cells
+        are edited and rows are added.
+
+        :param approximate: estimate the distinct values and quantiles
+            (and, for a lazily-loaded table, take everything from a sample
+            of the rows); by default, for tables of more than
+            `stats_approx_rows` rows
+        """
+        # (indexing the rest of a lazily-loaded file is quick next to
+        # parsing it)
+        self._fetch_all()
+        if approximate is None:
+            approximate = (len(self._data) > self.stats_approx_rows
+                           or isinstance(self._data, (LazyRows, SQLiteRows)))
+        return self._colstats.column_stats(self._columns[column], approximate)
+
+    # endregion
+
+    # region prefetching
+
+    def watch_view(self, view):
+        """
+        Read the rows of a lazily-loaded file (or of one imported into
+        SQLite) ahead of where `view` is scrolled, in the background (see
+        prefetch.py). The rows that it shows before they've been read are
+        drawn empty until they have been, rather than waiting for them.
+        """
+        self._view = view
+        view.verticalScrollBar().valueChanged.connect(self._on_view_scrolled)
+        # (the rows in view change with the size of the view and the
+        # number of rows, and with sorting and filtering)
+        view.verticalScrollBar().rangeChanged.connect(self._on_view_scrolled)
+        self.modelReset.connect(self._on_view_scrolled)
+        self.layoutChanged.connect(self._on_view_scrolled)
+
+    @property
+    def prefetch_counts(self):
+        """
+        How many of the rows scrolled into view (since the file was
+        loaded) had been read ahead, and how many hadn't
+        """
+        return self._prefetch.hits, self._prefetch.misses
+
+    def _row_ready(self, row, store_row):
+        """True if displayed row `row` can be drawn without waiting for it to be read"""
+        if self._prefetch.ready(store_row):
+            return True
+        if self._unread is None:
+            self._unread = [row, row]
+        else:
+            self._unread[0] = min(self._unread[0], row)
+            self._unread[1] = max(self._unread[1], row)
+        return False
+
+    def _on_view_scrolled(self):
+        view, nrows = self._view, self.rowCount()
+        first = max(view.rowAt(0), 0)
+        last = view.rowAt(view.viewport().height() - 1)
+        self._prefetch.scrolled(first, nrows if last < 0 else last + 1, nrows, self._store_row)
+
+    def _on_block_read(self):
+        # draw the rows that were waiting (for that block, or another one)
+        if self._unread is not None:
+            first, last = self._unread
+            self._unread = None
+            last = min(last, self.rowCount() - 1)
+            if first <= last and self.columnCount():
+                self.dataChanged.emit(self.index(first, 0),
+                                      self.index(last, self.columnCount() - 1))
+
+    # endregion
+
+    # region undo/redo
+
+    def can_undo(self):
+        return self._undo.can_undo
+
+    def can_redo(self):
+        return self._undo.can_redo
+
+    def undo_text(self):
+        """What undo() would undo ("Edit", "Paste"...), or an empty string"""
+        return self._undo.undo_text
+
+    def redo_text(self):
+        return self._undo.redo_text
+
+    def is_clean(self):
+        """True if the data hasn't changed since it was loaded or last saved"""
+        return self._undo.clean
+
+    def undo(self):
+        """Undo the last change"""
+        was_clean = self._undo.clean
+        command = self._undo.undo()
+        if command is not None:
+            command.undo(self)
+            self._undo_changed(was_clean)
+
+    def redo(self):
+        """Redo the last change that was undone"""
+        was_clean = self._undo.clean
+        command = self._undo.redo()
+        if command is not None:
+            command.redo(self)
+            self._undo_changed(was_clean)
+
+    def _push(self, command):
+        """Record a change that has just been made"""
+        was_clean = self._undo.clean
+        self._undo.push(command)
+        self._undo_changed(was_clean)
+
+    def _reset_undo(self, clear=True):
+        """Make the current state the clean one (and forget the history if `clear`)"""
+        was_clean = self._undo.clean
+        if clear:
+            self._undo.clear()
+        else:
+            self._undo.set_clean()
+        self._undo_changed(was_clean)
+
+    def _undo_changed(self, was_clean):
+        self.undoStateChanged.emit()
+        if self._undo.clean != was_clean:
+            self.cleanChanged.emit(self._undo.clean)
+
+    def _encodable(self, values):
+        """False if any of the values has characters that the encoding of the file lacks"""
         try:
+            for value in values:
+                if value and not value.isascii():
+                    value.encode(self._encoding, 'surrogateescape')
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def _set_cell(self, row, slot, value):
+        """Set a cell of the store (without signalling the change)"""
+        self._colstats.cells_changing((row,), slot, (value,))
+        self._data.set(row, slot, value)
+        self._dirty.add(row)
+        # (the row stays where it is until the table is sorted again)
+        self._order.invalidate(slot)
+        self._search.cell_changed(row, slot, value)
+
+    def _emit_changed(self, rows, slots):
+        """Emit one dataChanged covering the given cells of the store"""
+        cols = [self._columns.index(slot) for slot in set(slots)]
+        rows = [pos for pos in self._order.positions(sorted(set(rows))) if pos >= 0]
+        if rows and cols:
+            self.dataChanged.emit(self.index(min(rows), min(cols)),
+                                  self.index(max(rows), max(cols)))
+
+    def _set_cells(self, cells):
+        """Set cells of the store, given as (row, slot, value) tuples"""
+        for row, slot, value in cells:
+            self._set_cell(row, slot, value)
+        self._emit_changed([c[0] for c in cells], [c[1] for c in cells])
+
+    def _set_range(self, rows, slots, values):
+        """Set a block of cells of the store: `values` has a list per slot"""
+        for slot, column in zip(slots, values):
+            self._colstats.cells_changing(rows, slot, column)
+            self._data.set_cells(rows, slot, column)
+            self._order.invalidate(slot)
+            self._search.cells_changed(rows, slot, column)
+        self._dirty.update(rows)
+        self._emit_changed(rows, slots)
+
+    def _rename_slot(self, slot, name):
+        section = self._columns.index(slot)
+        self._headers[section] = name
+        self._header_dirty = True
+        self.headerDataChanged.emit(Qt.Horizontal, section, section)
 
-            with open(csvfile, newline='') as f:
-                self.beginResetModel()
+    # endregion
 
-                self._currfile = csvfile
-                self._data = []
-                self._headers = []
+    # region clipboard
 
-                ## determine dialect and header
+    def copy_text(self, top, left, bottom, right, dialect=csv.excel_tab):
+        """
+        Serialise the cells from (top, left) to (bottom, right) (inclusive)
+        as csv text in the given dialect; tab-separated by default, as
+        spreadsheets expect on the clipboard.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, dialect)
+        slots = self._columns[left:right + 1]
+
+        # a block of rows at a time, a column at a time
+        for first in range(top, bottom + 1, self.clipboard_rows):
+            rows = [self._store_row(row)
+                    for row in range(first, min(first + self.clipboard_rows, bottom + 1))]
+            writer.writerows(zip(*[self._data.get_cells(rows, slot) for slot in slots]))
+        return buffer.getvalue()
+
+    def paste_text(self, top, left, text, dialect=csv.excel_tab, bottom=None, right=None):
+        """
+        Write csv text (tab-separated by default) into the table, starting
+        at cell (top, left), as a single undoable step. Whatever doesn't
+        fit in the table is left out. A single value fills the whole
+        range to (bottom, right), if given.
 
-                # sample the first 1Kb of the file
-                sample = f.read(1024)
+        :return: the (bottom, right) corner of the cells that were
+            written, or None if nothing was
+        """
+        values = list(csv.reader(io.StringIO(text), dialect))
+        if not values or top < 0 or left < 0:
+            return None
 
-                try:
-                    dialect, self._has_header = self.sniff(sample, delims)
-                except csv.Error as csve:
-                    print("CSVerror:", csve)
-                    if csve.args[0] == "Could not determine delimiter":
-                        raise BadSniffException
-                        # print("Could not determine delimeter")
-                        # try again with standard delims;
-                        # "aligned" files might sometimes cause this
-                        # issue, though often it's due to using
-                        # odd "quote" characters (like balanced braces
-                        # { ... } ) to contain arbitrary text--possibly
-                        # including the delimeter, any number of times.
-                        # This latter scenario is far more difficult to
-                        # deal with.
-                        # XXX: this is stupid, sniff() already tries 'standard delims'
-                        # dialect, self._has_header = self.sniff(sample, ',;')
-                    else:
-                        raise
-                f.seek(0)
-
-                # sniffer = csv.Sniffer()
-                # if delims:
-                #     dialect = sniffer.sniff(sample, delims)
-                # else:
-                #     dialect = sniffer.sniff(sample)
-                # self._has_header = sniffer.has_header(sample)
-
-                # f.seek(0)
-                if self._has_header:
-                    # reader = csv.DictReader(f, dialect=dialect)
-                    reader = csv.DictReader(f)
-                    print("DictReader")
-
-                    # copy the header names
-                    self._headers = list(reader.fieldnames)
-
-                    # TODO: handle "restval", ie scenarios where some rows are too long or too short
-                    for row in reader:
-                        self._data.append(row)
-
-                else:
-                    # todo: allow manually specifying the first row as a header if the sniffer fails to sniff it
-                    # reader = csv.reader(f, dialect=dialect)
-                    reader = csv.reader(f)
-                    print("reader")
-
-                    try:
-                        first_row = next(reader)
-                        # create generic header names
-                        self._headers = ["Column {}".format(i+1) for i in range(len(first_row))]
-
-                        # XXX: should we skip blank rows? If not, we could end up with a dict full of Nones
-                        self._data=[OrderedDict(zip(self._headers, first_row))]
-
-                        for row in reader:
-                            self._data.append(OrderedDict(zip(self._headers, row)))
-
-                    except StopIteration:
-                        # no data
-                        pass
-
-                self.endResetModel()
+        if len(values) == 1 and len(values[0]) == 1 and bottom is not None:
+            height, width = bottom - top + 1, right - left + 1
+            columns = [values[0] * height] * width
+        else:
+            height = len(values)
+            width = max(map(len, values))
+            columns = list(zip(*(row + [''] * (width - len(row)) for row in values)))
+
+        height = min(height, self.rowCount() - top)
+        width = min(width, self.columnCount() - left)
+        if height <= 0 or width <= 0:
+            return None
+
+        rows = [self._store_row(row) for row in range(top, top + height)]
+        slots = self._columns[left:left + width]
+        new = [[v or None for v in column[:height]] for column in columns[:width]]
+        if not self._encodable(chain.from_iterable(new)):
+            return None
+        self._set_cells_range(rows, slots, new, "Paste")
+        return top + height - 1, left + width - 1
+
+    def clear_cells(self, top, left, bottom, right, text="Delete"):
+        """Empty the cells from (top, left) to (bottom, right), as a single undoable step"""
+        rows = [self._store_row(row) for row in range(top, bottom + 1)]
+        slots = self._columns[left:right + 1]
+        self._set_cells_range(rows, slots, [[None] * len(rows)] * len(slots), text)
+
+    def _set_cells_range(self, rows, slots, values, text):
+        old = [self._data.get_cells(rows, slot) for slot in slots]
+        self._set_range(rows, slots, values)
+        self._push(RangeEdit(rows, slots, old, values, text))
 
+    # endregion
 
-        except IOError as e:
-            print(f"IOError: could not load {csvfile}")
-            print(e)
+    @staticmethod
+    def sniff(sample, delims):
+        """Determine the dialect of a sample of a csv file"""
+        return sniff_sample(sample, delims)
+
+
+
+    def _use_lazy(self, csvfile, lazy, encoding, dialect):
+        # (records are found by looking for line breaks in the bytes,
+        # outside of single-character quotes)
+        if not byte_level(encoding) or needs_tokenizer(dialect):
+            return False
+        if lazy is None:
+            # (by the size of the data, for a compressed file)
+            return (size_hint(csvfile) > self.lazy_threshold
+                    and not self._use_sqlite(csvfile, encoding))
+        return lazy
+
+    def _use_sqlite(self, csvfile, encoding):
+        # (the cells are kept as raw text)
+        return (self.sqlite_threshold is not None and byte_level(encoding)
+                and size_hint(csvfile) > self.sqlite_threshold)
+
+    def _use_parallel(self, csvfile, dialect):
+        # (a compressed file can only be decompressed from the start)
+        return (self.parallel_workers != 1 and can_split(dialect)
+                and not self._compression and byte_level(self._encoding)
+                and os.path.getsize(csvfile) > self.parallel_threshold)
+
+    def _release(self):
+        """Close the file backing the current data, if any"""
+        self._search.close()
+        # (waits for a block being read from it)
+        self._prefetch.set_store(None)
+        self._data.close()
+
+    def _set_store(self, store, headers):
+        self._data = store
+        self._prefetch.set_store(store)
+        self._unread = None
+        self._rows = None
+        self._order = RowOrder()
+        self._search.close()
+        self._search = SearchEngine(store)
+        self._colstats = StatsEngine(store)
+        self._headers = list(headers)
+        self._columns = list(range(len(headers)))
+        self._reset_undo()
+
+    def _load_rows(self, csvfile, dialect, header, skip, lazy, background, stats=None,
+                   encoding=None):
+        """Replace the model's data with the records of `csvfile`"""
+
+        self.cancel_load()
+        self._reset_follow(csvfile)
+        self._stats = stats = stats or LoadStats(csvfile)
+        stats.start("parse")
+
+        self.beginResetModel()
+        try:
+            self._read_rows(csvfile, dialect, header, skip, lazy, background,
+                            encoding or detect_encoding(csvfile))
+        finally:
+            stats.start("reset")
+            self.endResetModel()
+            stats.end()
+
+        if self._loader is None:
+            self._finish_stats()
+        else:
+            # (the rest is read by the loader)
+            stats.background = True
+            stats.start("parse")
+
+    def _finish_stats(self, bytes_read=None):
+        stats = self._stats
+        if isinstance(self._data, LazyRows):
+            bytes_read = self._data.bytes_indexed
+            stats.cached_index = self._data.from_index
+        stats.finish(len(self._data), len(self._headers), bytes_read)
+        report = self._data.report
+        stats.short_rows, stats.long_rows, stats.blank_rows = report.short, report.long, report.blank
+
+        # (slots can add to the stats -- the time taken to paint the
+        # table, say -- before they're logged)
+        self.loadStats.emit(stats)
+
+        if self.stats_log:
+            try:
+                stats.log(self.stats_log)
+            except OSError as e:
+                print(f"Could not write to {self.stats_log}: {e}")
+
+    @property
+    def encoding(self):
+        """The encoding the file was read in (and will be saved in)"""
+        return self._encoding
+
+    @property
+    def load_stats(self):
+        """The LoadStats of the latest load (which may still be in progress), or None"""
+        return self._stats
+
+    def _read_rows(self, csvfile, dialect, header, skip, lazy, background, encoding):
+        """Read the file into a new store (between resetting the model)"""
+        self._stats.method = "lazy" if lazy else "reader"
+        self._stats.encoding = encoding
+        self._release()
+        self._currfile = csvfile
+        self._set_store(ColumnStore(), [])
+
+        self._dialect = dialect
+        self._has_header = header
+        self._skip = skip
+        self._encoding = encoding
+        self._source_stat = self._stat(csvfile)
+        self._compression = compression(csvfile)
+        self._dirty = set()
+        self._header_dirty = False
+        self._columns_changed = False
+        self._records = None
+        self._read_end = 0
+
+        if lazy:
+            # LazyRows does its own line-skipping
+            store = LazyRows(csvfile, dialect, header, skip, encoding, index_dir=self.index_dir,
+                             keep_blank=self.keep_blank_rows)
+            self._set_store(store, store.headers)
+            return
+
+        if self._use_sqlite(csvfile, encoding):
+            self._import_rows(csvfile, dialect, header, skip, background, encoding)
+            return
+
+        if self._use_parallel(csvfile, dialect):
+            source = ParallelReader(csvfile, dialect, header, skip, encoding,
+                                    workers=self.parallel_workers,
+                                    keep_blank=self.keep_blank_rows)
+            self._stats.method = "parallel"
+            self._set_store(ColumnStore(len(source.headers), source.codec, self.keep_blank_rows),
+                            source.headers)
+
+            if background:
+                self._start_loader(source, source.size)
+                return
+
+            try:
+                for chunk, _ in source:
+                    self._data.extend_chunk(chunk)
+            finally:
+                source.close()
+            self._data.infer_types()
+            self._read_end = source.size
+            # (the columns added by long rows)
+            self._headers = widen_headers(self._headers, self._data.ncols)
+            self._columns = list(range(len(self._headers)))
+            return
+
+        # todo: allow manually specifying the first row as a header if the sniffer fails to sniff it
+        # (parsed from the bytes, if the encoding allows)
+        codec = cell_codec(encoding)
+        f, reader = open_records(csvfile, dialect, skip, encoding, raw=codec is not None)
+        try:
+            # when loading in the background, only read enough
+            # rows here to fill the first screen
+            limit = self.first_batch if background else None
+            self._set_store(*read_table(reader, header, limit, codec, self.keep_blank_rows))
+        except:
+            f.close()
+            raise
+
+        if background:
+            self._start_loader(RowBatches(f, reader, len(self._headers),
+                                          keep_blank=self.keep_blank_rows),
+                               os.path.getsize(csvfile))
+        else:
+            self._read_end = disk_position(f)
+            f.close()
+
+    def _import_rows(self, csvfile, dialect, header, skip, background, encoding):
+        """Read the file into an SQLite database (see sqlstore.py), unless it's in one already"""
+        self._stats.method = "sqlite"
+        store = SQLiteRows(csvfile, dialect, header, skip, cell_codec(encoding),
+                           self.sqlite_dir, self.keep_blank_rows)
+        if store.reopened:
+            self._set_store(store, store.headers)
+            self._read_end = os.path.getsize(csvfile)
+            return
+
+        f, reader = open_records(csvfile, dialect, skip, encoding, raw=True)
+        try:
+            store.begin_import(reader, header)
+            if background:
+                # (enough rows to fill the first screen)
+                store.extend_chunk(RowChunk.from_rows(islice(reader, self.first_batch),
+                                                      store.ncols, self.keep_blank_rows))
+        except:
+            f.close()
+            store.close()
+            raise
+        self._set_store(store, store.headers)
+
+        batches = RowBatches(f, reader, store.ncols, keep_blank=self.keep_blank_rows,
+                             chunk_type=RowChunk)
+        if background:
+            self._start_loader(batches, os.path.getsize(csvfile))
+            return
 
-    def load_csv_manual(self, csvfile, custom_dialect, header=False, skip=0):
-        """Load a csv file into memory to back the model"""
+        try:
+            for chunk, pos in batches:
+                store.extend_chunk(chunk)
+                self._read_end = pos
+        finally:
+            batches.close()
+        store.end_import()
+        # (the columns added by long rows)
+        self._headers = widen_headers(self._headers, store.ncols)
+        self._columns = list(range(len(self._headers)))
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def _source(self):
+        """
+        Return a LazyRows index of the file the data was read from, if its
+        records still correspond to the rows of the model, or None.
+        """
+        # (the records of a compressed file can't be copied as they are,
+        # nor those of a file that can't be indexed)
+        if (not self._currfile or self._source_stat is None or self._compression
+                or not byte_level(self._encoding) or needs_tokenizer(self._dialect)
+                or self._columns_changed
+                or self._columns != list(range(len(self._columns)))):
+            return None
+
+        if isinstance(self._data, LazyRows):
+            # (the file may have been replaced by saving, but the store
+            # is still reading the original)
+            source = self._data
+            st = os.fstat(source.fileno())
+            if (st.st_size, st.st_mtime_ns) != self._source_stat:
+                return None
+            return source
 
         try:
+            if self._stat(self._currfile) != self._source_stat:
+                return None
+            source = LazyRows(self._currfile, self._dialect, self._has_header, self._skip,
+                              self._encoding)
+        except OSError:
+            return None
+
+        source.index_all()
+        if len(source) != (len(self._data) if self._rows is None else self._nrecords):
+            source.close()
+            return None
+        return source
+
+    def _table_records(self):
+        """The record of the source (see _source()) that each row of the table is, or -1"""
+        if self._records is None:
+            records = array('q', range(self._nrecords))
+        else:
+            records = array('q', self._records)
+        # (the inserted rows, and the edited ones, are written out)
+        records.extend(repeat(-1, len(self._data) - len(records)))
+        for row in self._dirty:
+            records[row] = -1
+        return array('q', map(records.__getitem__, self._rows))
+
+    def save_csv(self, csvfile=None):
+        """
+        Write the data to `csvfile` (by default, the file it was read
+        from), replacing the file atomically.
+
+        Records that haven't been edited are copied straight from the
+        original file; only the edited rows are re-serialised.
+
+        :return: False if the file can't be saved yet (i.e. while it is
+            still being loaded)
+        """
+        if self.loading:
+            return False
+
+        csvfile = csvfile or self._currfile
+
+        # a lazily-indexed file needs to be indexed to the end
+        self._fetch_all()
+
+        source = self._source()
+        # (can't copy any records if the columns were moved)
+        dirty = None if source is None else self._dirty
+        table = self._rows
+        records = None if source is None or table is None else self._table_records()
+
+        if self._has_header and (source is None or self._header_dirty):
+            headers = self._headers
+        else:
+            headers = None
+
+        data, columns = self._data, self._columns
+
+        def get_row(i):
+            if table is not None:
+                i = table[i]
+            row = [data.get(i, slot) for slot in columns]
+            if ordered:
+                # a short row is saved as short as it was (unless cells
+                # past its end were filled in)
+                length = data.row_length(i)
+                while len(row) > length and row[-1] is None:
+                    row.pop()
+            return row
+
+        ordered = columns == list(range(len(columns)))
+        try:
+            save_csv(csvfile, get_row, len(data) if table is None else len(table),
+                     self._dialect, headers, source, dirty, self._encoding, records)
+        finally:
+            if source is not None and source is not self._data:
+                source.close()
+
+        self._currfile = csvfile
+        self._reset_undo(clear=False)
+        # (saving replaced the file, so the rows are all there is to it)
+        self._read_end = os.path.getsize(csvfile)
+        self._reset_follow(csvfile)
+
+        if self.dialect_cache is not None:
+            # (only the skipped lines of the original are kept, if any)
+            skip = self._skip if source is not None else 0
+            self.dialect_cache.put(csvfile, self._dialect, self._has_header, skip)
+
+        # (a LazyRows store still reads from -- and so compares against --
+        # the original file, so its edits stay dirty)
+        if not isinstance(self._data, LazyRows):
+            self._source_stat = self._stat(csvfile)
+            self._compression = compression(csvfile)
+            self._dirty = set()
+            self._header_dirty = False
+            self._columns_changed = False
+            if table is not None:
+                # (the records of the file are the rows of the table)
+                self._records = array('q', repeat(-1, len(data)))
+                for i, row in enumerate(table):
+                    self._records[row] = i
+                self._nrecords = len(table)
+            if source is None:
+                # nothing was copied from the original, so any lines
+                # that were skipped when reading it are gone now
+                self._skip = 0
+        return True
+
+    # region background loading
+
+    def _start_loader(self, source, total):
+        self._loader = CSVLoader(source, total)
+        self._loader.chunkReady.connect(self._on_chunk_ready)
+        self._loader.progress.connect(self._on_load_progress)
+        self._loader.error.connect(self._on_load_error)
+        self._loader.finished.connect(self._on_load_finished)
+        self._thread = start_loader(self._loader)
+
+    @property
+    def loading(self):
+        """True while rows are being loaded in the background"""
+        return self._loader is not None
+
+    def cancel_load(self):
+        """
+        Stop a background load that is in progress. The rows that have
+        already been read are kept.
+        """
+        if self._loader is not None:
+            self._loader.cancel()
+            self._thread.wait()
+            # deliver the batches (and finished signal) that are still
+            # queued; these are posted to PyQt's slot proxies rather than
+            # to the model itself, hence no receiver
+            QCoreApplication.sendPostedEvents(None, QEvent.MetaCall)
+
+    def _on_chunk_ready(self, chunk):
+        # ignore stragglers from a load that has since been replaced
+        if self.sender() is not self._loader:
+            return
+        if not chunk.nrows:
+            # (just skipped blank rows, to count)
+            self._data.extend_chunk(chunk)
+            return
+
+        first, end = self.rowCount(), len(self._data)
+        self.beginInsertRows(QModelIndex(), first, first + chunk.nrows - 1)
+        self._data.extend_chunk(chunk)
+        self._order.extend(end, len(self._data))
+        self.endInsertRows()
+        self._widen()
+
+    def _on_load_progress(self, done, total):
+        if self.sender() is self._loader:
+            self._stats.bytes_read = done
+            # (the file may have grown while it was read)
+            self._read_end = max(self._read_end, done)
+            self.loadProgress.emit(done, total)
+
+    def _on_load_error(self, message):
+        if self.sender() is self._loader:
+            print(f"Error while loading {self._currfile}: {message}")
+            if isinstance(self._data, SQLiteRows):
+                # (so the database isn't taken for the whole file)
+                self._data.end_import(complete=False)
+            self.loadError.emit(message)
+
+    def _on_load_finished(self, cancelled):
+        if self.sender() is not self._loader:
+            return
+
+        self._thread.wait()
+        self._loader = self._thread = None
+        if isinstance(self._data, SQLiteRows):
+            self._data.end_import(complete=not cancelled)
+        else:
+            # (for a table that turned out to be small)
+            self._data.infer_types()
 
-            with open(csvfile, newline='') as f:
-                self.beginResetModel()
+        self._stats.cancelled = cancelled
+        self._finish_stats(self._stats.bytes_read if cancelled else None)
+        self.loadFinished.emit(cancelled)
 
-                self._currfile = csvfile
-                self._data = []
-                self._headers = []
+    # endregion
 
-                # skip lines if requested
-                if skip > 0:
-                    for _ in range(skip):
-                        f.readline()
+    # region following
 
-                if header:
-                    reader = csv.DictReader(f, dialect=custom_dialect)
-                    # reader = csv.DictReader(f)
-                    print("DictReader")
+    @property
+    def following(self):
+        return self._follow
 
-                    # copy the header names
-                    self._headers = list(reader.fieldnames)
+    def set_following(self, follow):
+        """
+        Follow the file (like `tail -f`): add the rows appended to it as
+        they're written, without reading it again. If the file is
+        truncated or replaced (when a log is rotated, say), it's read
+        again from the start.
 
-                    # TODO: handle "restval", ie scenarios where some rows are too long or too short
-                    for row in reader:
-                        self._data.append(row)
+        A file can't be followed once rows have been inserted, removed or
+        moved, or columns removed, until it's loaded again.
+        """
+        refused = follow and (self._rows is not None or len(self._columns) < self._data.ncols)
+        was, self._follow = self._follow, follow and not refused
+        self._reset_follow(self._currfile)
+        if self._follow != was or refused:
+            self.followingChanged.emit(self._follow)
+
+    def _reset_follow(self, csvfile):
+        """Stop following the current file, and start following `csvfile` if following"""
+        self._tail = None
+        self._tail_partial = False
+        self._follow_timer.stop()
+        self._follow_soon.stop()
+        if self._watcher.files():
+            self._watcher.removePaths(self._watcher.files())
+
+        if self._follow and csvfile:
+            self._watcher.addPath(csvfile)
+            self._follow_timer.start()
+            # (the position to follow from is taken once the file has
+            # been loaded)
+            self._follow_soon.start()
+
+    def _on_file_changed(self, path):
+        if not self._follow_soon.isActive():
+            self._follow_soon.start()
+        # (a file that was replaced is no longer watched)
+        if path not in self._watcher.files() and os.path.exists(path):
+            self._watcher.addPath(path)
+
+    def _new_tail(self):
+        if isinstance(self._data, LazyRows):
+            return FileTail(self._currfile, self._dialect, self._data.size)
+
+        # (the rows are added to the store as raw text)
+        tail = FileTail(self._currfile, self._dialect, self._read_end, RAW_ENCODING)
+        # (an unfinished last line was read as a row of its own)
+        self._tail_partial = len(self._data) > 0 and tail.rewind_partial()
+        return tail
+
+    def _check_follow(self):
+        # (a compressed file can't be read from the middle, nor can a
+        # file in an encoding like UTF-16 be read from a byte offset; and
+        # the end of the records of a tokenizer format isn't looked for)
+        if (not self._follow or self.loading or not self._currfile or self._compression
+                or not byte_level(self._encoding) or needs_tokenizer(self._dialect)):
+            return
 
-                else:
-                    # todo: allow manually specifying the first row as a header if the sniffer fails to sniff it
-                    reader = csv.reader(f, dialect=custom_dialect)
-                    # reader = csv.reader(f)
-                    print("reader")
+        try:
+            if self._tail is None:
+                self._tail = self._new_tail()
+            status = self._tail.status()
+
+            if status in ("truncated", "replaced") or status and not self._headers:
+                self._reload_followed(status)
+            elif status:
+                self._read_appended()
+        except OSError:
+            # (gone for a moment while being rotated, maybe)
+            self._tail = None
+
+    def _read_appended(self):
+        if isinstance(self._data, LazyRows):
+            last = len(self._data) - 1
+            if self._data.grow():
+                self._tail.skip_to(self._data.size)
+                # (the last record may have been unfinished)
+                if last >= 0:
+                    self._emit_changed([last], self._columns)
+            self._index_more()
+            more = self.canFetchMore()
+        else:
+            rows = self._tail.read(self.follow_chunk)
+            self._append_rows(rows)
+            # (an unfinished line doesn't count)
+            more = bool(rows) and self._tail.status() == "grown"
+
+        # (the rows still correspond to the records of the file)
+        self._source_stat = self._stat(self._currfile)
+        if more and not self._follow_soon.isActive():
+            self._follow_soon.start()
+
+    def _append_rows(self, rows):
+        if rows and self._tail_partial:
+            # the row read from the unfinished last line is complete now
+            self._tail_partial = False
+            row = len(self._data) - 1
+            # (as read, like the rest)
+            self._colstats.invalidate()
+            self._data.replace_row(row, rows.pop(0))
+            for slot in range(len(self._columns)):
+                self._order.invalidate(slot)
+                self._search.cell_changed(row, slot, self._data.get(row, slot))
+            self._emit_changed([row], self._columns)
+
+        # (blank rows are only counted, unless they're kept)
+        count = len(rows) if self._data.keep_blank else sum(map(bool, rows))
+        if not count:
+            self._data.extend(rows)
+        else:
+            first, end = self.rowCount(), len(self._data)
+            self.beginInsertRows(QModelIndex(), first, first + count - 1)
+            self._data.extend(rows)
+            self._order.extend(end, len(self._data))
+            self.endInsertRows()
+        self._widen()
+
+    def _reload_followed(self, reason):
+        print(f"Reloading {self._currfile}: {reason}")
+        lazy = isinstance(self._data, LazyRows)
+        self._load_rows(self._currfile, self._dialect, self._has_header, self._skip,
+                        lazy, background=not lazy, encoding=self._encoding)
+        self.followReloaded.emit(reason)
 
-                    try:
-                        first_row = next(reader)
-                        # create generic header names
-                        self._headers = ["Column {}".format(i+1) for i in range(len(first_row))]
+    # endregion
 
-                        # XXX: should we skip blank rows? If not, we could end up with a dict full of Nones
-                        self._data=[OrderedDict(zip(self._headers, first_row))]
+    def load_csv(self, csvfile, delims=None, lazy=None, background=False, encoding=None):
+        """
+        Load a csv file to back the model.
 
-                        for row in reader:
-                            self._data.append(OrderedDict(zip(self._headers, row)))
+        The format of the file is taken from the dialect cache or, if the
+        file isn't in there, sniffed from samples of the file. Its encoding
+        is detected (see charset.detect_encoding()) unless it's given.
 
-                    except StopIteration:
-                        # no data
-                        pass
+        :param lazy: if True, only index the record offsets of the file
+            and parse rows on demand; if False, read the entire file into
+            memory. The default is to choose based on the file size.
+        :param background: if True, return as soon as the first screen of
+            rows has been read, and read the rest in a worker thread
+        """
 
-                self.endResetModel()
+        # XXX: should we actually load the entire file into memory? What's the alternative?
+        # --> for big files, LazyRows
+
+        try:
+            stats = LoadStats(csvfile)
+
+            ## determine encoding, dialect and header
+
+            stats.start("sniff")
+            encoding = encoding or detect_encoding(csvfile)
+            try:
+                dialect, self._has_header, skip, stats.cached_dialect = detect_format(
+                    csvfile, delims, self.dialect_cache, encoding)
+            except csv.Error as csve:
+                print("CSVerror:", csve)
+                raise
+            stats.end()
+
+            lazy = self._use_lazy(csvfile, lazy, encoding, dialect)
+            # (sniffing several samples, voting on the result and checking
+            # it against them is reliable enough to actually use the
+            # sniffed dialect)
+            self._load_rows(csvfile, dialect, self._has_header, skip, lazy, background, stats,
+                            encoding)
+
+        except IOError as e:
+            print(f"IOError: could not load {csvfile}")
+            print(e)
+
+    def load_csv_manual(self, csvfile, custom_dialect, header=False, skip=0, lazy=None,
+                        background=False, encoding=None):
+        """Load a csv file to back the model, using the given dialect"""
+
+        try:
+            encoding = encoding or detect_encoding(csvfile)
+            lazy = self._use_lazy(csvfile, lazy, encoding, custom_dialect)
+            self._load_rows(csvfile, custom_dialect, header, skip, lazy, background,
+                            encoding=encoding)
 
+            if self.dialect_cache is not None:
+                self.dialect_cache.put(csvfile, custom_dialect, header, skip, manual=True)
 
         except IOError as e:
             print(f"IOError: could not load {csvfile}")
@@ -0,0 +1,195 @@
+import csv
+import io
+import locale
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from charset import RAW_ENCODING, CellCodec, bom_length
+from sniff import dialect_params
+from store import ColumnChunk
+from tokenizer import needs_tokenizer
+
+# nominal size of each range handed to a worker
+RANGE_BYTES = 8 * 1024 * 1024
+
+# ...except for the first one, which is kept small so that the first
+# screen of rows is ready quickly
+FIRST_RANGE_BYTES = 256 * 1024
+
+
+def can_split(dialect):
+    """
+    Whether record boundaries can be found by counting quote characters.
+    An escape character can hide a quote, which throws off the count, and
+    the quotes of a tokenizer format can't be counted like that.
+    """
+    return not dialect.escapechar and not needs_tokenizer(dialect)
+
+
+def _read_record(f, quote):
+    """
+    Read lines from binary file `f` up to the end of the current record.
+    A quoted field can contain newlines, so a line with an odd number of
+    quote characters means the record continues on the next line.
+    """
+    record = f.readline()
+    if quote and record.count(quote) & 1:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            record += line
+            if line.count(quote) & 1:
+                break
+    return record
+
+
+def record_boundaries(f, start, end, quote, step=RANGE_BYTES, first_step=FIRST_RANGE_BYTES):
+    """
+    Yield the offsets of record boundaries in binary file `f`, roughly
+    `step` bytes apart, from `start` up to (and including) `end`.
+
+    :param bytes quote: the quote character, or None if quotes aren't
+        special
+    """
+    pos, step_size = start, first_step
+    while pos < end:
+        target = pos + step_size
+        step_size = step
+
+        if target >= end:
+            yield end
+            return
+
+        # is `target` inside a quoted field?
+        f.seek(pos)
+        inquote = bool(quote) and f.read(target - pos).count(quote) & 1
+
+        # finish the line that `target` is on, then keep going until
+        # we're outside the quoted field
+        line = f.readline()
+        if quote and line.count(quote) & 1:
+            inquote = not inquote
+        while inquote and line:
+            line = f.readline()
+            if line.count(quote) & 1:
+                inquote = not inquote
+
+        pos = min(f.tell(), end)
+        yield pos
+
+
+def _parse_range(csvfile, start, end, params, ncols, keep_blank):
+    """Worker: parse the records of csvfile[start:end] into a ColumnChunk (with numbers parsed)"""
+    with open(csvfile, 'rb') as f:
+        f.seek(start)
+        # (as raw text; see charset.py)
+        text = f.read(end - start).decode(RAW_ENCODING)
+
+    rows = csv.reader(io.StringIO(text, newline=''), **params)
+    chunk = ColumnChunk.from_rows(rows, ncols, keep_blank)
+    chunk.parse_numbers()
+    return chunk
+
+
+class ParallelReader:
+    """
+    Iterate over the records of a csv file in (ColumnChunk, end offset)
+    pairs, parsed by a pool of worker processes.
+
+    The file is cut into byte ranges that each end on a real record
+    boundary (see record_boundaries()); the ranges are parsed in
+    parallel and the results are yielded in file order.
+
+    The header (or the first row, for the column count) is read up front
+    and is available from the `headers` attribute right away.
+
+    The file has to be in a byte-level encoding: the chunks hold raw
+    cells, to be decoded by `codec` (see charset.py).
+    """
+
+    def __init__(self, csvfile, dialect, header=False, skip=0, encoding=None, workers=None,
+                 keep_blank=False):
+        self._csvfile = csvfile
+        self._params = dialect_params(dialect)
+        self._encoding = encoding or locale.getpreferredencoding(False)
+        self.codec = CellCodec(self._encoding)
+        self._workers = workers or os.cpu_count() or 1
+        self._keep_blank = keep_blank
+        self._executor = None
+
+        if dialect.quoting == csv.QUOTE_NONE or not dialect.quotechar:
+            self._quote = None
+        else:
+            self._quote = dialect.quotechar.encode(self._encoding)
+
+        self._file = open(csvfile, 'rb')
+        self.size = self._file.seek(0, io.SEEK_END)
+        self._file.seek(bom_length(os.pread(self._file.fileno(), 4, 0), self._encoding))
+
+        # skip lines if requested
+        for _ in range(skip):
+            self._file.readline()
+
+        # find the first (non-blank) record
+        self.headers = []
+        while True:
+            self._start = self._file.tell()
+            record = _read_record(self._file, self._quote)
+            if not record:
+                # no data
+                return
+
+            rows = list(filter(None, csv.reader(
+                io.StringIO(record.decode(RAW_ENCODING), newline=''), **self._params)))
+            if rows:
+                first_row = rows[0]
+                break
+
+        if header:
+            # copy the header names; the data starts after the header
+            self.headers = self.codec.decode_all(first_row)
+            self._start = self._file.tell()
+        else:
+            # create generic header names
+            self.headers = ["Column {}".format(i+1) for i in range(len(first_row))]
+
+    def close(self):
+        """Close the file and stop any workers (pending ranges are dropped)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._file.close()
+
+    def __iter__(self):
+        if not self.headers:
+            return
+
+        # fork()ing a process that is running Qt threads is asking for
+        # trouble, so start the workers from scratch
+        self._executor = ProcessPoolExecutor(self._workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+        ncols = len(self.headers)
+
+        # keep a bounded number of ranges in flight, and collect the
+        # results in order
+        pending = deque()
+        start = self._start
+        for end in record_boundaries(self._file, self._start, self.size, self._quote):
+            future = self._executor.submit(_parse_range, self._csvfile, start, end,
+                                           self._params, ncols, self._keep_blank)
+            pending.append((future, end))
+            start = end
+
+            if len(pending) >= 2 * self._workers:
+                future, pos = pending.popleft()
+                yield future.result(), pos
+
+        while pending:
+            future, pos = pending.popleft()
+            yield future.result(), pos
+
+        self.close()
@@ -0,0 +1,131 @@
+from bisect import bisect_right
+from itertools import accumulate, chain
+
+
+class PieceTable:
+    """
+    The rows of a store that make up a table, in the table's order, kept
+    as a list of pieces: runs of consecutive store rows, as (first row,
+    number of rows) pairs. Inserting, removing or moving rows only splits
+    and joins pieces, so it takes time in proportion to the number of
+    pieces rather than of rows, and the rows themselves never move in the
+    store (a removed row stays there, for undo to put back).
+
+    It's a sequence of store rows: table[i] is the store row at position i.
+    """
+
+    def __init__(self, nrows=0):
+        """Start out as the rows [0, nrows) of a store, in order"""
+        self._pieces = [(0, nrows)] if nrows else []
+        self._update()
+
+    def _update(self):
+        # the position in the table of the first row of each piece, and
+        # the pieces in the order of their rows (for positions())
+        self._starts = list(accumulate((n for _, n in self._pieces), initial=0))
+        self._by_row = None
+
+    @property
+    def pieces(self):
+        """The (first row, number of rows) pieces, in order"""
+        return list(self._pieces)
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._starts[-1]:
+            raise IndexError("row index out of range")
+        p = bisect_right(self._starts, i) - 1
+        return self._pieces[p][0] + i - self._starts[p]
+
+    def __iter__(self):
+        return chain.from_iterable(range(first, first + n) for first, n in self._pieces)
+
+    def _split(self, pos):
+        """Make `pos` the start of a piece (if it's in the table), and return that piece's index"""
+        p = bisect_right(self._starts, pos) - 1
+        if p == len(self._pieces) or self._starts[p] == pos:
+            return p
+        first, n = self._pieces[p]
+        head = pos - self._starts[p]
+        self._pieces[p:p + 1] = [(first, head), (first + head, n - head)]
+        self._starts.insert(p + 1, pos)
+        return p + 1
+
+    def _join(self):
+        """Merge the pieces that continue where the one before them ends"""
+        joined = []
+        for first, n in self._pieces:
+            if joined and sum(joined[-1]) == first:
+                joined[-1] = (joined[-1][0], joined[-1][1] + n)
+            elif n:
+                joined.append((first, n))
+        self._pieces = joined
+        self._update()
+
+    def insert(self, pos, pieces):
+        """Insert pieces of store rows before position `pos`"""
+        if not 0 <= pos <= len(self):
+            raise IndexError("position out of range")
+        p = self._split(pos)
+        self._pieces[p:p] = pieces
+        self._join()
+
+    def remove(self, pos, count):
+        """Take `count` rows out of the table, from position `pos`, and return their pieces"""
+        if count < 0 or not 0 <= pos <= pos + count <= len(self):
+            raise IndexError("rows out of range")
+        first = self._split(pos)
+        end = self._split(pos + count)
+        removed = self._pieces[first:end]
+        del self._pieces[first:end]
+        self._join()
+        return removed
+
+    def move(self, pos, count, dest):
+        """
+        Move `count` rows from position `pos` to before position `dest`
+        (a position from before the move, like QAbstractItemModel.moveRows())
+        """
+        pieces = self.remove(pos, count)
+        self.insert(dest if dest <= pos else dest - count, pieces)
+
+    def extend(self, first, end):
+        """Add the store rows [first, end) to the end of the table"""
+        if first < end:
+            self._pieces.append((first, end - first))
+            self._join()
+
+    def positions(self, rows):
+        """Where the given store rows are in the table (-1 if they aren't in it)"""
+        if self._by_row is None:
+            order = sorted(range(len(self._pieces)), key=lambda p: self._pieces[p][0])
+            self._by_row = ([self._pieces[p][0] for p in order], order)
+        firsts, order = self._by_row
+
+        result = []
+        for row in rows:
+            i = bisect_right(firsts, row) - 1
+            pos = -1
+            if i >= 0:
+                p = order[i]
+                first, n = self._pieces[p]
+                if row < first + n:
+                    pos = self._starts[p] + row - first
+            result.append(pos)
+        return result
+
+
+def runs(positions):
+    """
+    Group a descending sequence of positions into (first, count) runs of
+    consecutive ones (the last run first)
+    """
+    result = []
+    for pos in positions:
+        if result and result[-1][0] == pos + 1:
+            result[-1] = (pos, result[-1][1] + 1)
+        else:
+            result.append((pos, 1))
+    return result
@@ -0,0 +1,256 @@
+"""
+Reading the rows of a lazily-loaded file (or of one imported into
+SQLite) ahead of where the table is being scrolled, in a background
+thread, so that drawing the table never waits for the file.
+
+The stores that read their rows on demand (LazyRows and SQLiteRows) do
+so a block of rows at a time, and cache the blocks; RowPrefetcher reads
+the blocks that are about to be needed with their read_block(), in
+another thread, and hands them to the store's cache in the GUI thread
+(add_block()). A block that was read while the store changed (as
+`block_version` tells) is dropped.
+"""
+
+import threading
+import time
+from collections import deque
+from itertools import chain
+
+from PyQt5.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+
+from rowindex import LazyRows
+from sqlstore import SQLiteRows
+
+
+class RowPrefetcher(QObject):
+    """
+    Reads blocks of rows of a store in a background thread: those of the
+    rows that a view shows, then the ones ahead of them in the direction
+    it's being scrolled in, as many as it would scroll past in
+    `lookahead` seconds at its current speed. Each time the view moves,
+    what's still to be read is replaced, so that after a jump the blocks
+    meant for where the view was are dropped rather than read.
+
+    `hits` and `misses` count the rows that had (or hadn't) been read
+    when they were scrolled into view.
+    """
+
+    # read ahead as far as the view scrolls in this many seconds
+    lookahead = 1.0
+    # (but at least this many screenfuls)
+    min_pages = 2
+    # share of the store's cache of blocks that's filled by reading ahead
+    # (so that the blocks in view aren't pushed out of it)
+    cache_share = 0.5
+
+    # after a pause of this many seconds, the speed is estimated afresh
+    # (the first move after one, a click in the scroll bar, say, says
+    # nothing about it)
+    pause = 0.3
+
+    # a block of rows that was wanted for rows being shown has been read
+    blockRead = pyqtSignal()
+    # (store, block, rows or None, block version), from the thread
+    _read = pyqtSignal(object, object, object, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._store = None
+        self.hits = self.misses = 0
+
+        # (store, block, block version) of the blocks still to be read,
+        # which the thread takes from the front
+        self._queue = deque()
+        self._wakeup = threading.Condition()
+        # True while the thread reads a block
+        self._reading = False
+        self._thread = None
+        self._closed = False
+
+        # the blocks of rows that were shown before they were read, and
+        # the ones to read ahead
+        self._waiting = set()
+        self._ahead = []
+        # the blocks that are left for the store to read when they're
+        # needed (the end of a file that's still being indexed, say)
+        self._unreadable = set()
+
+        # the rows in view, when they were, and how fast the view is
+        # being scrolled (in rows per second; negative when going up)
+        self._visible = (0, 0)
+        self._time = None
+        self._speed = 0.0
+        self._direction = 1
+
+        self._read.connect(self._on_read)
+        # (the rows missed while the table is drawn are asked for at once)
+        self._request_soon = QTimer(self, singleShot=True, interval=0, timeout=self._request)
+
+        # (a thread still reading, or handing a block over, while the
+        # application is torn down can crash it)
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.close)
+
+    def set_store(self, store):
+        """
+        Read the rows of `store` (if it's one that reads them on demand)
+        from now on. Once this returns, the thread is done reading from
+        the previous store, which can be closed.
+        """
+        with self._wakeup:
+            self._queue.clear()
+            while self._reading:
+                self._wakeup.wait()
+            self._store = store if isinstance(store, (LazyRows, SQLiteRows)) else None
+
+        self.hits = self.misses = 0
+        self._waiting.clear()
+        self._ahead = []
+        self._unreadable.clear()
+        self._visible = (0, 0)
+        self._time = None
+        self._speed = 0.0
+        self._direction = 1
+
+    def close(self):
+        """Stop reading, and wait for the thread to finish"""
+        with self._wakeup:
+            self._closed = True
+            self._queue.clear()
+            self._wakeup.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._store = None
+
+    def ready(self, i):
+        """
+        True if row `i` of the store can be had without reading the file;
+        if it can't, it's read in the background (see `blockRead`)
+        """
+        store = self._store
+        if store is None:
+            return True
+        b = store.block_of(i)
+        if b is None or store.has_block(b) or b in self._unreadable:
+            return True
+        if b not in self._waiting:
+            self._waiting.add(b)
+            self._request_soon.start()
+        return False
+
+    def scrolled(self, first, end, nrows, store_row):
+        """
+        The view has moved to show rows [first, end) of its `nrows`, which
+        are rows `store_row(row)` of the store: read them, and the rows
+        ahead of them
+        """
+        store = self._store
+        if store is None:
+            return
+
+        now = time.monotonic()
+        page = max(end - first, 1)
+        prev_first, prev_end = self._visible
+        moved = first - prev_first
+        if self._time is None or now - self._time > self.pause:
+            self._speed = 0.0
+        else:
+            # (averaged, as the steps of scrolling are uneven)
+            self._speed = (self._speed + moved / max(now - self._time, 0.001)) / 2
+        if moved:
+            self._direction = 1 if moved > 0 else -1
+        self._time = now
+        self._visible = (first, end)
+
+        # the blocks of the rows in view (counting the rows that weren't
+        # in view before), then those of the rows ahead, in the order
+        # they'll be needed
+        blocks = {}
+        for row in range(first, end):
+            b = store.block_of(store_row(row))
+            if b is None:
+                continue
+            blocks[b] = None
+            if not prev_first <= row < prev_end:
+                if store.has_block(b):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        # (the rows that went out of view don't need drawing)
+        self._waiting.intersection_update(blocks)
+
+        count = int(max(self.min_pages * page, abs(self._speed) * self.lookahead))
+        if self._direction > 0:
+            ahead = range(end, min(end + count, nrows))
+        else:
+            ahead = range(first - 1, max(first - count, 0) - 1, -1)
+
+        limit = max(1, int(store.cache_blocks * self.cache_share))
+        for row in ahead:
+            if len(blocks) >= limit:
+                break
+            b = store.block_of(store_row(row))
+            if b is not None:
+                blocks[b] = None
+        self._ahead = list(blocks)
+        self._request()
+
+    def _request(self):
+        """Have the thread read the blocks that are waited for, then the ones ahead"""
+        store = self._store
+        if store is None or self._closed:
+            return
+        version = store.block_version
+        blocks = dict.fromkeys(b for b in chain(self._waiting, self._ahead)
+                               if not store.has_block(b) and b not in self._unreadable)
+
+        with self._wakeup:
+            # (anything that was still to be read is dropped)
+            self._queue = deque((store, b, version) for b in blocks)
+            self._wakeup.notify()
+
+        if self._thread is None and blocks:
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._queue and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                store, b, version = self._queue.popleft()
+                self._reading = True
+
+            try:
+                rows = store.read_block(b)
+            except Exception:
+                # (the store may have changed under it; the block is then
+                # left for the store to read)
+                rows = None
+            finally:
+                with self._wakeup:
+                    self._reading = False
+                    self._wakeup.notify_all()
+
+            try:
+                self._read.emit(store, b, rows, version)
+            except RuntimeError:
+                # the prefetcher is gone (as the application quits)
+                return
+
+    def _on_read(self, store, b, rows, version):
+        # ignore stragglers from a store that has since been replaced
+        if store is not self._store:
+            return
+        if rows is None:
+            self._unreadable.add(b)
+        else:
+            store.add_block(b, rows, version)
+
+        if b in self._waiting:
+            self._waiting.discard(b)
+            self.blockRead.emit()
@@ -0,0 +1,305 @@
+"""
+Command-line tools for processing csv files without the GUI.
+
+    python quicsv.py convert in.csv -o out.tsv --delimiter tab
+    python quicsv.py convert in.csv -c name,3 -w price ">=10"
+    python quicsv.py convert data/*.csv -d converted/ -j 8
+    python quicsv.py sniff data/*.csv > formats.jsonl
+
+`convert` streams each file from input to output a row at a time (so
+files of any size are converted in constant memory), optionally changing
+the format, selecting or reordering columns and filtering rows. Inputs
+may be compressed (gzip, bzip2, xz, zstd); an output named *.gz (etc.)
+is compressed. `sniff` prints the detected format of each file as a
+line of JSON. Several files are processed at once by a pool of worker
+processes.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from charset import detect_encoding
+from coltypes import SAMPLE_SIZE, infer_type
+from compressed import compressing_writer, compression_for_name
+from core import RecordStream, detect_format, guess_line_terminator
+from sniff import dialect_params, make_dialect
+from sortfilter import Filter
+from tokenizer import writer as row_writer
+from writer import atomic_write
+
+_QUOTING = {
+    "minimal": csv.QUOTE_MINIMAL,
+    "all": csv.QUOTE_ALL,
+    "nonnumeric": csv.QUOTE_NONNUMERIC,
+    "none": csv.QUOTE_NONE,
+}
+
+_CHAR_NAMES = {
+    "tab": "\t",
+    "comma": ",",
+    "semicolon": ";",
+    "pipe": "|",
+    "space": " ",
+}
+
+
+def _char(text):
+    """A character given on the command line: a name (tab...), an escape (\\t) or itself"""
+    return _CHAR_NAMES.get(text.lower(), text.encode().decode("unicode_escape"))
+
+
+def resolve_columns(specs, headers):
+    """
+    The indexes of the columns named by `specs`: header names, or else
+    column numbers (counting from 1)
+
+    :raises ValueError: for a column that doesn't exist
+    """
+    columns = []
+    for spec in specs:
+        if spec in headers:
+            columns.append(headers.index(spec))
+        elif spec.isdigit() and 1 <= int(spec) <= len(headers):
+            columns.append(int(spec) - 1)
+        else:
+            raise ValueError(f"no column {spec!r}")
+    return columns
+
+
+def _output_dialect(dialect, options):
+    params = dialect_params(dialect)
+    for key in ("delimiter", "quotechar", "closequote", "escapechar"):
+        if options.get(key) is not None:
+            params[key] = options[key]
+    if options.get("quoting"):
+        params["quoting"] = _QUOTING[options["quoting"]]
+    return make_dialect(params, "output_dialect")
+
+
+def _row_filter(rows, headers, where):
+    """
+    Filter `rows` by the (column, condition) pairs of `where`, comparing
+    values as the type of their column (as inferred from the first rows)
+
+    :return: the rows that match all the conditions
+    """
+    slots = resolve_columns([column for column, _ in where], headers)
+
+    # (only the sample is held in memory)
+    rows = iter(rows)
+    sample = list(islice(rows, SAMPLE_SIZE))
+    filters = []
+    for slot, (_, condition) in zip(slots, where):
+        ctype = infer_type(row[slot] if slot < len(row) else None for row in sample)
+        filters.append((slot, Filter(condition, ctype).predicate))
+
+    def matches(row):
+        return all(predicate(row[slot] if slot < len(row) else None)
+                   for slot, predicate in filters)
+
+    return filter(matches, chain(sample, rows))
+
+
+def convert_file(src, dst, options):
+    """
+    Stream the rows of csv file `src` to `dst` ("-" for stdout).
+
+    :param options: dict of the conversion settings (see main())
+    :return: (rows read, rows written)
+    :raises BadSniffException: if the format of `src` can't be worked out
+    """
+    encoding = options.get("encoding") or detect_encoding(src)
+    dialect, header, skip, _ = detect_format(src, options.get("delimiters"), encoding=encoding)
+    if options.get("input_header") is not None:
+        header = options["input_header"]
+
+    out_dialect = _output_dialect(dialect, options)
+    lineterminator = options.get("lineterminator") or guess_line_terminator(src)
+
+    with RecordStream(src, dialect, header, skip, encoding) as stream:
+        headers = stream.headers
+        columns = resolve_columns(options["columns"], headers) if options.get("columns") else None
+
+        counted = [0]
+
+        def count(row):
+            counted[0] += 1
+            return row
+
+        rows = map(count, stream)
+        if options.get("where"):
+            rows = _row_filter(rows, headers, options["where"])
+        if columns is not None:
+            headers = [headers[i] for i in columns]
+            rows = ([row[i] if i < len(row) else "" for i in columns] for row in rows)
+
+        def write(f):
+            # (bytes that weren't valid in the input's encoding are kept)
+            out = io.TextIOWrapper(f, encoding=options.get("output_encoding") or encoding,
+                                   errors='surrogateescape', newline='')
+            writer = row_writer(out, out_dialect, lineterminator=lineterminator)
+            if header and options.get("header", True):
+                writer.writerow(headers)
+            written = 0
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+            out.flush()
+            # (the file is closed by whoever opened it)
+            out.detach()
+            return written
+
+        kind = None if dst == "-" else compression_for_name(dst)
+        if dst == "-":
+            written = write(sys.stdout.buffer)
+        elif kind is not None:
+            with atomic_write(dst) as f, compressing_writer(f, kind) as cf:
+                written = write(cf)
+        else:
+            with atomic_write(dst) as f:
+                written = write(f)
+
+    return counted[0], written
+
+
+def _convert_job(job):
+    src, dst, options = job
+    try:
+        return src, dst, convert_file(src, dst, options), None
+    except Exception as e:
+        return src, dst, None, str(e) or type(e).__name__
+
+
+def _sniff_job(src):
+    try:
+        encoding = detect_encoding(src)
+        dialect, header, skip, _ = detect_format(src, encoding=encoding)
+    except Exception as e:
+        return {"path": src, "error": str(e) or type(e).__name__}
+    return {"path": src, "encoding": encoding, "dialect": dialect_params(dialect),
+            "header": header, "skip": skip}
+
+
+def run_jobs(func, jobs, workers=None):
+    """Yield the results of `func` for each of `jobs`, in order, using a pool of `workers` processes"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 2:
+        yield from map(func, jobs)
+        return
+
+    with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+        yield from executor.map(func, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+
+
+def _convert(args):
+    if len(args.inputs) > 1 and not args.output_dir:
+        sys.exit("quicsv convert: several inputs need an --output-dir")
+
+    options = {
+        "delimiters": args.delimiters,
+        "input_header": args.input_header,
+        "encoding": args.encoding,
+        "output_encoding": args.output_encoding,
+        "delimiter": args.delimiter,
+        "quotechar": args.quotechar,
+        "closequote": args.closequote,
+        "escapechar": args.escapechar,
+        "quoting": args.quoting,
+        "lineterminator": args.lineterminator,
+        "header": args.header,
+        "columns": [c for spec in args.columns for c in spec.split(",") if c],
+        "where": args.where,
+    }
+
+    jobs = []
+    for src in args.inputs:
+        if args.output_dir:
+            dst = os.path.join(args.output_dir, os.path.basename(src))
+        else:
+            dst = args.output or "-"
+        jobs.append((src, dst, options))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    failed = 0
+    for src, dst, counts, error in run_jobs(_convert_job, jobs, args.jobs):
+        if error:
+            failed += 1
+            print(f"quicsv: {src}: {error}", file=sys.stderr)
+        elif not args.quiet and dst != "-":
+            print(f"{src} -> {dst}: {counts[1]} of {counts[0]} rows", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _sniff(args):
+    failed = 0
+    for result in run_jobs(_sniff_job, args.inputs, args.jobs):
+        failed += "error" in result
+        print(json.dumps(result))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="quicsv", description="Process csv files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="convert csv files to another format",
+                                  description="Stream csv files to new files, changing their "
+                                              "format, columns or rows along the way")
+    convert.add_argument("inputs", nargs="+", metavar="INPUT")
+    convert.add_argument("-o", "--output", help="output file (default: stdout)")
+    convert.add_argument("-d", "--output-dir", help="write each output, under the name of "
+                                                    "its input, to this directory")
+    convert.add_argument("-j", "--jobs", type=int,
+                         help="files to convert at once (default: one per CPU)")
+    convert.add_argument("-q", "--quiet", action="store_true", help="only report errors")
+
+    group = convert.add_argument_group("input")
+    group.add_argument("--delimiters", help="the delimiters to choose from when sniffing")
+    group.add_argument("--input-header", choices=("yes", "no"),
+                       help="whether the input has a header (default: sniffed)")
+    group.add_argument("--encoding", help="encoding of the input (default: detected)")
+
+    group = convert.add_argument_group("output format (default: that of the input)")
+    group.add_argument("--delimiter", type=_char, help="field delimiter (characters, or "
+                                                       "tab, comma, semicolon, pipe, space)")
+    group.add_argument("--quotechar", type=_char, help="the (opening) quote; can be "
+                                                       "several characters, like <<")
+    group.add_argument("--closequote", type=_char, help="the closing quote, if it's "
+                                                        "different (like } for {)")
+    group.add_argument("--escapechar", type=_char)
+    group.add_argument("--quoting", choices=sorted(_QUOTING))
+    group.add_argument("--lineterminator", type=_char, help="e.g. \\n or \\r\\n")
+    group.add_argument("--output-encoding", help="(default: that of the input)")
+    group.add_argument("--no-header", dest="header", action="store_false",
+                       help="leave out the header")
+
+    group = convert.add_argument_group("rows and columns")
+    group.add_argument("-c", "--columns", action="append", default=[],
+                       help="comma-separated columns to keep, in order (names, or "
+                            "numbers counting from 1)")
+    group.add_argument("-w", "--where", nargs=2, action="append", metavar=("COLUMN", "CONDITION"),
+                       help="only keep the rows whose COLUMN matches CONDITION: text to look "
+                            "for, or =, !=, <, <=, >, >= and a value (repeatable)")
+    convert.set_defaults(func=_convert)
+
+    sniff = commands.add_parser("sniff", help="print the format of csv files (as JSON lines)")
+    sniff.add_argument("inputs", nargs="+", metavar="INPUT")
+    sniff.add_argument("-j", "--jobs", type=int,
+                       help="files to sniff at once (default: one per CPU)")
+    sniff.set_defaults(func=_sniff)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "input_header", None):
+        args.input_header = args.input_header == "yes"
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
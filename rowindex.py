@@ -0,0 +1,630 @@
+import csv
+import io
+import locale
+import mmap
+import os
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, repeat
+
+import sidecar
+from charset import RAW_ENCODING, CellCodec, bom_length
+from compressed import CompressedBuffer, compression
+from sniff import dialect_params
+from store import ScanReport
+
+# how many bytes of the file to index per call to LazyRows.index_more()
+INDEX_CHUNK = 4 * 1024 * 1024
+
+# rows are decoded (and cached) in blocks of this many records
+BLOCK_ROWS = 256
+
+
+def _has_blank(chunk):
+    """True if a chunk of whole lines has a blank one"""
+    return (b'\n\n' in chunk or b'\n\r\n' in chunk or chunk.startswith((b'\n', b'\r\n'))
+            or chunk.endswith(b'\n\r'))
+
+
+class LazyRows:
+    """
+    Offset-indexed, read-only view of the records in a csv file.
+
+    The file is mmapped and scanned (incrementally) for the byte offset
+    of each record; a record is only parsed when it is requested, and
+    decoded rows are kept in a bounded LRU cache. Memory use thus grows
+    with the size of the offset index (8 bytes per record) rather than
+    with the contents of the cells.
+
+    Cells are addressed by (row, slot) just like in a ColumnStore; rows
+    that have been edited are copied to a separate table of edits that
+    is never evicted.
+
+    A compressed file is decompressed as it is indexed, and records are
+    read from it through a CompressedBuffer instead of an mmap (and
+    offsets are those in the decompressed data).
+
+    The file has to be in a byte-level encoding: records are parsed as
+    raw text, and cells are decoded when they're read (see charset.py).
+
+    While indexing, the fields of each record are counted (by counting
+    the delimiters outside quotes, which an escape character can throw
+    off) for the `report` of short, long and blank rows; a long row adds
+    columns, with generic header names.
+    """
+
+    def __init__(self, csvfile, dialect=csv.excel, header=False, skip=0,
+                 encoding=None, cache_rows=20000, index_dir=None, keep_blank=False):
+        """
+        :param index_dir: if given, the offset index is read from (or,
+            once the file has been fully indexed, saved to) an index file
+            in this directory; see sidecar.py
+        :param keep_blank: if False, blank lines aren't records
+        """
+        self._file = open(csvfile, 'rb')
+        self._compression = compression(csvfile)
+
+        if self._compression:
+            self._buf = CompressedBuffer(csvfile, self._compression)
+            self._buf.extend(INDEX_CHUNK)
+            self._size = size = self._buf.size
+            # (the offsets aren't those of the file)
+            index_dir = None
+        else:
+            self._size = size = self._file.seek(0, io.SEEK_END)
+            # can't mmap an empty file
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        self._dialect = dialect
+        self._encoding = encoding or locale.getpreferredencoding(False)
+        self._codec = CellCodec(self._encoding)
+
+        # with QUOTE_NONE, the quotechar has no special meaning
+        if dialect.quoting == csv.QUOTE_NONE or not dialect.quotechar:
+            self._quote = None
+        else:
+            self._quote = dialect.quotechar.encode(self._encoding)
+        self._delim = dialect.delimiter.encode(self._encoding)
+        self._keep_blank = keep_blank
+
+        self._cache = OrderedDict()
+        self._max_blocks = max(1, cache_rows // BLOCK_ROWS)
+        # goes up whenever blocks that were read may have changed (see add_block())
+        self.block_version = 0
+        # the buffer that blocks are read from in another thread, for a
+        # compressed file (see read_block())
+        self._reader_buf = None
+        self._edits = {}
+        # number of (empty) rows added after the records, by add_rows()
+        self._added = 0
+        # start of the last record, if it was cut off by the end of the
+        # file rather than ended by a line break (and its field count)
+        self._cut = None
+        self._cut_fields = 0
+
+        # (the width is that of the first record)
+        self.report = ScanReport()
+        # records before the first row
+        self._header_rows = 1 if header else 0
+
+        # the settings that an index file has to match
+        self._index_path = index_dir and sidecar.index_path(csvfile, index_dir)
+        self._index_meta = {"dialect": dialect_params(dialect), "header": bool(header),
+                            "skip": skip, "encoding": self._encoding,
+                            "keep_blank": bool(keep_blank)}
+        # set if the offsets are read from an index file
+        self._index = None
+
+        if self._index_path and self._read_index():
+            return
+
+        # start offset of each (non-blank) record
+        self._offsets = array('q')
+        # number of records that have been made visible through len()
+        self._count = 0
+
+        # scanning state
+        self._inquote = False
+        # delimiters found so far in the record being scanned
+        self._fields = 0
+        self._scanpos = bom_length(self._buf[:4], self._encoding)
+
+        # skip lines if requested
+        for _ in range(skip):
+            nl = self._find_newline(self._scanpos)
+            self._scanpos = self._size if nl < 0 else nl + 1
+
+        # start of the record currently being scanned; once the file
+        # has been fully indexed, this is the end of the last record
+        self._recstart = self._scanpos
+
+        self.headers = []
+
+        # byte range of the header record (empty if there's no header)
+        self.header_range = (self._scanpos, self._scanpos)
+
+        # read enough of the file to get the first record
+        while not self._offsets and not self.complete:
+            self.index_more()
+
+        if self._offsets:
+            first_row = self._parse(self._offsets[0], self._record_end(0))[0]
+
+            if header:
+                # copy the header names
+                self.headers = self._codec.decode_all(first_row)
+                self.header_range = (self._offsets[0], self._record_end(0))
+                del self._offsets[0]
+                if self._cut == self.header_range[0]:
+                    # (not a record)
+                    self._cut = None
+            else:
+                # create generic header names
+                self.headers = ["Column {}".format(i+1) for i in range(len(first_row))]
+
+        self.commit()
+
+    def _read_index(self):
+        """Take the offsets from a valid index file, if there is one"""
+        if not self._size:
+            return False
+
+        index = sidecar.read_index(self._index_path, os.fstat(self._file.fileno()), self._buf)
+        if index is None:
+            return False
+
+        meta = index.meta
+        if any(meta.get(k) != v for k, v in self._index_meta.items()):
+            # the file was indexed with different settings
+            index.close()
+            return False
+
+        self._index = index
+        self._offsets = index.offsets
+        self._count = len(index.offsets)
+        self._inquote = False
+        self._scanpos = self._size
+        self._recstart = meta["end"]
+        self.headers = meta["headers"]
+        self.header_range = tuple(meta["header_range"])
+        self.report = ScanReport.from_dict(meta["report"])
+        return True
+
+    def _write_index(self):
+        if not self._index_path or self._index is not None or not self._size:
+            return
+
+        meta = dict(self._index_meta, headers=self.headers,
+                    header_range=self.header_range, end=self._recstart,
+                    report=self.report.as_dict())
+        try:
+            sidecar.write_index(self._index_path, os.fstat(self._file.fileno()),
+                                self._buf, meta, self._offsets)
+        except OSError as e:
+            print(f"Could not write index {self._index_path}: {e}")
+
+        # (only once)
+        self._index_path = None
+
+    @property
+    def complete(self):
+        """True once the entire file has been indexed"""
+        return self._scanpos >= self._size and self._at_end
+
+    @property
+    def _at_end(self):
+        """True if all of the data is available (compressed data is decompressed bit by bit)"""
+        return not self._compression or self._buf.eof
+
+    def _more(self, nbytes=INDEX_CHUNK):
+        """Decompress more of a compressed file; :return: True if there was more"""
+        if self._at_end or not self._buf.extend(nbytes):
+            return False
+        self._size = self._buf.size
+        return True
+
+    def _find_newline(self, pos):
+        """The offset of the first line break from `pos` on, or -1"""
+        while True:
+            nl = self._buf.find(b'\n', pos, self._size)
+            if nl >= 0 or not self._more():
+                return nl
+
+    @property
+    def size(self):
+        """The size of the file, as far as it is read"""
+        return self._size
+
+    @property
+    def bytes_indexed(self):
+        """How much of the file has been indexed so far"""
+        return self._scanpos
+
+    @property
+    def from_index(self):
+        """True if the offsets were read from an index file"""
+        return self._index is not None
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+        if self._size or self._compression:
+            self._buf.close()
+        if self._reader_buf is not None:
+            self._reader_buf.close()
+        self._file.close()
+        self._cache.clear()
+
+    def index_more(self, nbytes=INDEX_CHUNK):
+        """
+        Extend the offset index by (about) `nbytes` of the file.
+
+        The new records are not visible through len() until commit()
+        is called.
+
+        :return: number of records waiting to be committed
+        """
+        if self.complete:
+            return len(self._offsets) - self._count
+
+        if self._scanpos + nbytes > self._size:
+            self._more(self._scanpos + nbytes - self._size)
+        buf, pos, size = self._buf, self._scanpos, self._size
+
+        # always stop at the end of a line
+        stop = pos + nbytes
+        if stop >= size and self._at_end:
+            stop = size
+        else:
+            stop = min(stop, size)
+            nl = buf.rfind(b'\n', pos, stop)
+            if nl < 0:
+                # a single very long line
+                nl = self._find_newline(stop)
+                size = self._size
+            stop = size if nl < 0 else nl + 1
+
+        chunk = buf[pos:stop]
+        find, count = chunk.find, chunk.count
+        q, d, offsets = self._quote, self._delim, self._offsets
+        inquote, recstart, fields = self._inquote, self._recstart, self._fields
+        report, keep_blank = self.report, self._keep_blank
+        width, first = report.width, self._header_rows
+        nfields = 0
+
+        # the last record in the cached block may now be followed by more
+        self._cache.pop(len(offsets) // BLOCK_ROWS, None)
+        self.block_version += 1
+
+        i, n = 0, len(chunk)
+        if width is not None and not inquote and not (q and q in chunk) and not _has_blank(chunk):
+            # the usual case: every line is a record, so the lines are
+            # split and counted all at once
+            lines = chunk.split(b'\n')
+            if not lines[-1]:
+                lines.pop()
+            starts = accumulate([len(line) + 1 for line in lines], initial=pos)
+            offsets.extend(starts)
+            offsets.pop()
+            delims = list(map(bytes.count, lines, repeat(d)))
+            if delims.count(width - 1) != len(delims):
+                report.add_lengths(len(offsets) - len(lines) - first, [k + 1 for k in delims])
+            nfields = delims[-1] + 1 if delims else 0
+            recstart = pos + n
+            i = n
+
+        while i < n:
+            j = find(b'\n', i)
+            j = n if j < 0 else j + 1
+
+            # an odd number of quote chars on this line means it either
+            # opens or closes a quoted field with an embedded newline;
+            # doubled quotes ("") don't change the parity
+            nquotes = count(q, i, j) if q else 0
+            if nquotes:
+                # (only the delimiters between the quoted parts count)
+                fields += sum(part.count(d) for part in chunk[i:j].split(q)[inquote::2])
+                if nquotes & 1:
+                    inquote = not inquote
+            elif not inquote:
+                fields += count(d, i, j)
+
+            if not inquote:
+                end = pos + j
+                # skip blank lines, as DictReader does (unless keeping
+                # them, after the first record)
+                if end - recstart > 2 or buf[recstart:end].strip(b'\r\n'):
+                    nfields = fields + 1
+                    if width is None:
+                        width = report.width = report.widest = nfields
+                    elif nfields != width:
+                        report.add(len(offsets) - first, nfields)
+                    offsets.append(recstart)
+                elif width is None:
+                    pass
+                elif keep_blank:
+                    report.add(len(offsets) - first, 0)
+                    offsets.append(recstart)
+                else:
+                    report.add_blank([len(offsets) - first])
+                fields = 0
+                recstart = end
+            i = j
+
+        self._scanpos = stop
+
+        if stop >= size and self._at_end:
+            if recstart < size:
+                # unterminated quote at the end of the file
+                self._cut_fields = fields + 1
+                if width is None:
+                    report.width = report.widest = self._cut_fields
+                else:
+                    report.add(len(offsets) - first, self._cut_fields)
+                offsets.append(recstart)
+                self._cut = recstart
+                recstart = size
+                fields = 0
+            elif n and chunk[-1:] != b'\n' and offsets:
+                # unterminated last line
+                self._cut = offsets[-1]
+                self._cut_fields = nfields
+
+        self._inquote, self._recstart, self._fields = inquote, recstart, fields
+
+        return len(offsets) - self._count
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def record_range(self, first, last=None):
+        """
+        Return the byte range (start, end) of the given record, or of the
+        records `first` through `last` (inclusive). The range includes the
+        line terminator and any blank lines that follow.
+        """
+        if last is None:
+            last = first
+        return self._offsets[first], self._record_end(last)
+
+    def line_terminator(self):
+        """Guess the line terminator used by the file"""
+        nl = self._buf.find(b'\n')
+        if nl < 0:
+            return '\r\n'
+        return '\r\n' if nl and self._buf[nl-1:nl] == b'\r' else '\n'
+
+    def commit(self):
+        """Make all indexed records visible (and add the columns of any long ones)"""
+        self._count = len(self._offsets)
+        if self.headers and self.report.widest > len(self.headers):
+            self.headers = self.headers + ["Column {}".format(i+1) for i in
+                                           range(len(self.headers), self.report.widest)]
+
+        if self.complete:
+            self._write_index()
+
+    def grow(self):
+        """
+        Take in the data appended to the file since it was opened (or last
+        grown); it's indexed by index_more() like the rest of the file. A
+        last record that was cut off by the end of the file is indexed
+        again, since it may have been finished since.
+
+        :return: True if the file grew
+        """
+        # (with rows added after the records, any new ones would be out
+        # of place)
+        if self._compression or self._added:
+            return False
+        size = os.fstat(self._file.fileno()).st_size
+        if size <= self._size:
+            return False
+
+        if self._index is not None:
+            # (the offsets can't be appended to the index file)
+            self._offsets = array('q', self._offsets)
+            self._index.close()
+            self._index = None
+        if self._size:
+            self._buf.close()
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._size = size
+
+        if self._cut is not None:
+            # (it's found again right away, so the record keeps its place)
+            del self._offsets[-1]
+            self.report.forget(len(self._offsets) - self._header_rows, self._cut_fields)
+            self._scanpos = self._recstart = self._cut
+            self._inquote = False
+            self._fields = 0
+            self._cut = None
+            self.index_more()
+        return True
+
+    def index_all(self):
+        while not self.complete:
+            self.index_more()
+        self.commit()
+
+    def _record_end(self, i):
+        if i + 1 < len(self._offsets):
+            return self._offsets[i+1]
+        return self._recstart
+
+    def _parse(self, start, end, buf=None):
+        """Parse the bytes between start and end into a list of rows (of raw text)"""
+        text = (buf or self._buf)[start:end].decode(RAW_ENCODING)
+        rows = csv.reader(io.StringIO(text, newline=''), self._dialect)
+        # (kept blank lines are records of their own)
+        return list(rows) if self._keep_blank else [r for r in rows if r]
+
+    def _block(self, b):
+        rows = self._cache.get(b)
+        if rows is None:
+            first = b * BLOCK_ROWS
+            last = min(first + BLOCK_ROWS, len(self._offsets)) - 1
+
+            rows = self._parse(self._offsets[first], self._record_end(last))
+            self._cache_block(b, rows)
+        else:
+            self._cache.move_to_end(b)
+        return rows
+
+    def _cache_block(self, b, rows):
+        self._cache[b] = rows
+        if len(self._cache) > self._max_blocks:
+            self._cache.popitem(last=False)
+
+    # region prefetching (see prefetch.py)
+
+    @property
+    def cache_blocks(self):
+        """How many blocks of rows the cache holds"""
+        return self._max_blocks
+
+    def block_of(self, i):
+        """The block that row `i` is read from, or None if it isn't read from the file"""
+        if i in self._edits or not 0 <= i < self._count:
+            return None
+        return i // BLOCK_ROWS
+
+    def has_block(self, b):
+        return b in self._cache
+
+    def read_block(self, b):
+        """
+        Parse block `b` of the records without caching it (see
+        add_block()). This is safe to call from another thread.
+
+        :return: the rows, or None if the end of the block hasn't been
+            indexed yet
+        """
+        offsets = self._offsets
+        end = (b + 1) * BLOCK_ROWS
+        if end < len(offsets):
+            stop = offsets[end]
+        elif self.complete:
+            stop = self._recstart
+        else:
+            return None
+
+        buf = None
+        if self._compression:
+            # (the buffer can't be read from two threads)
+            if self._reader_buf is None:
+                self._reader_buf = self._buf.reader()
+            buf = self._reader_buf
+        return self._parse(offsets[b * BLOCK_ROWS], stop, buf)
+
+    def add_block(self, b, rows, version):
+        """
+        Cache a block that was read by read_block() when `block_version`
+        was `version` (unless it has changed since)
+        """
+        if version == self.block_version and b not in self._cache:
+            self._cache_block(b, rows)
+
+    # endregion
+
+    @property
+    def ncols(self):
+        return len(self.headers)
+
+    def __len__(self):
+        return self._count + self._added
+
+    def _raw(self, i):
+        if not 0 <= i < self._count + self._added:
+            raise IndexError("row index out of range")
+
+        try:
+            return self._edits[i]
+        except KeyError:
+            pass
+
+        if i >= self._count:
+            return [None] * len(self.headers)
+
+        b, r = divmod(i, BLOCK_ROWS)
+        rows = self._block(b)
+        return rows[r] if r < len(rows) else []
+
+    def _padded(self, i):
+        row = self._raw(i)
+
+        # pad short rows with None; any extra fields are dropped
+        ncols = len(self.headers)
+        if len(row) < ncols:
+            return row + [None] * (ncols - len(row))
+        return row[:ncols]
+
+    def row(self, i):
+        """Return the values of the given record as a list"""
+        return self._codec.decode_all(self._padded(i))
+
+    def row_length(self, i):
+        """The number of fields of the record"""
+        return len(self._raw(i))
+
+    def get(self, i, slot):
+        row = self._raw(i)
+        return self._codec.decode(row[slot]) if slot < len(row) else None
+
+    def column_data(self, slot):
+        """
+        Return the cells of a column as a (cells, None) pair (like
+        ColumnStore.column_data()). This parses every indexed record.
+        """
+        return [self.get(i, slot) for i in range(len(self))], None
+
+    # (the cells of a lazily-loaded file are always kept as text; a
+    # column type only affects sorting and filtering)
+
+    def column_type(self, slot):
+        return None
+
+    def set_column_type(self, slot, ctype):
+        pass
+
+    def numeric_data(self, slot):
+        return None
+
+    def numeric_texts(self, slot):
+        return None
+
+    def set(self, i, slot, value):
+        """:raises UnicodeEncodeError: if `value` can't be encoded"""
+        value = self._codec.encode(value)
+        if i not in self._edits:
+            self._edits[i] = list(self._raw(i))
+        row = self._edits[i]
+        # (a short row only grows as far as it's filled in)
+        if slot >= len(row):
+            row.extend([None] * (slot + 1 - len(row)))
+        row[slot] = value
+
+    def get_cells(self, rows, slot):
+        return [self.get(i, slot) for i in rows]
+
+    def add_rows(self, count):
+        """
+        Add `count` empty rows after the records of the file (which has
+        to be fully indexed, as they'd be in the way of any more records)
+        """
+        if not self.complete:
+            raise ValueError("the file hasn't been fully indexed")
+        self._added += count
+
+    def add_column(self):
+        """Add a new (empty) column and return its slot number"""
+        self.headers = self.headers + ["Column {}".format(self.ncols + 1)]
+        return self.ncols - 1
+
+    def set_cells(self, rows, slot, values):
+        for i, value in zip(rows, values):
+            self.set(i, slot, value)
@@ -0,0 +1,385 @@
+import threading
+from array import array
+from itertools import compress
+
+from store import ColumnStore
+
+# (cells are joined with this for scanning; it can't be part of a needle)
+_SEP = '\0'
+
+# all the characters a formatted number can have (as in "-1.5e-07", "inf")
+_NUMBER_CHARS = frozenset("0123456789+-.einfa")
+
+
+def join(values):
+    """Join values (strings or None) into a single string for scan_joined()"""
+    return _SEP.join(['' if v is None else v for v in values])
+
+
+def scan(values, needle, case=False):
+    """
+    Yield the indexes of the values (strings or None) that contain
+    `needle`. All the values are searched in one go, as a single string.
+    """
+    blob = join(values)
+    if not case:
+        blob, needle = blob.casefold(), needle.casefold()
+    return scan_joined(blob, needle)
+
+
+def scan_joined(blob, needle):
+    """scan() the values joined into `blob` by join() (matching case)"""
+    index, counted = 0, 0
+    pos = blob.find(needle)
+    while pos >= 0:
+        index += blob.count(_SEP, counted, pos)
+        yield index
+
+        # go on from the next value
+        counted = blob.find(_SEP, pos + len(needle))
+        if counted < 0:
+            return
+        index += 1
+        counted += 1
+        pos = blob.find(needle, counted)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Maps the (casefolded) trigrams of the values of a column to the ids
+    of the values containing them: value codes for a dictionary-encoded
+    column, rows for the others. Candidates from the index still have to
+    be checked, as the index only ever grows.
+    """
+
+    def __init__(self, codes=None):
+        # the codes array of an encoded column (None if ids are rows)
+        self.codes = codes
+        # number of values (or rows) indexed
+        self.count = 0
+        self._postings = {}
+
+    def add(self, id, text):
+        postings = self._postings
+        for tri in trigrams(text.casefold()):
+            ids = postings.get(tri)
+            if ids is None:
+                ids = postings[tri] = array('I')
+            ids.append(id)
+
+    def extend(self, values, cancelled=lambda: False):
+        """Index values[self.count:]; stop early if `cancelled()`"""
+        for id in range(self.count, len(values)):
+            if not id & 0xfff and cancelled():
+                return False
+            text = values[id]
+            if text:
+                self.add(id, text)
+            self.count = id + 1
+        return True
+
+    def candidates(self, needle):
+        """The ids of the values that may contain `needle` (at least 3 characters)"""
+        postings = [self._postings.get(tri) for tri in trigrams(needle.casefold())]
+        if not postings or None in postings:
+            return set()
+
+        postings.sort(key=len)
+        found = set(postings[0])
+        for ids in postings[1:]:
+            found.intersection_update(ids)
+            if not found:
+                break
+        return found
+
+
+class SearchEngine:
+    """
+    Finds the cells of a store that contain some text.
+
+    Each column of an in-memory store is scanned as a whole (see scan());
+    a lazily-loaded store is searched a row at a time, as the matches are
+    asked for. An index of the trigrams of the values of an in-memory
+    store's text columns can be built in the background (build_index()),
+    to make repeated searches quicker.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        # slot -> TrigramIndex, once built
+        self._indexes = {}
+        # slot -> (numbers array, row count, joined text, casefolded text)
+        # of a numeric column, to not have to format it for every search
+        self._joined = {}
+        self._builder = None
+        self._cancel = False
+        # slot -> [(row, value)] of the edits made to the column that's
+        # being indexed (in the background), which are added to its
+        # index once it's done
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Stop building the index"""
+        self._cancel = True
+
+    # region index
+
+    @property
+    def indexing(self):
+        return self._builder is not None and self._builder.is_alive()
+
+    def build_index(self):
+        """Start indexing the store in a background thread (if it isn't indexed yet)"""
+        if (self._indexes or self.indexing
+                or not isinstance(self._store, ColumnStore)):
+            return
+        self._builder = threading.Thread(target=self._build, name="search-index", daemon=True)
+        self._builder.start()
+
+    def _build(self):
+        store = self._store
+        cancelled = lambda: self._cancel
+        for slot in range(store.ncols):
+            with self._lock:
+                self._pending[slot] = []
+
+            if store.column_type(slot) is not None:
+                # numbers are mostly distinct, so an index of their
+                # digits would be huge and not narrow searches much;
+                # having their text ready to scan helps more
+                self._numbers_joined(slot, store.numeric_data(slot)[0], False)
+                with self._lock:
+                    if self._pending.pop(slot):
+                        # (it may have been joined before the edits)
+                        self._joined.pop(slot, None)
+                continue
+
+            values, codes = store.column_data(slot)
+            index = TrigramIndex(codes)
+            done = index.extend(values, cancelled)
+            with self._lock:
+                edits = self._pending.pop(slot)
+                if not done:
+                    return
+                # (the rows edited after it went past them)
+                if codes is None:
+                    for row, value in edits:
+                        if value:
+                            index.add(row, value)
+                self._indexes[slot] = index
+
+    def cell_changed(self, row, slot, value):
+        """Let the index know about an edit"""
+        self.cells_changed((row,), slot, (value,))
+
+    def cells_changed(self, rows, slot, values):
+        """Let the index know about the edit of several cells of a column"""
+        with self._lock:
+            self._joined.pop(slot, None)
+            pending = self._pending.get(slot)
+            if pending is not None:
+                pending.extend(zip(rows, values))
+                return
+            index = self._indexes.get(slot)
+        # (new values of an encoded column are picked up when searching)
+        if index is not None and index.codes is None:
+            for row, value in zip(rows, values):
+                if value:
+                    index.add(row, value)
+
+    def _indexed_mask(self, slot, needle, case):
+        """
+        Use the index to find the rows of a column containing `needle`.
+
+        :return: a mask (see column_mask()), or None if there's no
+            (valid) index for the column
+        """
+        index = self._indexes.get(slot)
+        if index is None or len(needle) < 3:
+            return None
+
+        store = self._store
+        nrows = len(store)
+        contains = (lambda v: needle in v) if case else (lambda v, n=needle.casefold(): n in v.casefold())
+
+        if index.codes is not None:
+            values, codes = store.column_data(slot)
+            if codes is not index.codes:
+                # the column has been converted since
+                del self._indexes[slot]
+                return None
+            index.extend(values)
+
+            matches = bytearray(len(values))
+            for code in index.candidates(needle):
+                if contains(values[code]):
+                    matches[code] = 1
+            return bytes(map(matches.__getitem__, codes))
+
+        mask = bytearray(nrows)
+        get = store.get
+        for row in index.candidates(needle):
+            if row < nrows:
+                value = get(row, slot)
+                if value and contains(value):
+                    mask[row] = 1
+
+        # rows added since the index was built
+        if index.count < nrows:
+            tail = [get(row, slot) for row in range(index.count, nrows)]
+            for i in scan(tail, needle, case):
+                mask[index.count + i] = 1
+        return mask
+
+    def _numbers_joined(self, slot, numbers, case):
+        """The cells of a numeric column, as text joined by join()"""
+        nrows = len(self._store)
+        cached = self._joined.get(slot)
+        if cached is None or cached[0] is not numbers or cached[1] != nrows:
+            blob = join(self._store.column_data(slot)[0])
+            folded = blob.casefold()
+            cached = self._joined[slot] = (numbers, nrows, blob,
+                                           blob if folded == blob else folded)
+        return cached[2] if case else cached[3]
+
+    # endregion
+
+    def column_mask(self, slot, needle, case=False):
+        """
+        :return: a mask of the rows of the store whose value in column
+            `slot` contains `needle`, with a byte (0 or 1) per row
+        """
+        mask = self._indexed_mask(slot, needle, case)
+        if mask is not None:
+            return mask
+
+        store = self._store
+        texts = store.numeric_texts(slot)
+        if texts is not None and not _NUMBER_CHARS.issuperset(needle.casefold()):
+            # only the cells kept as text can match, no need to format
+            # the numbers
+            mask = bytearray(len(store))
+            rows = list(texts)
+            for i in scan([texts[row] for row in rows], needle, case):
+                mask[rows[i]] = 1
+            return mask
+
+        if texts is not None:
+            mask = bytearray(len(store))
+            blob = self._numbers_joined(slot, store.numeric_data(slot)[0], case)
+            for row in scan_joined(blob, needle if case else needle.casefold()):
+                mask[row] = 1
+            return mask
+
+        values, codes = store.column_data(slot)
+        if codes is None:
+            mask = bytearray(len(values))
+            for row in scan(values, needle, case):
+                mask[row] = 1
+            return mask
+
+        # find the distinct values that match, then their rows
+        matches = bytearray(len(values))
+        for code in scan(values, needle, case):
+            matches[code] = 1
+        return bytes(map(matches.__getitem__, codes))
+
+    def matches(self, needle, slots, rows=None, start=(-1, -1), case=False, backwards=False):
+        """
+        Iterate over the cells containing `needle`, as (row, column)
+        pairs, row by row from (and not including) the `start` cell,
+        wrapping around at the end of the table.
+
+        :param slots: the store slot of each column, in display order
+        :param rows: the store row of each displayed row, or None if
+            they're the same (see RowOrder)
+        :param start: (row, column) to start after (or before, searching
+            backwards); the default starts at the very beginning (or end)
+        """
+        if not needle or not slots:
+            return iter(())
+
+        nrows = len(self._store) if rows is None else len(rows)
+        srow, scol = start
+        if not 0 <= srow < nrows:
+            srow, scol = (nrows - 1, len(slots)) if not backwards else (0, -1)
+            if not nrows:
+                return iter(())
+
+        if isinstance(self._store, ColumnStore):
+            return self._column_matches(needle, slots, rows, nrows, srow, scol, case, backwards)
+        return self._row_matches(needle, slots, rows, nrows, srow, scol, case, backwards)
+
+    @staticmethod
+    def _order(nrows, srow, backwards):
+        """
+        The rows to look through, in order, after the start row: as
+        (range, slice) pairs
+        """
+        if backwards:
+            return [(range(srow - 1, -1, -1), slice(srow - 1, None, -1) if srow else slice(0, 0)),
+                    (range(nrows - 1, srow, -1), slice(nrows - 1, srow, -1))]
+        return [(range(srow + 1, nrows), slice(srow + 1, nrows)),
+                (range(0, srow), slice(0, srow))]
+
+    def _column_matches(self, needle, slots, rows, nrows, srow, scol, case, backwards):
+        masks = [self.column_mask(slot, needle, case) for slot in slots]
+
+        # the rows with a match in any of the columns
+        nstore = len(self._store)
+        anyrow = 0
+        for mask in masks:
+            anyrow |= int.from_bytes(mask, 'little')
+        anyrow = anyrow.to_bytes(nstore, 'little')
+        if rows is not None:
+            anyrow = bytes(map(anyrow.__getitem__, rows))
+
+        def columns(row):
+            r = row if rows is None else rows[row]
+            cols = [col for col, mask in enumerate(masks) if mask[r]]
+            return cols[::-1] if backwards else cols
+
+        # the rest of the start row, the other rows, then the start of
+        # the start row
+        for col in columns(srow):
+            if (col < scol) if backwards else (col > scol):
+                yield srow, col
+
+        for span, part in self._order(nrows, srow, backwards):
+            for row in compress(span, anyrow[part]):
+                for col in columns(row):
+                    yield row, col
+
+        for col in columns(srow):
+            if (col >= scol) if backwards else (col <= scol):
+                yield srow, col
+
+    def _row_matches(self, needle, slots, rows, nrows, srow, scol, case, backwards):
+        store = self._store
+        if not case:
+            needle = needle.casefold()
+
+        def columns(row):
+            r = row if rows is None else rows[row]
+            values = [store.get(r, slot) for slot in slots]
+            cols = [col for col, value in enumerate(values)
+                    if value and needle in (value if case else value.casefold())]
+            return cols[::-1] if backwards else cols
+
+        for col in columns(srow):
+            if (col < scol) if backwards else (col > scol):
+                yield srow, col
+
+        for span, _ in self._order(nrows, srow, backwards):
+            for row in span:
+                for col in columns(row):
+                    yield row, col
+
+        for col in columns(srow):
+            if (col >= scol) if backwards else (col <= scol):
+                yield srow, col
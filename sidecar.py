@@ -0,0 +1,115 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from sniff import cache_dir
+from writer import atomic_write
+
+_MAGIC = b"QCSVIDX1"
+
+# magic, byte order (0=little, 1=big), file size, file mtime, number of
+# offsets, length of the metadata
+_HEADER = struct.Struct("<8sBxxxxxxxqqqq")
+
+# bytes from the head and from the tail of the csv file that are hashed
+_HASH_BYTES = 64 * 1024
+
+
+def default_index_dir():
+    return os.path.join(cache_dir(), "index")
+
+
+def index_path(csvfile, index_dir, suffix=".idx"):
+    """Path of the index for `csvfile` in `index_dir` (or of another file kept for it there)"""
+    key = hashlib.sha1(os.path.abspath(csvfile).encode('utf-8', 'surrogateescape'))
+    return os.path.join(index_dir, key.hexdigest() + suffix)
+
+
+def content_hash(buf):
+    """Hash of the head and tail of a file's contents (a bytes-like or mmap)"""
+    h = hashlib.sha1(buf[:_HASH_BYTES])
+    h.update(buf[-_HASH_BYTES:])
+    return h.hexdigest()
+
+
+class RecordIndex:
+    """
+    A record offset table read from an index file. The offsets are not
+    copied into memory: `offsets` is a memoryview of the mmapped file.
+    """
+
+    def __init__(self, f, buf, meta, offsets):
+        self._file = f
+        self._buf = buf
+        self.meta = meta
+        self.offsets = offsets
+
+    def close(self):
+        self.offsets.release()
+        self._buf.close()
+        self._file.close()
+
+
+def write_index(path, st, buf, meta, offsets):
+    """
+    Write an index file.
+
+    :param st: os.stat_result of the csv file
+    :param buf: contents of the csv file (for the content hash)
+    :param dict meta: json-able metadata (dialect, headers...)
+    :param offsets: array('q') of record offsets
+    """
+    meta = dict(meta, hash=content_hash(buf))
+    metadata = json.dumps(meta).encode('utf-8')
+    # keep the offsets aligned
+    metadata += b' ' * (-(_HEADER.size + len(metadata)) % 8)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path) as f:
+        f.write(_HEADER.pack(_MAGIC, sys.byteorder == "big",
+                             st.st_size, st.st_mtime_ns, len(offsets), len(metadata)))
+        f.write(metadata)
+        f.write(offsets.tobytes())
+
+
+def read_index(path, st, buf):
+    """
+    Open the index file at `path`, if it exists and is valid for a csv
+    file with the given stat result and contents.
+
+    :return: a RecordIndex, or None
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+
+    try:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("truncated")
+
+        magic, bigendian, size, mtime, count, metalen = _HEADER.unpack(header)
+        if (magic != _MAGIC or bigendian != (sys.byteorder == "big")
+                or (size, mtime) != (st.st_size, st.st_mtime_ns)):
+            raise ValueError("stale")
+
+        meta = json.loads(f.read(metalen).decode('utf-8'))
+        if meta.get("hash") != content_hash(buf):
+            raise ValueError("stale")
+
+        start = _HEADER.size + metalen
+        if os.fstat(f.fileno()).st_size != start + 8 * count:
+            raise ValueError("truncated")
+
+        idxbuf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = memoryview(idxbuf)[start:].cast('q')
+
+    except (OSError, ValueError, struct.error):
+        f.close()
+        return None
+
+    return RecordIndex(f, idxbuf, meta, offsets)
@@ -0,0 +1,392 @@
+import codecs
+import csv
+import io
+import json
+import locale
+import os
+from collections import Counter, OrderedDict
+
+from charset import byte_level
+from compressed import compression, open_binary
+from tokenizer import custom_dialect
+from writer import atomic_write
+
+# size of each of the samples taken from a file
+SAMPLE_BYTES = 16 * 1024
+
+# never skip more lines than this looking for the start of the table
+MAX_SKIP = 20
+
+# a sniffed dialect is only used if at least this share of the rows of
+# each sample have the same number of fields (and that's more than one)
+MIN_CONSISTENCY = 2 / 3
+
+# the delimiters tried (with the quoting of csv.excel) when the sniffed
+# dialect doesn't check out, unless the delimiters are given
+FALLBACK_DELIMS = ",\t;|"
+
+_param_names = ("delimiter", "quotechar", "escapechar", "doublequote",
+                "skipinitialspace", "quoting", "strict", "closequote")
+
+
+def dialect_params(dialect):
+    """
+    Return the formatting parameters of a dialect as a dict, since dialect
+    classes can't always be pickled (e.g. the one from CSVFormatDialog).
+    """
+    return {k: getattr(dialect, k) for k in _param_names if hasattr(dialect, k)}
+
+
+def make_dialect(params, name="sniffed_dialect"):
+    """
+    Create a csv.Dialect subclass from a dict of formatting parameters (or
+    a tokenizer.CustomDialect, for a format the csv module can't handle)
+    """
+    custom = custom_dialect(params.get("delimiter", ","), params.get("quotechar"),
+                            params.get("closequote"), params.get("doublequote", True))
+    if custom is not None:
+        return custom
+
+    attrs = {k: params[k] for k in _param_names if k in params and k != "closequote"}
+    attrs["_name"] = name
+    # all other dialects have this hardcoded to this:
+    attrs["lineterminator"] = '\r\n'
+    attrs.setdefault("quoting", csv.QUOTE_MINIMAL)
+    return type(name, (csv.Dialect,), attrs)
+
+
+def sniff_sample(sample, delims=None):
+    """Determine the dialect of a sample of csv text, and whether it starts with a header"""
+    sniffer = csv.Sniffer()
+    if delims:
+        dialect = sniffer.sniff(sample, delims)
+    else:
+        dialect = sniffer.sniff(sample)
+    has_header = sniffer.has_header(sample)
+
+    return dialect, has_header
+
+
+def read_samples(csvfile, encoding=None, sample_bytes=SAMPLE_BYTES):
+    """
+    Read samples of text from the head, middle and tail of a file. Each
+    sample consists of whole lines (the head always starts at the very
+    beginning of the file); small files give a single sample.
+
+    Compressed files can't be sampled in the middle without decompressing
+    everything before it, so all the samples come from their head; so do
+    those of a file in an encoding like UTF-16, whose line breaks can't
+    be found by looking for a byte.
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+
+    if compression(csvfile) or not byte_level(encoding):
+        with open_binary(csvfile) as f:
+            data = f.read(3 * sample_bytes)
+            more = bool(f.read(1))
+        text = codecs.getincrementaldecoder(encoding)('replace').decode(data, final=not more)
+        if more:
+            # drop the partial line at the end
+            text = text[:text.rfind('\n') + 1]
+        return [text]
+
+    with open(csvfile, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+
+        if size <= 3 * sample_bytes:
+            f.seek(0)
+            return [f.read().decode(encoding, 'replace')]
+
+        samples = []
+        for start in (0, (size - sample_bytes) // 2, size - sample_bytes):
+            f.seek(start)
+            data = f.read(sample_bytes)
+
+            # drop partial lines at either end
+            if start:
+                data = data[data.find(b'\n') + 1:]
+            if start + len(data) < size:
+                data = data[:data.rfind(b'\n') + 1]
+
+            samples.append(data.decode(encoding, 'replace'))
+        return samples
+
+
+def _field_count(lines, dialect):
+    return [len(row) for row in csv.reader(lines, dialect)]
+
+
+def _guess_skip(head, dialect):
+    """
+    Count the lines of preamble (title lines, comments...) at the start
+    of `head`: the lines with a lot fewer fields than the lines following
+    them.
+    """
+    lines = head.splitlines(True)[:MAX_SKIP + 10]
+    counts = _field_count(lines, dialect)
+    if len(counts) < 2:
+        return 0
+
+    # the most common field count in the sample
+    ncols = Counter(counts).most_common(1)[0][0]
+    if ncols < 2:
+        return 0
+
+    # (only count lines with far fewer fields, so that a table with some
+    # short rows doesn't lose its header)
+    skip = 0
+    for n in counts[:MAX_SKIP]:
+        if n * 2 > ncols:
+            break
+        skip += 1
+    return skip
+
+
+def plausible_delimiter(delimiter):
+    """
+    False for the delimiters the sniffer comes up with that can't be
+    right: letters and digits (picked for being evenly spread, e.g. in
+    short files) and line breaks (e.g. "\r", in a file with quoted
+    fields and CRLF line ends)
+    """
+    if len(delimiter) != 1:
+        # (a CustomDialect's, which is never sniffed)
+        return bool(delimiter)
+    return not delimiter.isalnum() and (delimiter in " \t" or not delimiter.isspace())
+
+
+def _consistent(samples, dialect, skip=0):
+    """
+    True if the rows of the samples, read in `dialect`, mostly have the
+    same number of fields (more than one), in each of them
+    """
+    counts = []
+    for n, sample in enumerate(samples):
+        lines = sample.splitlines(True)
+        if n == 0:
+            lines = lines[skip:]
+        else:
+            # (a sample from the middle may start in a quoted field)
+            lines = lines[1:]
+        try:
+            counts.append([c for c in _field_count(lines, dialect) if c])
+        except csv.Error:
+            return False
+
+    total = Counter(c for sample in counts for c in sample)
+    if not total:
+        return False
+    ncols = total.most_common(1)[0][0]
+    if ncols < 2:
+        return False
+    return all(not sample or sample.count(ncols) >= MIN_CONSISTENCY * len(sample)
+               for sample in counts)
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _has_header(head, dialect):
+    """
+    Guess whether `head` (of a file in `dialect`) starts with a header:
+    if csv.Sniffer doesn't think so, it still does if the first row is
+    of distinct names, over a column that's mostly numbers (the sniffer
+    gives up on the columns whose values vary in type, like numbers
+    mixed with quoted text)
+    """
+    try:
+        if csv.Sniffer().has_header(head):
+            return True
+    except csv.Error:
+        pass
+
+    try:
+        rows = [row for row in csv.reader(head.splitlines(True), dialect) if row]
+    except csv.Error:
+        return False
+    if len(rows) < 2:
+        return False
+    first, rest = rows[0], rows[1:]
+    if not all(first) or len(set(first)) < len(first):
+        return False
+
+    for col, name in enumerate(first):
+        if _is_number(name):
+            continue
+        values = [row[col] for row in rest if col < len(row) and row[col]]
+        if values and sum(map(_is_number, values)) * 2 > len(values):
+            return True
+    return False
+
+
+def sniff_file(csvfile, delims=None, encoding=None):
+    """
+    Determine the dialect of a csv file, by sniffing samples from several
+    regions of it and taking the dialect that most of them agree on.
+
+    The dialect is checked against the samples (see plausible_delimiter()
+    and _consistent()); if it doesn't hold up, or none could be sniffed,
+    the samples are read like csv.excel with each of the `delims` (or
+    FALLBACK_DELIMS) in turn.
+
+    :return: tuple of the dialect, whether the file has a header, and the
+        number of lines to skip before the header (or first row)
+    :raises csv.Error: if no dialect (sniffed or not) fits the samples
+    """
+    samples = read_samples(csvfile, encoding)
+
+    votes = Counter()
+    found = {}
+
+    for sample in samples:
+        try:
+            dialect = csv.Sniffer().sniff(sample, delims) if delims else csv.Sniffer().sniff(sample)
+        except csv.Error:
+            continue
+
+        key = (dialect.delimiter, dialect.quotechar, dialect.skipinitialspace)
+        votes[key] += 1
+        # (the first sample to get a vote wins a tie)
+        found.setdefault(key, dialect)
+
+    candidates = []
+    for key, _ in votes.most_common():
+        params = dialect_params(found[key])
+        # the sniffer only says "doublequote" if it happens to see a
+        # doubled quote in the sample; without an escape character,
+        # that's the only way a quote could be written, though
+        if not params.get("escapechar"):
+            params["doublequote"] = True
+        candidates.append(params)
+    candidates += [dict(dialect_params(csv.excel), delimiter=d)
+                   for d in (delims or FALLBACK_DELIMS)]
+
+    for params in candidates:
+        if not plausible_delimiter(params["delimiter"]):
+            continue
+        dialect = make_dialect(params)
+        skip = _guess_skip(samples[0], dialect)
+        if _consistent(samples, dialect, skip):
+            break
+    else:
+        raise csv.Error("Could not determine delimiter")
+
+    head = samples[0]
+    if skip:
+        head = "".join(head.splitlines(True)[skip:])
+
+    return dialect, _has_header(head, dialect), skip
+
+
+def cache_dir():
+    """The directory QuiCSV keeps its caches in"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "QuiCSV")
+
+
+class DialectCache:
+    """
+    Remembers the format (dialect, header and lines to skip) of the files
+    that have been opened, so they don't need to be sniffed again. Entries
+    are keyed by path and are only valid for as long as the size and
+    mtime of the file stay the same.
+
+    The cache also remembers the last format that was chosen manually.
+    """
+
+    def __init__(self, path=None, max_entries=500):
+        self._path = path or os.path.join(cache_dir(), "dialects.json")
+        self._max_entries = max_entries
+        self._entries = None
+        self._last_manual = None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        self._entries = OrderedDict()
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._entries.update(data.get("files", {}))
+            self._last_manual = data.get("last_manual")
+        except (OSError, ValueError, AttributeError):
+            # missing or garbled; start over
+            pass
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            data = {"files": self._entries, "last_manual": self._last_manual}
+            with atomic_write(self._path) as f:
+                f.write(json.dumps(data).encode('utf-8'))
+        except OSError as e:
+            print(f"Could not write dialect cache {self._path}: {e}")
+
+    @staticmethod
+    def _key(csvfile):
+        return os.path.abspath(csvfile)
+
+    @staticmethod
+    def _stat(csvfile):
+        st = os.stat(csvfile)
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, csvfile):
+        """
+        :return: (dialect, header, skip) for the file, or None if it's not
+            in the cache or has changed since
+        """
+        self._load()
+
+        entry = self._entries.get(self._key(csvfile))
+        if entry is None:
+            return None
+        try:
+            if entry["stat"] != self._stat(csvfile):
+                return None
+            if not plausible_delimiter(entry["dialect"]["delimiter"]):
+                # (sniffed wrong, before sniffs were checked)
+                return None
+            return make_dialect(entry["dialect"]), entry["header"], entry["skip"]
+        except (OSError, KeyError, TypeError):
+            return None
+
+    def put(self, csvfile, dialect, header, skip=0, manual=False):
+        """Remember the format of a file"""
+        self._load()
+
+        try:
+            stat = self._stat(csvfile)
+        except OSError:
+            return
+
+        entry = {"stat": stat, "dialect": dialect_params(dialect),
+                 "header": bool(header), "skip": skip}
+
+        key = self._key(csvfile)
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+        if manual:
+            self._last_manual = entry
+        self._save()
+
+    def last_manual(self):
+        """
+        :return: (dialect parameters, header, skip) of the format that was
+            most recently chosen by hand, or None
+        """
+        self._load()
+
+        entry = self._last_manual
+        if not entry:
+            return None
+        return entry["dialect"], entry["header"], entry["skip"]
@@ -0,0 +1,329 @@
+import operator
+import re
+from array import array
+from itertools import compress
+
+from coltypes import FLOAT, TEXT, infer_type, parser, sort_key
+from sqlstore import SQLiteRows
+
+# "<op> <value>"; without an operator, a condition matches the cells
+# that contain the value (ignoring case)
+_condition = re.compile(r"\s*(<=|>=|!=|=|<|>|~)?\s*(.*?)\s*$", re.S)
+
+_compare = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# name of the method of the value compared *with* that does the same
+# comparison (`x < t` is `t.__gt__(x)`)
+_reflected = {
+    "=": "__eq__",
+    "!=": "__ne__",
+    "<": "__gt__",
+    "<=": "__ge__",
+    ">": "__lt__",
+    ">=": "__le__",
+}
+
+
+def column_type(store, slot):
+    """The type of a column of `store`: the type it's stored as, or else an inferred one"""
+    ctype = store.column_type(slot)
+    if ctype is None:
+        ctype = infer_type(store.get(i, slot) for i in range(len(store)))
+    return ctype
+
+
+def sort_keys(store, slot, ctype):
+    """
+    Compute a sort key for each row of a column.
+
+    For a dictionary-encoded column, only the distinct values are
+    converted and sorted; each row's key is then the rank of its value,
+    an integer, which makes sorting the rows themselves cheap.
+    """
+    numeric = store.numeric_data(slot)
+    if numeric is not None and store.column_type(slot) == ctype:
+        # the numbers are the keys (with empty cells first)
+        values, nulls = numeric
+        keys = values.tolist()
+        for i in compress(range(len(keys)), nulls):
+            keys[i] = float("-inf")
+        return keys
+
+    values, codes = store.column_data(slot)
+    key = sort_key(ctype)
+
+    if codes is None:
+        return list(map(key, values))
+
+    keys = list(map(key, values))
+    ranks = array('q', bytes(8 * len(values)))
+    rank, prev = -1, None
+    for code in sorted(range(len(values)), key=keys.__getitem__):
+        # (values that are equal as their type share a rank)
+        if rank < 0 or keys[code] != prev:
+            rank, prev = rank + 1, keys[code]
+        ranks[code] = rank
+
+    return array('q', map(ranks.__getitem__, codes))
+
+
+class Filter:
+    """
+    A filter condition on a column: a value optionally preceded by an
+    operator, one of = != < <= > >= (which compare values as the column's
+    type) or ~ (contains, ignoring case; the default).
+    """
+
+    def __init__(self, condition, ctype=TEXT):
+        """:raises ValueError: if the value isn't valid for the column's type"""
+        self.condition = condition
+        self.ctype = ctype
+
+        op, operand = _condition.match(condition).groups()
+        self.op = op or "~"
+        self.operand = operand
+        # the value to compare with, as the column's type
+        self.target = None
+
+        if self.op == "~":
+            needle = operand.casefold()
+            self.predicate = lambda value: value is not None and needle in value.casefold()
+            return
+
+        compare = _compare[self.op]
+
+        if not operand:
+            if self.op not in ("=", "!="):
+                raise ValueError(f"'{self.op}' needs a value to compare with")
+            # (in)equality with nothing: match the (non-)empty cells
+            empty = self.op == "="
+            self.predicate = lambda value: (not value) == empty
+            return
+
+        parse = parser(ctype)
+        if parse is None:
+            self.predicate = lambda value: compare(value or "", operand)
+            return
+
+        try:
+            self.target = target = parse(operand)
+        except ValueError:
+            raise ValueError(f"{operand!r} is not a valid {ctype}") from None
+
+        def predicate(value):
+            if not value:
+                return False
+            try:
+                return compare(parse(value), target)
+            except ValueError:
+                return False
+        self.predicate = predicate
+
+    def mask(self, store, slot):
+        """
+        Evaluate the condition over a column, giving a mask with a byte
+        per row (1 if the row matches). For a dictionary-encoded column,
+        the condition is only checked once per distinct value, and the
+        numbers of a numeric column are compared directly.
+        """
+        numeric = store.numeric_data(slot)
+        if numeric is not None and self.target is not None:
+            values, nulls = numeric
+            target = self.target
+            if store.column_type(slot) == FLOAT:
+                # (an int can't compare itself with a float)
+                target = float(target)
+            matches = bytes(map(getattr(target, _reflected[self.op]), values))
+            # empty cells never match
+            return combine_masks([matches, bytes(map((1).__xor__, nulls))], len(values))
+
+        values, codes = store.column_data(slot)
+        if codes is None:
+            return bytes(map(self.predicate, values))
+
+        matches = bytes(map(self.predicate, values))
+        return bytes(map(matches.__getitem__, codes))
+
+
+def combine_masks(masks, nrows):
+    """AND together row masks"""
+    result = -1
+    for mask in masks:
+        result &= int.from_bytes(mask, 'little')
+    if result == -1:
+        return b'\x01' * nrows
+    return result.to_bytes(nrows, 'little')
+
+
+class RowOrder:
+    """
+    The order and selection of the rows of a store that are shown, as
+    determined by a sort column and per-column filters.
+
+    `rows` maps each displayed row to a row of the store, or is None when
+    rows are shown in the order of the table: that of the `base`
+    PieceTable (see pieces.py), once rows have been inserted, removed or
+    moved, or else that of the store. Typed sort keys are computed once
+    per column and kept until the column is edited, as is the (ascending)
+    order of all rows by the sort column; reversing the sort or changing
+    the filters doesn't sort again.
+    """
+
+    def __init__(self):
+        self.sort_slot = None
+        self.descending = False
+        # slot -> Filter
+        self.filters = {}
+        self.rows = None
+        self.base = None
+
+        # slot -> type, for the columns whose type was chosen by hand
+        self.types = {}
+        self._types = {}
+        self._keys = {}
+        # (slot, rows of the store in ascending order by that column)
+        self._sorted = None
+
+    def count(self, nrows):
+        """Number of rows shown, for a store of `nrows` rows"""
+        return len(self.store_rows) if self.store_rows is not None else nrows
+
+    @property
+    def store_rows(self):
+        """The row of the store shown as each displayed row, or None if that's the row itself"""
+        return self.base if self.rows is None else self.rows
+
+    def column_type(self, store, slot):
+        ctype = self.types.get(slot) or self._types.get(slot)
+        if ctype is None:
+            ctype = self._types[slot] = column_type(store, slot)
+        return ctype
+
+    def set_type(self, slot, ctype):
+        """Sort and filter a column as the given type"""
+        self.types[slot] = ctype
+        self.invalidate(slot)
+
+    def keys(self, store, slot):
+        keys = self._keys.get(slot)
+        if keys is None:
+            keys = self._keys[slot] = sort_keys(store, slot, self.column_type(store, slot))
+        return keys
+
+    def invalidate(self, slot=None):
+        """Forget the sort keys (and inferred types) of a column, or of all of them"""
+        if slot is None:
+            self._keys.clear()
+            self._types.clear()
+        else:
+            self._keys.pop(slot, None)
+            self._types.pop(slot, None)
+
+        if slot is None or self._sorted and self._sorted[0] == slot:
+            self._sorted = None
+
+    def _sorted_rows(self, store, slot):
+        if self._sorted is None or self._sorted[0] != slot:
+            keys = self.keys(store, slot)
+            rows = range(len(store)) if self.base is None else self.base
+            self._sorted = (slot, array('q', sorted(rows, key=keys.__getitem__)))
+        return self._sorted[1]
+
+    def set_filter(self, store, slot, condition):
+        """
+        Set (or, if `condition` is empty, remove) the filter on a column
+
+        :raises ValueError: if the condition is invalid
+        """
+        if condition:
+            self.filters[slot] = Filter(condition, self.column_type(store, slot))
+        else:
+            self.filters.pop(slot, None)
+
+    def update(self, store):
+        """
+        Recompute `rows` for the current sort and filters (which the
+        database of an SQLiteRows store works out itself)
+        """
+        nrows = len(store)
+
+        if self.sort_slot is None and not self.filters:
+            self.rows = None
+            return
+
+        if isinstance(store, SQLiteRows):
+            ctype = None if self.sort_slot is None else self.column_type(store, self.sort_slot)
+            self.rows = store.select(self.sort_slot, ctype, self.descending, self.filters,
+                                     None if self.base is None else self.base.pieces)
+            return
+
+        if self.sort_slot is None:
+            rows = range(nrows) if self.base is None else self.base
+        else:
+            rows = self._sorted_rows(store, self.sort_slot)
+            if self.descending:
+                rows = rows[::-1]
+
+        if self.filters:
+            mask = combine_masks((f.mask(store, slot) for slot, f in self.filters.items()), nrows)
+            if self.sort_slot is None and self.base is None:
+                rows = compress(rows, mask)
+            else:
+                rows = compress(rows, map(mask.__getitem__, rows))
+
+        self.rows = rows if isinstance(rows, array) else array('q', rows)
+
+    def positions(self, rows):
+        """Where the given rows of the store are shown (-1 if they're filtered out)"""
+        if self.rows is None:
+            return list(rows) if self.base is None else self.base.positions(rows)
+
+        if len(rows) <= 16:
+            # (searching the array is quick enough for a few rows)
+            found = {}
+            for row in rows:
+                try:
+                    found[row] = self.rows.index(row)
+                except ValueError:
+                    pass
+        else:
+            wanted = set(rows)
+            found = {row: i for i, row in enumerate(self.rows) if row in wanted}
+
+        return [found.get(row, -1) for row in rows]
+
+    def extend(self, first, end):
+        """
+        Rows [first, end) were added to the store; show them at the end,
+        unsorted and unfiltered, until the next update()
+        """
+        self.invalidate()
+        if self.base is not None:
+            self.base.extend(first, end)
+        if self.rows is not None:
+            self.rows.extend(range(first, end))
+
+    def insert(self, pos, rows):
+        """
+        Rows of the store were put into the table; show them at displayed
+        position `pos` (if the rows aren't shown in the order of the
+        table), unsorted and unfiltered, until the next update()
+        """
+        if self.rows is not None:
+            self.rows[pos:pos] = array('q', rows)
+
+    def remove(self, first, end):
+        """Stop showing the displayed rows [first, end), which were taken out of the table"""
+        if self.rows is not None:
+            del self.rows[first:end]
+
+    def rebase(self):
+        """The order of the rows of the table changed (which ties are sorted by)"""
+        self._sorted = None
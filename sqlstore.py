@@ -0,0 +1,586 @@
+import json
+import os
+import sqlite3
+from array import array
+from collections import OrderedDict
+from operator import itemgetter
+
+from coltypes import parser
+from core import generic_headers
+from sidecar import index_path
+from sniff import dialect_params
+from store import ScanReport, _skip_blank
+
+# rows are read from the database (and cached) in windows of this many
+WINDOW_ROWS = 64
+
+# edited cells are written to the database in batches of (at most) this
+# many, as UPDATEs, unless rows are read from it before then
+UPDATE_CELLS = 1000
+
+# the rows of a sort or filter are fetched this many at a time
+_FETCH_ROWS = 65536
+
+# (a GLOB pattern for text with any character past ASCII)
+_NON_ASCII = "*[^\x01-\x7f]*"
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class RowChunk:
+    """
+    A batch of rows for an SQLiteRows store, made ready to be inserted
+    away from the GUI thread (like a ColumnChunk, see loader.RowBatches):
+    each row is padded to the width of the chunk, and ends with its
+    number of fields (or None for a row as wide as the chunk).
+    """
+
+    __slots__ = ("nrows", "rows", "width", "lengths", "blanks")
+
+    def __init__(self, nrows, rows, width, lengths, blanks=()):
+        self.nrows = nrows
+        self.rows = rows
+        self.width = width
+        # the number of fields of each row (an array)
+        self.lengths = lengths
+        # where blank rows were skipped (see ColumnChunk)
+        self.blanks = list(blanks)
+
+    def __len__(self):
+        return self.nrows
+
+    @classmethod
+    def from_rows(cls, rows, ncols, keep_blank=False):
+        """Prepare the given rows (of a table `ncols` wide, or wider)"""
+        batch = list(rows)
+        blanks = []
+        if not keep_blank:
+            batch = _skip_blank(batch, 0, blanks)
+
+        lengths = array('I', map(len, batch))
+        width = max(ncols, max(lengths, default=0))
+        # (the rows are fresh lists from the reader, so they're padded in place)
+        if lengths.count(width) == len(batch):
+            for row in batch:
+                row.append(None)
+        else:
+            for row, n in zip(batch, lengths):
+                if n < width:
+                    row.extend([None] * (width - n))
+                    row.append(n)
+                else:
+                    row.append(None)
+        return cls(len(batch), batch, width, lengths, blanks)
+
+    def parse_numbers(self):
+        """(for compatibility with ColumnChunk: the cells of an SQLite table are kept as text)"""
+
+
+class SQLiteRows:
+    """
+    Rows of a csv file imported into an SQLite database on disk, for
+    files too big to keep in memory. The rows are bulk-loaded once, in a
+    single transaction (see begin_import()); after that, memory use
+    doesn't grow with the size of the file.
+
+    Cells are addressed by (row, slot) just like in a ColumnStore, and
+    are read through a cache of windows of consecutive rows. Edits are
+    written to the database in batches of UPDATEs. Sorting and filtering
+    are done by the database (see select()), on indexes of the columns
+    that are sorted by.
+
+    The file has to be in a byte-level encoding: cells are kept as raw
+    text, and decoded when they're read (see charset.py).
+
+    The database is a temporary one, unless it's kept in a directory:
+    then opening the same file (with the same settings) again takes the
+    rows from the database rather than importing them again. Changes are
+    never committed to a kept database, so it always has the rows of the
+    file.
+    """
+
+    # for compatibility with lazily-loaded stores
+    complete = True
+
+    def __init__(self, csvfile, dialect, header, skip, codec, db_dir=None, keep_blank=False,
+                 cache_rows=20000):
+        """
+        :param codec: the CellCodec of the encoding of the file
+        :param db_dir: if given, the database is kept in this directory
+            (see `reopened`); otherwise it's a temporary one
+        :param keep_blank: if False, blank lines aren't rows
+        """
+        self._codec = codec
+        self.keep_blank = keep_blank
+
+        st = os.stat(csvfile)
+        self._meta = {"stat": [st.st_size, st.st_mtime_ns], "dialect": dialect_params(dialect),
+                      "header": bool(header), "skip": skip, "encoding": codec.encoding,
+                      "keep_blank": bool(keep_blank)}
+        self._path = db_dir and index_path(csvfile, db_dir, ".sqlite")
+
+        self.headers = []
+        self.report = ScanReport()
+        self._nrows = 0
+        self._ncols = 0
+
+        self._cache = OrderedDict()
+        self._max_windows = max(1, cache_rows // WINDOW_ROWS)
+        # goes up whenever the rows in the database change (see add_block())
+        self.block_version = 0
+        # slot -> {row: raw value}, the edits that haven't been written yet
+        self._updates = {}
+        # True once anything has changed (which a kept database mustn't keep)
+        self._edited = False
+        self._importing = False
+
+        # True if the rows were taken from a database kept from before
+        self.reopened = self._path is not None and self._reopen()
+        if not self.reopened:
+            if self._path:
+                os.makedirs(db_dir, exist_ok=True)
+                for path in (self._path, self._path + "-journal"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            # (an empty name makes a temporary database, deleted on close)
+            self._connect(self._path or "")
+
+    def _connect(self, path):
+        # (windows of rows are read from another thread while prefetching,
+        # see read_block(), which SQLite allows for in serialized mode)
+        self._db = sqlite3.connect(path, isolation_level=None,
+                                   check_same_thread=sqlite3.threadsafety < 3)
+        # (a kept database is only a copy of the file, so it can be made again)
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.create_function("qc_value", 2, self._value, deterministic=True)
+        self._db.create_function("qc_contains", 2, self._contains, deterministic=True)
+
+    def _reopen(self):
+        """Take the rows from the kept database, if it was made with the same settings"""
+        if not os.path.exists(self._path):
+            return False
+        try:
+            self._connect(self._path)
+            meta = json.loads(self._db.execute("SELECT value FROM meta").fetchone()[0])
+        except (sqlite3.Error, TypeError, ValueError):
+            self._db.close()
+            return False
+
+        if any(meta.get(k) != v for k, v in json.loads(json.dumps(self._meta)).items()):
+            self._db.close()
+            return False
+
+        self.headers = meta["headers"]
+        self.report = ScanReport.from_dict(meta["report"])
+        self._nrows = meta["rows"]
+        self._set_ncols(meta["columns"])
+        return True
+
+    def _set_ncols(self, ncols):
+        self._ncols = ncols
+        self._columns = ", ".join(["n"] + [f"c{slot}" for slot in range(ncols)])
+        self._cache.clear()
+        self.block_version += 1
+
+    def close(self):
+        # (a kept database rolls back whatever wasn't committed)
+        self._db.close()
+        self._cache.clear()
+
+    # region importing
+
+    def begin_import(self, rows, header):
+        """
+        Start importing rows of raw text (from a csv reader): create the
+        table from the first row, which has the header names if `header`.
+        The rest are added by extend_chunk(), and the import is committed
+        by end_import().
+        """
+        rows = iter(rows)
+        # (blank lines before the table are always skipped)
+        first_row = next(filter(None, rows), None) or []
+
+        if header:
+            self.headers = self._codec.decode_all(first_row)
+        else:
+            self.headers = generic_headers(len(first_row))
+        self.report = ScanReport(len(first_row))
+
+        self._db.execute("CREATE TABLE meta (value TEXT)")
+        self._db.execute("CREATE TABLE rows (id INTEGER PRIMARY KEY, n INTEGER"
+                         + "".join(f", c{slot}" for slot in range(len(first_row))) + ")")
+        self._set_ncols(len(first_row))
+        self._db.execute("BEGIN")
+        self._importing = True
+
+        if first_row and not header:
+            self.extend_chunk(RowChunk.from_rows([first_row], self._ncols))
+
+    def _widen(self, ncols):
+        """Add (empty) columns up to `ncols`"""
+        if ncols <= self._ncols:
+            return
+        # (the rows that were as wide as the table are short now)
+        self._db.execute("UPDATE rows SET n = ? WHERE n IS NULL", (self._ncols,))
+        for slot in range(self._ncols, ncols):
+            self._db.execute(f"ALTER TABLE rows ADD COLUMN c{slot}")
+        self._set_ncols(ncols)
+        self.headers = self.headers + generic_headers(ncols)[len(self.headers):]
+
+    def extend_chunk(self, chunk):
+        """Insert the rows of a RowChunk (adding columns for long rows)"""
+        first = self._nrows
+        self._widen(chunk.width)
+        columns = ", ".join([f"c{slot}" for slot in range(chunk.width)] + ["n"])
+        marks = ", ".join("?" * (chunk.width + 1))
+        self._db.executemany(f"INSERT INTO rows ({columns}) VALUES ({marks})", chunk.rows)
+        if chunk.width < self._ncols:
+            self._db.execute("UPDATE rows SET n = ? WHERE id > ? AND n IS NULL",
+                             (chunk.width, first))
+
+        self.report.add_blank([first + i for i in chunk.blanks])
+        self.report.add_lengths(first, chunk.lengths)
+        self._nrows += chunk.nrows
+        # (the last window may have been short)
+        self._cache.pop(first // WINDOW_ROWS, None)
+        self.block_version += 1
+
+    def end_import(self, complete=True):
+        """
+        Commit the imported rows. A kept database is only reopened later
+        if all of the file was imported (and nothing was edited meanwhile).
+        """
+        if not self._importing:
+            return
+        self._importing = False
+        self._flush()
+        if complete and not self._edited:
+            meta = dict(self._meta, headers=self.headers, report=self.report.as_dict(),
+                        rows=self._nrows, columns=self._ncols)
+            self._db.execute("INSERT INTO meta VALUES (?)", (json.dumps(meta),))
+        self._db.execute("COMMIT")
+
+    # endregion
+
+    # region cells
+
+    @property
+    def ncols(self):
+        return self._ncols
+
+    def __len__(self):
+        return self._nrows
+
+    def _window(self, w):
+        rows = self._cache.get(w)
+        if rows is None:
+            self._flush()
+            rows = self._read_window(w)
+            self._cache_window(w, rows)
+        else:
+            self._cache.move_to_end(w)
+        return rows
+
+    def _read_window(self, w):
+        first = w * WINDOW_ROWS
+        # (rowids count from 1)
+        return self._db.execute(f"SELECT {self._columns} FROM rows WHERE id > ? AND id <= ? "
+                                f"ORDER BY id", (first, first + WINDOW_ROWS)).fetchall()
+
+    def _cache_window(self, w, rows):
+        self._cache[w] = rows
+        if len(self._cache) > self._max_windows:
+            self._cache.popitem(last=False)
+
+    def _raw(self, i):
+        """The row (its length, then its cells) as kept in the database"""
+        if not 0 <= i < self._nrows:
+            raise IndexError("row index out of range")
+        w, r = divmod(i, WINDOW_ROWS)
+        return self._window(w)[r]
+
+    def get(self, i, slot):
+        row = self._raw(i)
+        return self._codec.decode(row[slot + 1]) if slot < len(row) - 1 else None
+
+    def row(self, i):
+        """Return the values of the given row as a list"""
+        row = self._raw(i)
+        return self._codec.decode_all(row[1:]) + [None] * (self._ncols + 1 - len(row))
+
+    def row_length(self, i):
+        """The number of fields of the row"""
+        n = self._raw(i)[0]
+        return self._ncols if n is None else n
+
+    def get_cells(self, rows, slot):
+        return [self.get(i, slot) for i in rows]
+
+    def column_data(self, slot):
+        """
+        Return the cells of a column as a (cells, None) pair (like
+        ColumnStore.column_data()). This reads the whole column.
+        """
+        self._flush()
+        cells = self._db.execute(f"SELECT c{slot} FROM rows ORDER BY id")
+        return self._codec.decode_all(map(itemgetter(0), cells)), None
+
+    # (the cells are always kept as text; a column type only affects
+    # sorting and filtering)
+
+    def column_type(self, slot):
+        return None
+
+    def set_column_type(self, slot, ctype):
+        pass
+
+    def numeric_data(self, slot):
+        return None
+
+    def numeric_texts(self, slot):
+        return None
+
+    # endregion
+
+    # region prefetching (see prefetch.py)
+
+    @property
+    def cache_blocks(self):
+        """How many windows of rows the cache holds"""
+        return self._max_windows
+
+    def block_of(self, i):
+        """The window that row `i` is read in"""
+        return i // WINDOW_ROWS if 0 <= i < self._nrows else None
+
+    def has_block(self, w):
+        return w in self._cache
+
+    def read_block(self, w):
+        """
+        Read window `w` of rows without caching it (see add_block()).
+        This is safe to call from another thread (if SQLite is in
+        serialized mode; else it gives None).
+        """
+        if sqlite3.threadsafety < 3:
+            return None
+        return self._read_window(w)
+
+    def add_block(self, w, rows, version):
+        """
+        Cache a window that was read by read_block() when `block_version`
+        was `version` (unless the rows have changed since), with the
+        edits that haven't been written to the database yet
+        """
+        if version != self.block_version or w in self._cache:
+            return
+        first = w * WINDOW_ROWS
+        for slot, cells in self._updates.items():
+            for r in range(len(rows)):
+                if first + r in cells:
+                    self._patch(rows, r, slot, cells[first + r])
+        self._cache_window(w, rows)
+
+    # endregion
+
+    # region editing
+
+    def _begin(self):
+        """Start the transaction that changes go into (which a kept database never commits)"""
+        self._edited = True
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+
+    def set(self, i, slot, value):
+        """:raises UnicodeEncodeError: if `value` can't be encoded"""
+        value = self._codec.encode(value)
+        w, r = divmod(i, WINDOW_ROWS)
+        rows = self._cache.get(w)
+        if rows is not None and 0 <= r < len(rows):
+            self._patch(rows, r, slot, value)
+
+        self._updates.setdefault(slot, {})[i] = value
+        if sum(map(len, self._updates.values())) >= UPDATE_CELLS:
+            self._flush()
+
+    def _patch(self, rows, r, slot, value):
+        """Set a cell of row `r` of a window, as read from the database"""
+        row = rows[r] = list(rows[r])
+        if slot >= len(row) - 1:
+            row.extend([None] * (slot + 2 - len(row)))
+        row[slot + 1] = value
+        # (a short row only grows as far as it's filled in)
+        if value is not None and row[0] is not None and row[0] <= slot:
+            row[0] = slot + 1 if slot + 1 < self._ncols else None
+
+    def set_cells(self, rows, slot, values):
+        for i, value in zip(rows, values):
+            self.set(i, slot, value)
+
+    def _flush(self):
+        """Write the edits made since the last time to the database"""
+        if not self._updates:
+            return
+        self._begin()
+        for slot, cells in self._updates.items():
+            self._db.executemany(
+                f"UPDATE rows SET c{slot} = ?1, n = CASE WHEN ?1 IS NOT NULL AND n <= ?2 "
+                f"THEN nullif(?2 + 1, {self._ncols}) ELSE n END WHERE id = ?3",
+                ((value, slot, i + 1) for i, value in cells.items()))
+        self._updates.clear()
+        self.block_version += 1
+
+    def extend(self, rows):
+        """Append rows of raw text (read from the end of a followed file)"""
+        self._flush()
+        self._begin()
+        self.extend_chunk(RowChunk.from_rows(rows, self._ncols, self.keep_blank))
+
+    def replace_row(self, i, values):
+        """Replace the cells of a row with those of a row as read (see extend())"""
+        self._flush()
+        self._begin()
+        self.report.forget(i, self.row_length(i))
+        self._widen(len(values))
+        cells = values + [None] * (self._ncols - len(values))
+        n = len(values) if len(values) < self._ncols else None
+        marks = ", ".join("?" * (len(cells) + 1))
+        self._db.execute(f"UPDATE rows SET ({self._columns}) = ({marks}) WHERE id = ?",
+                         (n, *cells, i + 1))
+        self.report.add(i, len(values))
+        self._cache.pop(i // WINDOW_ROWS, None)
+        self.block_version += 1
+
+    def add_rows(self, count):
+        """Add `count` empty rows (as wide as the table) to the end"""
+        self._flush()
+        self._begin()
+        self._db.executemany("INSERT INTO rows (n) VALUES (NULL)", [()] * count)
+        # (the last window may have been short)
+        self._cache.pop(self._nrows // WINDOW_ROWS, None)
+        self._nrows += count
+        self.block_version += 1
+
+    def add_column(self):
+        """Add a new (empty) column and return its slot number"""
+        self._flush()
+        self._begin()
+        # (the rows that were as wide as the table still are)
+        self._db.execute(f"ALTER TABLE rows ADD COLUMN c{self._ncols}")
+        self.headers = self.headers + generic_headers(self._ncols + 1)[self._ncols:]
+        self._set_ncols(self._ncols + 1)
+        return self._ncols - 1
+
+    # endregion
+
+    # region sorting and filtering
+
+    def _value(self, raw, ctype):
+        """A cell as a value of the given type, or NULL if it's empty or isn't one"""
+        if not raw:
+            return None
+        try:
+            return parser(ctype)(self._codec.decode(raw))
+        except ValueError:
+            return None
+
+    def _contains(self, raw, needle):
+        return raw is not None and needle in self._codec.decode(raw).casefold()
+
+    def _key(self, slot, ctype):
+        """The SQL expression that a column is sorted by, as the given type"""
+        if parser(ctype) is None:
+            # (raw text sorts like the text itself, for UTF-8)
+            return f"coalesce(c{slot}, '')"
+        # (the type is written out, to match the expression of the index)
+        return f"qc_value(c{slot}, '{ctype}')"
+
+    def _condition(self, slot, condition):
+        """The SQL (and its parameters) for a sortfilter.Filter on a column"""
+        column, op, operand = f"c{slot}", condition.op, condition.operand
+        if op == "~":
+            needle = operand.casefold()
+            if needle.isascii():
+                # (LIKE only ignores the case of ASCII letters; the cells
+                # that aren't all ASCII, which can casefold to it -- "ß"
+                # to "ss" -- are checked like any other)
+                return (f"({column} LIKE ? ESCAPE '\\' OR ({column} GLOB ? "
+                        f"AND qc_contains({column}, ?)))",
+                        ["%" + _escape_like(needle) + "%", _NON_ASCII, needle])
+            return f"qc_contains({column}, ?)", [needle]
+
+        op = "<>" if op == "!=" else op
+        if not operand:
+            # (in)equality with nothing: the (non-)empty cells
+            return f"coalesce({column}, '') {op} ''", []
+        if condition.target is None:
+            return f"coalesce({column}, '') {op} ?", [self._codec.encode(operand)]
+        return f"{self._key(slot, condition.ctype)} {op} ?", [condition.target]
+
+    def select(self, slot, ctype, descending, filters, pieces=None):
+        """
+        The rows that match all of the `filters` ({slot: Filter}), sorted
+        by the column in `slot` (as type `ctype`), if that's not None.
+        Rows that sort the same stay in the order of the store, or that of
+        the table made of `pieces` (see pieces.py), which only has the
+        rows in them.
+
+        Sorting all the rows by a column indexes it (as that type), so
+        sorting by it again, either way, is quick, as are filters that
+        compare its values.
+
+        :return: the rows as an array
+        """
+        self._flush()
+        where, params = [], []
+        for fslot, condition in filters.items():
+            sql, args = self._condition(fslot, condition)
+            where.append(sql)
+            params.extend(args)
+
+        order = []
+        if slot is not None:
+            key = self._key(slot, ctype)
+            if where:
+                # (sorting the rows that match is quicker than going through
+                # the index for all of them, and "+" keeps it from doing that;
+                # the filters can still use indexes)
+                order.append("+" + key)
+            else:
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS k{slot}_{ctype} ON rows ({key})")
+                order.append(key)
+
+        if pieces is None:
+            source = "rows"
+            order.append("rows.id")
+        else:
+            # (the position of each row in the table is that of its piece,
+            # plus how far into the piece it is)
+            self._db.execute("DROP TABLE IF EXISTS temp.pieces")
+            self._db.execute("CREATE TEMP TABLE pieces (first INTEGER, last INTEGER, pos INTEGER)")
+            pos, spans = 0, []
+            for first, n in pieces:
+                spans.append((first + 1, first + n, pos - first - 1))
+                pos += n
+            self._db.executemany("INSERT INTO temp.pieces VALUES (?, ?, ?)", spans)
+            # (a CROSS JOIN goes through the pieces, and looks up the rows
+            # of each by rowid)
+            source = "temp.pieces AS p CROSS JOIN rows ON rows.id BETWEEN p.first AND p.last"
+            order.append("p.pos + rows.id")
+
+        direction = " DESC" if descending and slot is not None else ""
+        sql = (f"SELECT rows.id - 1 FROM {source}"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + " ORDER BY " + ", ".join(o + direction for o in order))
+
+        rows = array('q')
+        cursor = self._db.execute(sql, params)
+        while True:
+            batch = cursor.fetchmany(_FETCH_ROWS)
+            if not batch:
+                return rows
+            rows.extend(map(itemgetter(0), batch))
+
+    # endregion
@@ -0,0 +1,84 @@
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (QAbstractItemView, QCheckBox, QDockWidget, QHeaderView,
+                             QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget)
+
+
+class StatsPanel(QDockWidget):
+    """
+    Dock widget showing the statistics of the current column of a table
+    view (whose model must be a CSVTableModel): counts of empty and
+    distinct values, min, max, sum... (see colstats.py). The model keeps
+    them up to date, so showing them again after an edit is quick.
+    """
+
+    # (changes to the table come in bursts, while loading or pasting)
+    refresh_delay = 200
+
+    def __init__(self, view, *args, **kwargs):
+        super().__init__("Statistics", *args, **kwargs)
+        self.setObjectName("dock_stats")
+
+        self._view = view
+
+        self.table = QTableWidget(0, 2, self)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.approximate = QCheckBox("Approximate", self,
+                                     toolTip="Estimate the distinct values and quantiles, "
+                                             "for big tables")
+        self.approximate.toggled.connect(self.refresh)
+
+        body = QWidget(self)
+        layout = QVBoxLayout(body)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.table)
+        layout.addWidget(self.approximate)
+        self.setWidget(body)
+
+        self._timer = QTimer(self, singleShot=True, interval=self.refresh_delay,
+                             timeout=self.refresh)
+
+        model = view.model()
+        for signal in (model.dataChanged, model.rowsInserted, model.columnsInserted,
+                       model.columnsMoved, model.headerDataChanged):
+            signal.connect(self._schedule)
+        model.modelReset.connect(self._on_reset)
+        view.selectionModel().currentColumnChanged.connect(self._schedule)
+
+    def _on_reset(self):
+        # (a new table starts out in the mode its size calls for)
+        model = self._view.model()
+        self.approximate.blockSignals(True)
+        self.approximate.setChecked(model.rowCount() > model.stats_approx_rows)
+        self.approximate.blockSignals(False)
+        self._schedule()
+
+    def _schedule(self, *args):
+        if self.isVisible() and not self._timer.isActive():
+            self._timer.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+    def refresh(self):
+        """Show the statistics of the current column"""
+        model = self._view.model()
+        column = self._view.currentIndex().column()
+        if column < 0 or column >= model.columnCount():
+            self.setWindowTitle("Statistics")
+            self.table.setRowCount(0)
+            return
+
+        name = model.headerData(column, Qt.Horizontal)
+        self.setWindowTitle(f"Statistics: {name}")
+
+        items = model.column_stats(column, self.approximate.isChecked()).items()
+        self.table.setRowCount(len(items))
+        for row, (label, text) in enumerate(items):
+            self.table.setItem(row, 0, QTableWidgetItem(label))
+            self.table.setItem(row, 1, QTableWidgetItem(text))
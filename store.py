@@ -0,0 +1,898 @@
+from array import array
+from itertools import compress, islice
+
+from coltypes import INT, NUMERIC, formatter, numeric_format, parser
+
+# a column stops dictionary-encoding its values once it has seen at
+# least this many distinct values...
+_MIN_DISTINCT = 4096
+# ...and more than this fraction of its cells are distinct
+_MAX_DISTINCT_RATIO = 0.5
+
+# the types of the columns are inferred from this many rows
+TYPE_SAMPLE_ROWS = 1000
+
+# a numeric column goes back to storing text once it holds more than
+# this many cells that aren't (exactly) numbers...
+_MIN_TEXTS = 64
+# ...and they make up more than this fraction of the column
+_MAX_TEXT_RATIO = 0.01
+
+_INT_RANGE = range(-2**63, 2**63)
+
+# rows are transposed into columns this many at a time
+_ENCODE_ROWS = 8192
+
+# a ScanReport keeps the numbers of (at most) this many rows of each kind
+REPORT_ROWS = 1000
+
+
+def _skip_blank(batch, first, blanks):
+    """
+    Drop the blank rows ([]) from a batch of rows, adding the positions
+    they had -- the number of the row that followed each, counting from
+    `first` -- to the list `blanks`
+
+    :return: the rows that aren't blank
+    """
+    # (the usual case)
+    if all(batch):
+        return batch
+    kept = []
+    for row in batch:
+        if row:
+            kept.append(row)
+        else:
+            blanks.append(first + len(kept))
+    return kept
+
+
+class ScanReport:
+    """
+    The rows of a table that don't have as many fields as its header (or
+    its first row, without a header): counts of the short, long and blank
+    ones, and the numbers of the first REPORT_ROWS of each. It's filled in
+    as the rows are read.
+
+    Blank rows that were skipped are numbered by the row that followed
+    them.
+    """
+
+    def __init__(self, width=None):
+        # the number of fields a row should have (None until known)
+        self.width = width
+        # the most fields in any row
+        self.widest = width or 0
+        self.short = 0
+        self.long = 0
+        self.blank = 0
+        self.short_rows = []
+        self.long_rows = []
+        self.blank_rows = []
+
+    def __bool__(self):
+        """True if any of the rows are ragged or blank"""
+        return bool(self.short or self.long or self.blank)
+
+    def _kind(self, length):
+        if not length:
+            return "blank"
+        if length < self.width:
+            return "short"
+        if length > self.width:
+            return "long"
+        return None
+
+    def add(self, row, length):
+        """Count a row that has `length` fields (0 for a blank row)"""
+        if length == self.width:
+            return
+        if length > self.widest:
+            self.widest = length
+        kind = self._kind(length)
+        setattr(self, kind, getattr(self, kind) + 1)
+        rows = getattr(self, kind + "_rows")
+        if len(rows) < REPORT_ROWS:
+            rows.append(row)
+
+    def add_lengths(self, first, lengths):
+        """Count the rows numbered from `first` with the given lengths (an array)"""
+        # (the usual case)
+        if lengths.count(self.width) == len(lengths):
+            return
+        for row, length in enumerate(lengths, first):
+            if length != self.width:
+                self.add(row, length)
+
+    def add_blank(self, rows):
+        """Count blank rows that were skipped (see above for their numbers)"""
+        self.blank += len(rows)
+        self.blank_rows.extend(rows[:REPORT_ROWS - len(self.blank_rows)])
+
+    def forget(self, row, length):
+        """Take back the counting of a row (that is about to be read again)"""
+        kind = self._kind(length) if length != self.width else None
+        if kind is None:
+            return
+        setattr(self, kind, getattr(self, kind) - 1)
+        rows = getattr(self, kind + "_rows")
+        if rows and rows[-1] == row:
+            rows.pop()
+
+    def as_dict(self):
+        return {
+            "width": self.width,
+            "widest": self.widest,
+            "short": self.short,
+            "long": self.long,
+            "blank": self.blank,
+            "short_rows": self.short_rows,
+            "long_rows": self.long_rows,
+            "blank_rows": self.blank_rows,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        report = cls(d["width"])
+        for key, value in d.items():
+            setattr(report, key, value)
+        return report
+
+    def summary(self):
+        """The report as lines of text (with row numbers counting from 1)"""
+        lines = []
+        for kind, what in (("short", "fewer"), ("long", "more")):
+            count = getattr(self, kind)
+            if count:
+                lines.append(f"{count:,} {kind} rows ({what} than {self.width} fields): "
+                             + _row_list(getattr(self, kind + "_rows"), count))
+        if self.blank:
+            lines.append(f"{self.blank:,} blank rows: " + _row_list(self.blank_rows, self.blank))
+        if self.long:
+            lines.append(f"The longest row has {self.widest} fields")
+        return lines or [f"All rows have {self.width} fields"]
+
+
+def _row_list(rows, count, shown=20):
+    text = ", ".join(str(row + 1) for row in rows[:shown])
+    return text + ("..." if count > shown else "")
+
+
+class Column:
+    """
+    Compact storage for the cells of a single column.
+
+    Values are dictionary-encoded: each distinct value is stored once and
+    the cells are kept as an array of integer codes into that table (code
+    0 is always None). If it turns out that most of the values in the
+    column are unique, the encoding no longer pays for itself and the
+    column falls back to a plain list of values.
+    """
+
+    __slots__ = ("_codes", "_values", "_lookup", "_cells")
+
+    def __init__(self, length=0):
+        self._codes = array('I', bytes(length * 4))
+        self._values = [None]
+        self._lookup = {None: 0}
+
+        # used instead of the above once the column is no longer encoded
+        self._cells = None
+
+    @classmethod
+    def from_cells(cls, cells):
+        """Make a column holding a list of cells (which it may keep)"""
+        col = cls()
+        nvals = len(set(cells))
+        if nvals > _MIN_DISTINCT and nvals > len(cells) * _MAX_DISTINCT_RATIO:
+            # (not worth encoding)
+            col._cells = cells
+            col._codes = col._values = col._lookup = None
+        else:
+            col.extend(cells)
+        return col
+
+    @property
+    def encoded(self):
+        return self._cells is None
+
+    def __len__(self):
+        if self._cells is None:
+            return len(self._codes)
+        return len(self._cells)
+
+    def _code(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _check_ratio(self):
+        nvals = len(self._values)
+        if nvals > _MIN_DISTINCT and nvals > len(self._codes) * _MAX_DISTINCT_RATIO:
+            values = self._values
+            self._cells = [values[c] for c in self._codes]
+            self._codes = self._values = self._lookup = None
+
+    def append(self, value):
+        if self._cells is None:
+            self._codes.append(self._code(value))
+            # only check every so often
+            if not len(self._codes) & 0x3ff:
+                self._check_ratio()
+        else:
+            self._cells.append(value)
+
+    def extend(self, cells):
+        """Append a sequence of cells"""
+        if self._cells is None:
+            # encode each distinct value once
+            lookup = dict.fromkeys(cells)
+            table, values = self._lookup, self._values
+            for value in lookup:
+                code = table.get(value)
+                if code is None:
+                    code = table[value] = len(values)
+                    values.append(value)
+                lookup[value] = code
+            self._codes.extend(map(lookup.__getitem__, cells))
+            self._check_ratio()
+        else:
+            self._cells.extend(cells)
+
+    def extend_encoded(self, values, codes):
+        """
+        Append cells that have been dictionary-encoded elsewhere.
+
+        :param list values: the distinct values referenced by `codes`
+        :param codes: array of indexes into `values`
+        """
+        if self._cells is None:
+            # translate the chunk's codes into codes for this column
+            code = self._code
+            trans = [code(v) for v in values]
+            self._codes.extend(map(trans.__getitem__, codes))
+            self._check_ratio()
+        else:
+            self._cells.extend(map(values.__getitem__, codes))
+
+    def __getitem__(self, i):
+        if self._cells is None:
+            return self._values[self._codes[i]]
+        return self._cells[i]
+
+    def data(self):
+        """
+        :return: (values, codes) if the column is encoded, else (cells, None)
+        """
+        if self._cells is None:
+            return self._values, self._codes
+        return self._cells, None
+
+    def __setitem__(self, i, value):
+        # note: values that are no longer referenced stay in the table
+        if self._cells is None:
+            self._codes[i] = self._code(value)
+        else:
+            self._cells[i] = value
+
+
+class _TooManyTexts(Exception):
+    """Raised by a NumericColumn that should store text instead"""
+
+
+class NumericColumn:
+    """
+    Storage for a column of numbers: an array('q') of ints or an
+    array('d') of floats, with a mask (a byte per cell) of the empty
+    cells. Values are parsed when they are stored, and formatted back to
+    text only when they're read.
+
+    A cell whose text isn't exactly what formatting its number gives
+    ("007", say), or that isn't a number at all, keeps its text on the
+    side. If there are too many of those, _TooManyTexts is raised (after
+    storing the value) and the column should be converted back to a
+    text column with to_text().
+    """
+
+    __slots__ = ("ctype", "decimals", "_values", "_nulls", "_texts", "_parse", "_format")
+
+    def __init__(self, ctype, decimals=None):
+        self.ctype = ctype
+        self.decimals = decimals
+
+        self._values = array('q' if ctype == INT else 'd')
+        # 1 for empty cells (and for text that isn't a number)
+        self._nulls = bytearray()
+        # row -> text, for the cells that can't be formatted from a number
+        self._texts = {}
+
+        self._parse = parser(ctype)
+        self._format = formatter(ctype, decimals)
+
+    def __len__(self):
+        return len(self._values)
+
+    def _convert(self, value):
+        """:return: (number, null flag, text to keep or None) for a value"""
+        if not value:
+            # (an empty string is an empty cell, too)
+            return 0, 1, None
+        try:
+            x = self._parse(value)
+        except ValueError:
+            return 0, 1, value
+        if self.ctype == INT and x not in _INT_RANGE:
+            return 0, 1, value
+        return x, 0, (None if self._format(x) == value else value)
+
+    def _check_texts(self):
+        ntexts = len(self._texts)
+        if ntexts > _MIN_TEXTS and ntexts > len(self._values) * _MAX_TEXT_RATIO:
+            raise _TooManyTexts()
+
+    def append(self, value):
+        x, null, text = self._convert(value)
+        self._values.append(x)
+        self._nulls.append(null)
+        if text is not None:
+            self._texts[len(self._values) - 1] = text
+            self._check_texts()
+
+    def _exact_numbers(self, values):
+        """
+        Parse a list of values in one go, if they are all numbers written
+        just like they'd be formatted (the common case).
+
+        :return: the list of numbers, or None
+        """
+        try:
+            numbers = list(map(int if self.ctype == INT else float, values))
+        except (ValueError, TypeError):
+            return None
+        if list(map(self._format, numbers)) != values:
+            return None
+        if self.ctype == INT and numbers and not (min(numbers) in _INT_RANGE
+                                                  and max(numbers) in _INT_RANGE):
+            return None
+        return numbers
+
+    def _convert_all(self, values):
+        """:return: (numbers, null flags, {index: text to keep}) for a list of values"""
+        # (the first of a table of distinct values is usually None)
+        if values and values[0] is None:
+            numbers = self._exact_numbers(values[1:])
+            if numbers is not None:
+                return [0] + numbers, b'\x01' + bytes(len(numbers)), {}
+
+        converted = [self._convert(v) for v in values]
+        return ([c[0] for c in converted], bytes(c[1] for c in converted),
+                {i: c[2] for i, c in enumerate(converted) if c[2] is not None})
+
+    def extend(self, cells):
+        """Append a sequence of cells"""
+        cells = list(cells)
+        numbers = self._exact_numbers(cells)
+        if numbers is not None:
+            self._values.extend(numbers)
+            self._nulls.extend(bytes(len(numbers)))
+            return
+
+        # convert each distinct value once
+        lookup = dict.fromkeys(cells)
+        values = list(lookup)
+        for code, value in enumerate(values):
+            lookup[value] = code
+        self.extend_encoded(values, list(map(lookup.__getitem__, cells)))
+
+    def extend_encoded(self, values, codes):
+        """Append dictionary-encoded cells (see Column.extend_encoded())"""
+        first = len(self._values)
+
+        numbers, nulls, textcodes = self._convert_all(values)
+        self._values.extend(map(numbers.__getitem__, codes))
+        self._nulls.extend(map(nulls.__getitem__, codes))
+
+        if textcodes:
+            for i, code in enumerate(codes, first):
+                if code in textcodes:
+                    self._texts[i] = textcodes[code]
+            self._check_texts()
+
+    def __getitem__(self, i):
+        if self._texts:
+            text = self._texts.get(i)
+            if text is not None:
+                return text
+        if self._nulls[i]:
+            return None
+        return self._format(self._values[i])
+
+    def __setitem__(self, i, value):
+        x, null, text = self._convert(value)
+        self._values[i] = x
+        self._nulls[i] = null
+        self._texts.pop(i, None)
+        if text is not None:
+            self._texts[i] = text
+            self._check_texts()
+
+    def data(self):
+        """The cells as text, as a (cells, None) pair (see Column.data())"""
+        cells = list(map(self._format, self._values))
+        for i in compress(range(len(cells)), self._nulls):
+            cells[i] = None
+        for i, text in self._texts.items():
+            cells[i] = text
+        return cells, None
+
+    def numbers(self):
+        """:return: the (values, nulls) arrays; don't modify them"""
+        return self._values, self._nulls
+
+    def texts(self):
+        """:return: {row: text} for the cells not stored as numbers; don't modify it"""
+        return self._texts
+
+    def cells(self):
+        """The contents of the column, as NumericCells"""
+        return NumericCells(self.ctype, self.decimals, self._values, self._nulls, self._texts)
+
+    def extend_cells(self, cells):
+        """Append NumericCells of the same type (and format)"""
+        first = len(self._values)
+        self._values.extend(cells.values)
+        self._nulls.extend(cells.nulls)
+        if cells.texts:
+            self._texts.update((first + i, text) for i, text in cells.texts.items())
+            self._check_texts()
+
+    def to_text(self):
+        """Return a (text) Column with the same cells"""
+        return Column.from_cells(self.data()[0])
+
+
+class NumericCells:
+    """A column of a ColumnChunk that has been parsed into numbers (see NumericColumn)"""
+
+    __slots__ = ("ctype", "decimals", "values", "nulls", "texts")
+
+    def __init__(self, ctype, decimals, values, nulls, texts):
+        self.ctype = ctype
+        self.decimals = decimals
+        self.values = values
+        self.nulls = nulls
+        self.texts = texts
+
+    def as_text(self):
+        """:return: the cells as a list of text"""
+        fmt = formatter(self.ctype, self.decimals)
+        cells = [None if null else fmt(x) for x, null in zip(self.values, self.nulls)]
+        for i, text in self.texts.items():
+            cells[i] = text
+        return cells
+
+
+class ColumnChunk:
+    """
+    A batch of rows, dictionary-encoded column by column so that it can be
+    built away from the GUI thread (or in another process) and cheaply
+    appended to a ColumnStore.
+    """
+
+    __slots__ = ("nrows", "columns", "lengths", "blanks")
+
+    def __init__(self, nrows, columns, lengths=None, blanks=()):
+        self.nrows = nrows
+        # a (values, codes) pair per column, or NumericCells once
+        # parse_numbers() has been called
+        self.columns = columns
+        # the number of fields of each row (an array)
+        self.lengths = array('I', [len(columns)] * nrows) if lengths is None else lengths
+        # where blank rows were skipped (see ScanReport.add_blank()),
+        # counting from the first row of the chunk
+        self.blanks = list(blanks)
+
+    def __len__(self):
+        return self.nrows
+
+    @classmethod
+    def from_rows(cls, rows, ncols, keep_blank=False):
+        """
+        Encode the given rows. Short rows are padded with None; a row
+        with extra fields adds columns to the chunk (just like
+        ColumnStore.extend()). Blank rows are skipped unless `keep_blank`.
+        """
+        lookups = [{None: 0} for _ in range(ncols)]
+        values = [[None] for _ in range(ncols)]
+        codes = [array('I') for _ in range(ncols)]
+        lengths = array('I')
+        blanks = []
+
+        # encode a column at a time, in (cache-friendly) batches of rows
+        rows = iter(rows)
+        nrows = 0
+        while True:
+            batch = list(islice(rows, _ENCODE_ROWS))
+            if not batch:
+                break
+            if not keep_blank:
+                batch = _skip_blank(batch, nrows, blanks)
+
+            lens = array('I', map(len, batch))
+            width = max(lens, default=0)
+            if width > ncols:
+                # (the new columns are empty in the rows so far)
+                for _ in range(width - ncols):
+                    lookups.append({None: 0})
+                    values.append([None])
+                    codes.append(array('I', bytes(4 * nrows)))
+                ncols = width
+            if lens.count(ncols) != len(lens):
+                batch = [row if len(row) >= ncols else row + [None] * (ncols - len(row))
+                         for row in batch]
+            lengths.extend(lens)
+            nrows += len(batch)
+
+            for lookup, vals, cds, cells in zip(lookups, values, codes, zip(*batch)):
+                for value in dict.fromkeys(cells):
+                    if value not in lookup:
+                        lookup[value] = len(vals)
+                        vals.append(value)
+                cds.extend(map(lookup.__getitem__, cells))
+
+        return cls(nrows, list(zip(values, codes)), lengths, blanks)
+
+    def parse_numbers(self):
+        """
+        Parse the columns that look like numbers (see NumericColumn), so
+        that doesn't have to happen when the chunk is added to a store.
+        """
+        for i, (values, codes) in enumerate(self.columns):
+            fmt = numeric_format(islice(values, TYPE_SAMPLE_ROWS))
+            if fmt is None:
+                continue
+            col = NumericColumn(*fmt)
+            try:
+                col.extend_encoded(values, codes)
+            except _TooManyTexts:
+                continue
+            self.columns[i] = col.cells()
+
+
+class ColumnStore:
+    """
+    Column-oriented in-memory table. Cells are addressed by (row, slot),
+    where `slot` is the index of the column in the store; mapping slots to
+    header names (and display positions) is up to the user of the store.
+
+    A store with a `codec` (see charset.CellCodec) keeps the cells of a
+    file that was parsed from its bytes as raw text: the rows that are
+    appended to it are raw, and cells are decoded as they are read (and
+    encoded as they are set).
+    """
+
+    # for compatibility with lazily-loaded stores
+    complete = True
+
+    def __init__(self, ncols=0, codec=None, keep_blank=False):
+        """
+        :param keep_blank: if False, blank rows are skipped as they're
+            appended (and only counted, by the `report`)
+        """
+        self._columns = [Column() for _ in range(ncols)]
+        self._nrows = 0
+        self.codec = codec
+        self.keep_blank = keep_blank
+
+        # the number of fields of each row, as read (rows are padded to
+        # the width of the table, but saved as long as they were)
+        self._lengths = array('I')
+        self.report = ScanReport(ncols)
+
+        # True once the types of the columns have been inferred
+        self._typed = False
+        # slots whose type was chosen with set_column_type()
+        self._pinned = set()
+
+    @property
+    def ncols(self):
+        return len(self._columns)
+
+    def __len__(self):
+        return self._nrows
+
+    def close(self):
+        pass
+
+    def _widen(self, ncols):
+        """Add (empty) columns up to `ncols`"""
+        for _ in range(ncols - len(self._columns)):
+            self._columns.append(Column(self._nrows))
+
+    def append_row(self, row):
+        """
+        Add a row of values to the end of the table. Short rows are
+        padded with None; a row with extra fields adds columns to the
+        table (which are empty in the other rows).
+        """
+        if not row and not self.keep_blank:
+            self.report.add_blank([self._nrows])
+            return
+
+        self._widen(len(row))
+        columns = self._columns
+        for slot, (col, value) in enumerate(zip(columns, row)):
+            try:
+                col.append(value)
+            except _TooManyTexts:
+                self._untype(slot)
+        for col in columns[len(row):]:
+            col.append(None)
+        self.report.add(self._nrows, len(row))
+        self._lengths.append(len(row))
+        self._nrows += 1
+
+        if not self._typed and self._nrows >= TYPE_SAMPLE_ROWS:
+            self.infer_types()
+
+    def extend(self, rows, batch_rows=_ENCODE_ROWS):
+        """Append rows (padded, or adding columns, like in append_row())"""
+        # (a batch at a time, which lets the columns process their cells
+        # in bulk)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_rows))
+            if not batch:
+                break
+            if not self.keep_blank:
+                blanks = []
+                batch = _skip_blank(batch, self._nrows, blanks)
+                if blanks:
+                    self.report.add_blank(blanks)
+
+            lens = array('I', map(len, batch))
+            self._widen(max(lens, default=0))
+            ncols = self.ncols
+            if lens.count(ncols) != len(lens):
+                batch = [row if len(row) >= ncols else row + [None] * (ncols - len(row))
+                         for row in batch]
+
+            for slot, cells in enumerate(zip(*batch)):
+                try:
+                    self._columns[slot].extend(cells)
+                except _TooManyTexts:
+                    self._untype(slot)
+            self.report.add_lengths(self._nrows, lens)
+            self._lengths.extend(lens)
+            self._nrows += len(batch)
+
+            if not self._typed and self._nrows >= TYPE_SAMPLE_ROWS:
+                self.infer_types()
+
+    def extend_chunk(self, chunk):
+        """Append the rows of a ColumnChunk"""
+        self._widen(len(chunk.columns))
+        for slot, cells in enumerate(chunk.columns):
+            col = self._columns[slot]
+            try:
+                if not isinstance(cells, NumericCells):
+                    col.extend_encoded(*cells)
+                elif isinstance(col, NumericColumn) and (col.ctype, col.decimals) == (cells.ctype, cells.decimals):
+                    col.extend_cells(cells)
+                elif not self._nrows and not self._typed and slot not in self._pinned:
+                    # (the first chunk decides the type)
+                    col = self._columns[slot] = NumericColumn(cells.ctype, cells.decimals)
+                    col.extend_cells(cells)
+                else:
+                    col.extend(cells.as_text())
+            except _TooManyTexts:
+                self._untype(slot)
+
+        # (a chunk of narrower rows than some that came before)
+        for slot in range(len(chunk.columns), self.ncols):
+            try:
+                self._columns[slot].extend([None] * chunk.nrows)
+            except _TooManyTexts:
+                self._untype(slot)
+
+        self.report.add_blank([self._nrows + i for i in chunk.blanks])
+        self.report.add_lengths(self._nrows, chunk.lengths)
+        self._lengths.extend(chunk.lengths)
+        self._nrows += chunk.nrows
+
+        if not self._typed and self._nrows >= TYPE_SAMPLE_ROWS:
+            self.infer_types()
+
+    def row_length(self, row):
+        """The number of fields the row has (which may be fewer than the columns of the table)"""
+        return self._lengths[row]
+
+    def replace_row(self, row, values):
+        """Replace the cells of a row with those of a row as read (see append_row())"""
+        self.report.forget(row, self._lengths[row])
+        self._widen(len(values))
+        for slot, col in enumerate(self._columns):
+            try:
+                col[row] = values[slot] if slot < len(values) else None
+            except _TooManyTexts:
+                self._untype(slot)
+        self.report.add(row, len(values))
+        self._lengths[row] = len(values)
+
+    def _untype(self, slot):
+        self._columns[slot] = self._columns[slot].to_text()
+
+    def infer_types(self):
+        """
+        Store the columns whose values (in the first TYPE_SAMPLE_ROWS rows)
+        are numbers as NumericColumns. This happens by itself once the
+        store has that many rows; call it when a smaller table is done
+        loading. Only the first call does anything.
+        """
+        if self._typed:
+            return
+        self._typed = True
+
+        for slot, col in enumerate(self._columns):
+            if slot in self._pinned or not isinstance(col, Column):
+                continue
+            fmt = numeric_format(islice(col, TYPE_SAMPLE_ROWS))
+            if fmt is not None:
+                self._convert(slot, *fmt)
+
+    def _convert(self, slot, ctype, decimals):
+        """
+        Try to turn a text column into a NumericColumn.
+
+        :return: False if too many of its values aren't numbers
+        """
+        col = self._columns[slot]
+        numeric = NumericColumn(ctype, decimals)
+        try:
+            values, codes = col.data()
+            if codes is None:
+                numeric.extend(values)
+            else:
+                numeric.extend_encoded(values, codes)
+        except _TooManyTexts:
+            return False
+
+        self._columns[slot] = numeric
+        return True
+
+    def column_type(self, slot):
+        """The type of a numeric column (see coltypes), or None for text"""
+        col = self._columns[slot]
+        return col.ctype if isinstance(col, NumericColumn) else None
+
+    def set_column_type(self, slot, ctype):
+        """
+        Store a column as numbers of the given type, or as text (for any
+        other type). The type is kept from then on.
+
+        :raises ValueError: if too many of the values aren't numbers of
+            that type
+        """
+        self._pinned.add(slot)
+        col = self._columns[slot]
+
+        if ctype not in NUMERIC:
+            if isinstance(col, NumericColumn):
+                self._untype(slot)
+            return
+
+        if isinstance(col, NumericColumn):
+            if col.ctype == ctype:
+                return
+            self._untype(slot)
+
+        fmt = numeric_format(islice(self._columns[slot], TYPE_SAMPLE_ROWS), ctype, min_exact=0)
+        if fmt is None or not self._convert(slot, *fmt):
+            raise ValueError(f"too many of the values aren't {ctype}s")
+
+    def numeric_data(self, slot):
+        """
+        :return: the (values, nulls) arrays of a numeric column (see
+            NumericColumn), or None for a text column
+        """
+        col = self._columns[slot]
+        return col.numbers() if isinstance(col, NumericColumn) else None
+
+    def numeric_texts(self, slot):
+        """
+        :return: {row: text} for the cells of a numeric column that are
+            kept as text (see NumericColumn), or None for a text column
+        """
+        col = self._columns[slot]
+        if not isinstance(col, NumericColumn):
+            return None
+        if self.codec is None:
+            return col.texts()
+        decode = self.codec.decode
+        return {row: decode(text) for row, text in col.texts().items()}
+
+    def get(self, row, slot):
+        if not 0 <= row < self._nrows:
+            raise IndexError("row index out of range")
+        if self.codec is None:
+            return self._columns[slot][row]
+        return self.codec.decode(self._columns[slot][row])
+
+    def set(self, row, slot, value):
+        """
+        :raises UnicodeEncodeError: if the store has a codec, and `value`
+            can't be encoded
+        """
+        if not 0 <= row < self._nrows:
+            raise IndexError("row index out of range")
+        if self.codec is not None:
+            value = self.codec.encode(value)
+        if value is not None and slot >= self._lengths[row]:
+            self._lengths[row] = slot + 1
+        try:
+            self._columns[slot][row] = value
+        except _TooManyTexts:
+            self._untype(slot)
+
+    def get_cells(self, rows, slot):
+        """The values of a column at the given rows, as a list"""
+        col = self._columns[slot]
+        if self.codec is None:
+            return [col[row] for row in rows]
+        decode = self.codec.decode
+        return [decode(col[row]) for row in rows]
+
+    def set_cells(self, rows, slot, values):
+        """Set the cells of a column at the given rows to the given values"""
+        if self.codec is not None:
+            values = list(map(self.codec.encode, values))
+        cells = zip(rows, values)
+        col = self._columns[slot]
+        lengths = self._lengths
+        while True:
+            try:
+                for row, value in cells:
+                    if value is not None and slot >= lengths[row]:
+                        lengths[row] = slot + 1
+                    col[row] = value
+                return
+            except _TooManyTexts:
+                # (and carry on with the rest in the text column)
+                self._untype(slot)
+                col = self._columns[slot]
+
+    def column_data(self, slot):
+        """
+        Return the contents of a column for bulk processing: a (values,
+        codes) pair if it is dictionary-encoded (cell i is
+        values[codes[i]]), else a (cells, None) pair. Don't modify them.
+        """
+        values, codes = self._columns[slot].data()
+        if self.codec is not None:
+            # (only the distinct values of an encoded column)
+            values = self.codec.decode_all(values)
+        return values, codes
+
+    def row(self, row):
+        """Return the values of the given row as a list"""
+        return [self.get(row, slot) for slot in range(len(self._columns))]
+
+    def add_rows(self, count):
+        """Add `count` empty rows (as wide as the table) to the end"""
+        for slot in range(self.ncols):
+            try:
+                self._columns[slot].extend([None] * count)
+            except _TooManyTexts:
+                self._untype(slot)
+        self._lengths.extend([self.ncols] * count)
+        self._nrows += count
+
+    def add_column(self):
+        """Add a new (empty) column and return its slot number"""
+        # (the rows that were as wide as the table still are)
+        ncols = self.ncols
+        self._lengths = array('I', (n + 1 if n == ncols else n for n in self._lengths))
+        self._columns.append(Column(self._nrows))
+        return len(self._columns) - 1
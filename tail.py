@@ -0,0 +1,139 @@
+import csv
+import io
+import locale
+import os
+
+# how many bytes before the read position are checked to tell a file
+# that was truncated and written again from one that just grew
+MARK_BYTES = 64
+
+
+class FileTail:
+    """
+    Reads the records appended to a csv file, starting from a byte offset
+    where a record starts.
+
+    Only complete records are read: an unfinished line at the end of the
+    file (or a quoted field that hasn't been closed yet) is left for the
+    next read. The file is opened anew for each read, so a file that is
+    rotated (renamed and replaced with a new one) is noticed by status().
+    """
+
+    def __init__(self, path, dialect, offset, encoding=None):
+        self.path = path
+        self.offset = offset
+        self._dialect = dialect
+        self._encoding = encoding or locale.getpreferredencoding(False)
+
+        # with QUOTE_NONE, the quotechar has no special meaning
+        if dialect.quoting == csv.QUOTE_NONE or not dialect.quotechar:
+            self._quote = None
+        else:
+            self._quote = dialect.quotechar.encode(self._encoding)
+
+        st = os.stat(path)
+        self._id = (st.st_dev, st.st_ino)
+        self._mark = self._read_mark(offset)
+
+    def _read_mark(self, offset):
+        start = max(0, offset - MARK_BYTES)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(offset - start)
+
+    def skip_to(self, offset):
+        """Move the read position to `offset` (the data before it is taken as read)"""
+        self.offset = offset
+        self._mark = self._read_mark(offset)
+
+    def rewind_partial(self):
+        """
+        If the data read so far ends partway through a line, move back to
+        the start of that line, so that it's read again once it has been
+        finished.
+
+        :return: True if the read position moved
+        """
+        if not self.offset or self._mark.endswith(b'\n'):
+            return False
+
+        with open(self.path, 'rb') as f:
+            pos = self.offset
+            while pos > 0:
+                start = max(0, pos - io.DEFAULT_BUFFER_SIZE)
+                f.seek(start)
+                nl = f.read(pos - start).rfind(b'\n')
+                if nl >= 0:
+                    self.skip_to(start + nl + 1)
+                    return True
+                pos = start
+        return False
+
+    def status(self):
+        """
+        How the file has changed since it was last read:
+
+        "grown", if there's more to read; "truncated", if the data that
+        was read is gone (the file was cut short, or emptied and written
+        again); "replaced", if the path now refers to a different file;
+        None if it hasn't changed, or if there's no file at the path (as
+        happens for a moment while a log is rotated)
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        if (st.st_dev, st.st_ino) != self._id:
+            return "replaced"
+        if st.st_size < self.offset:
+            return "truncated"
+        if st.st_size > self.offset:
+            if self._read_mark(self.offset) != self._mark:
+                return "truncated"
+            return "grown"
+        return None
+
+    def read(self, max_bytes=4 * 1024 * 1024):
+        """
+        Read (up to about `max_bytes` of) the complete records that follow
+        the read position, and move past them.
+
+        :return: a list of the rows (blank lines are empty rows)
+        """
+        with open(self.path, 'rb') as f:
+            while True:
+                f.seek(self.offset)
+                data = f.read(max_bytes)
+                end = self._records_end(data)
+                if end or len(data) < max_bytes:
+                    break
+                # (a record longer than max_bytes)
+                max_bytes *= 2
+
+        if not end:
+            return []
+
+        text = data[:end].decode(self._encoding)
+        self.offset += end
+        self._mark = (self._mark + data[:end])[-MARK_BYTES:]
+        return list(csv.reader(io.StringIO(text, newline=''), self._dialect))
+
+    def _records_end(self, data):
+        """The end of the last complete record in `data` (which starts with a record)"""
+        q, count, find = self._quote, data.count, data.find
+        inquote = False
+        end = i = 0
+        while True:
+            j = find(b'\n', i)
+            if j < 0:
+                return end
+            j += 1
+
+            # an odd number of quote chars on a line means it either opens
+            # or closes a quoted field with an embedded newline
+            if q and count(q, i, j) & 1:
+                inquote = not inquote
+            if not inquote:
+                end = j
+            i = j
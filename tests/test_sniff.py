@@ -0,0 +1,75 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import BadSniffException, detect_format
+from sniff import DialectCache, sniff_file
+
+
+def write(tmp_path, text, name="data.csv"):
+    path = tmp_path / name
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+# (the csv module's, and Excel's, output: CRLF line ends, and fields with
+# quotes, delimiters or line breaks in them quoted; csv.Sniffer takes the
+# delimiter of these to be "\r", "i" or " ")
+@pytest.mark.parametrize("text", [
+    ',"end ""q"""\r\nKingston upon Hull,"a\r\nb"\r\n',
+    'Kingston upon Hull,beta\r\nx,"multi\nline"\r\n',
+    'name,note\r\n"Smith, John","said ""hi"""\r\nDoe,"two\nlines"\r\nRoe,plain\r\n',
+])
+def test_sniff_quoted_crlf(tmp_path, text):
+    path = write(tmp_path, text)
+    dialect, header, skip = sniff_file(path, encoding="utf-8")
+
+    assert dialect.delimiter == ","
+    assert dialect.quotechar == '"'
+    assert skip == 0
+    with open(path, newline="", encoding="utf-8") as f:
+        assert list(csv.reader(f, dialect)) == list(csv.reader(text.splitlines(True)))
+
+
+def test_sniff_other_delimiters(tmp_path):
+    path = write(tmp_path, 'a;b;c\r\n1;"x;y";2\r\n3;"p\nq";4\r\n')
+    dialect, header, skip = sniff_file(path, encoding="utf-8")
+    assert dialect.delimiter == ";"
+
+    path = write(tmp_path, "a\tb\r\n1\t2\r\n3\t4\r\n")
+    dialect, header, skip = sniff_file(path, encoding="utf-8")
+    assert dialect.delimiter == "\t"
+
+
+def test_unsniffable(tmp_path):
+    path = write(tmp_path, "one\r\ntwo\r\nthree\r\n")
+    with pytest.raises(BadSniffException):
+        detect_format(path, encoding="utf-8")
+
+
+def test_cache_ignores_bad_delimiter(tmp_path):
+    path = write(tmp_path, "a,b\r\n1,2\r\n")
+    cache = DialectCache(str(tmp_path / "dialects.json"))
+    cache.put(path, csv.excel, True)
+    assert cache.get(path)[0].delimiter == ","
+
+    class Wrong(csv.excel):
+        delimiter = "\r"
+    cache.put(path, Wrong, True)
+    assert cache.get(path) is None
+
+
+def test_header_over_mixed_numbers(tmp_path):
+    # (numbers mixed with quoted text, which csv.Sniffer.has_header gives up on)
+    text = ('id,price,name\r\n0,757.95,beta\r\n"1, ""0""","98.76, ""1""",gamma\r\n'
+            '2,710.25,red\r\n3,489.29,"north, ""3"""\r\n')
+    dialect, header, skip = sniff_file(write(tmp_path, text), encoding="utf-8")
+    assert header
+
+    dialect, header, skip = sniff_file(write(tmp_path, text.split("\r\n", 1)[1]),
+                                       encoding="utf-8")
+    assert not header
@@ -0,0 +1,266 @@
+"""
+Reading and writing delimited text in formats the csv module can't
+handle: delimiters of more than one character (`||`, say), and quotes of
+more than one character or that open and close differently (`{ ... }`,
+`<< ... >>`), which can contain the delimiter and line breaks.
+
+The reader gives the same rows as a csv.reader would for such a format,
+and is just as lazy. Text is scanned a block at a time with str.find()
+and compiled regexes: the lines that have no quote in them are split in
+bulk, and only records with a quoted field are parsed field by field.
+"""
+
+import csv
+import re
+
+# text is read (and split into rows) this many characters at a time
+BLOCK_CHARS = 1024 * 1024
+
+
+class CustomDialect:
+    """
+    A format for the tokenizer. Attributes are named like those of a
+    csv.Dialect, plus `closequote`.
+
+    With an opening and closing quote that are the same, a quote is
+    doubled to put it in a quoted field (as with `doublequote`); with
+    different ones, quotes nest, so `{a {b} c}` is the field "a {b} c".
+    Like with the csv module, a quote only opens a quoted field at the
+    start of a field, and anything after the closing quote (up to the
+    delimiter) is added to the field.
+    """
+
+    escapechar = None
+    skipinitialspace = False
+    strict = False
+
+    def __init__(self, delimiter=",", quotechar='"', closequote=None, doublequote=True,
+                 lineterminator="\r\n"):
+        """:param quotechar: the opening quote; None (or empty) for no quoting"""
+        if not delimiter:
+            raise ValueError("the delimiter can't be empty")
+        self.delimiter = delimiter
+        self.quotechar = quotechar or None
+        self.closequote = closequote or self.quotechar
+        self.doublequote = doublequote
+        self.lineterminator = lineterminator
+        self.quoting = csv.QUOTE_MINIMAL if self.quotechar else csv.QUOTE_NONE
+
+    def __repr__(self):
+        return (f"CustomDialect(delimiter={self.delimiter!r}, quotechar={self.quotechar!r}, "
+                f"closequote={self.closequote!r})")
+
+
+def needs_tokenizer(dialect):
+    """True if `dialect` is one the csv module can't read or write"""
+    return isinstance(dialect, CustomDialect)
+
+
+def custom_dialect(delimiter, quotechar, closequote=None, doublequote=True):
+    """
+    A CustomDialect for the given delimiter and quotes if the csv module
+    can't handle them, else None
+    """
+    if (len(delimiter) > 1 or (quotechar and len(quotechar) > 1)
+            or (closequote and closequote != quotechar)):
+        return CustomDialect(delimiter, quotechar, closequote, doublequote)
+    return None
+
+
+def reader(f, dialect):
+    """A csv.reader of the text file `f`, or a Reader for a CustomDialect"""
+    if needs_tokenizer(dialect):
+        return Reader(f, dialect)
+    return csv.reader(f, dialect=dialect)
+
+
+def writer(f, dialect, **fmtparams):
+    """A csv.writer to the text file `f`, or a Writer for a CustomDialect"""
+    if needs_tokenizer(dialect):
+        return Writer(f, dialect, **fmtparams)
+    return csv.writer(f, dialect, **fmtparams)
+
+
+class Reader:
+    """
+    Iterate over the records of a text file (opened with newline='') in a
+    CustomDialect, as lists of fields. Blank lines are empty rows.
+    """
+
+    def __init__(self, f, dialect):
+        self._file = f
+        self._delim = dialect.delimiter
+        self._open = dialect.quotechar
+        self._close = dialect.closequote
+        self._double = dialect.doublequote
+        # the end of an unquoted field (a "\r" on its own only ends the
+        # last line of the file)
+        self._field_end = re.compile(re.escape(self._delim) + r"|\r?\n|\r\Z")
+        if self._open and self._open != self._close:
+            # (the longer of the two first, in case one starts the other)
+            quotes = sorted({self._open, self._close}, key=len, reverse=True)
+            self._quotes = re.compile("|".join(map(re.escape, quotes)))
+        self._rows = self._read()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    def _read(self):
+        rest = ""
+        while True:
+            block = self._file.read(BLOCK_CHARS)
+            if not block:
+                break
+            text = rest + block
+            rows, used = self._parse(text, False)
+            yield from rows
+            rest = text[used:]
+        if rest:
+            rows, _ = self._parse(rest, True)
+            yield from rows
+
+    def _parse(self, text, final):
+        """
+        Split `text` into rows, up to the end of the last complete record
+        in it (or, if it's the `final` text, up to its end)
+
+        :return: the rows, and where in the text they end
+        """
+        end = len(text) if final else text.rfind("\n") + 1
+        quote = self._open
+        rows = []
+        pos = 0
+        while pos < end:
+            at = text.find(quote, pos, end) if quote else -1
+            if at < 0:
+                self._split_lines(text[pos:end], rows)
+                return rows, end
+
+            # the lines before the one with a quote in it don't need
+            # parsing, then that line does (and maybe the lines after it)
+            nl = text.rfind("\n", pos, at)
+            if nl >= 0:
+                self._split_lines(text[pos:nl + 1], rows)
+                pos = nl + 1
+            row, pos_after = self._record(text, pos, end, final)
+            if row is None:
+                # (a quoted field that goes on past the end of the text)
+                break
+            rows.append(row)
+            pos = pos_after
+        return rows, pos
+
+    def _split_lines(self, text, rows):
+        """Add the rows of lines of text without quotes"""
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+            if text.endswith("\r"):
+                text = text[:-1] + "\n"
+        lines = text.split("\n")
+        if not lines[-1]:
+            lines.pop()
+        delim = self._delim
+        rows.extend([line.split(delim) if line else [] for line in lines])
+
+    def _record(self, text, pos, end, final):
+        """
+        Parse the record that starts at `pos`, one field at a time
+
+        :return: the row and where the next record starts, or (None, pos)
+            if the record doesn't end before `end`
+        """
+        row = []
+        quote, field_end = self._open, self._field_end
+        while True:
+            value = ""
+            if quote and text.startswith(quote, pos):
+                value, after = self._quoted(text, pos + len(quote), end)
+                if value is None:
+                    if final:
+                        # (an unclosed quote takes the rest of the text)
+                        row.append(text[pos + len(quote):end])
+                        return row, end
+                    return None, pos
+                pos = after
+
+            m = field_end.search(text, pos, end)
+            if m is None:
+                row.append(value + text[pos:end])
+                return row, end
+            row.append(value + text[pos:m.start()])
+            pos = m.end()
+            if m.group() != self._delim:
+                return row, pos
+
+    def _quoted(self, text, pos, end):
+        """
+        The value of a quoted field whose text starts at `pos`, and where
+        the closing quote ends; (None, None) if it's not closed before `end`
+        """
+        close = self._close
+        if close == self._open:
+            parts = []
+            while True:
+                at = text.find(close, pos, end)
+                if at < 0:
+                    return None, None
+                after = at + len(close)
+                if self._double and text.startswith(close, after):
+                    # (a doubled quote is one quote)
+                    parts.append(text[pos:after])
+                    pos = after + len(close)
+                    continue
+                parts.append(text[pos:at])
+                return "".join(parts), after
+
+        depth = 1
+        for m in self._quotes.finditer(text, pos, end):
+            depth += 1 if m.group() == self._open else -1
+            if not depth:
+                return text[pos:m.start()], m.end()
+        return None, None
+
+
+class Writer:
+    """
+    Write rows to a text file in a CustomDialect, like csv.writer with
+    QUOTE_MINIMAL: fields with the delimiter, a quote or a line break in
+    them are quoted.
+    """
+
+    def __init__(self, f, dialect, lineterminator=None):
+        self._file = f
+        self._delim = dialect.delimiter
+        self._open = dialect.quotechar
+        self._close = dialect.closequote
+        self._lineterm = lineterminator or dialect.lineterminator
+        specials = [self._delim, "\r", "\n"]
+        if self._open:
+            specials += [self._open, self._close]
+        self._special = re.compile("|".join(map(re.escape, specials)))
+
+    def _field(self, value):
+        if value is None:
+            return ""
+        value = str(value)
+        if not self._open or not self._special.search(value):
+            return value
+        if self._open == self._close:
+            value = value.replace(self._close, self._close * 2)
+        # (with nesting quotes, a field whose quotes don't balance can't
+        # be written so that it reads back the same)
+        return self._open + value + self._close
+
+    def writerow(self, row):
+        fields = list(map(self._field, row))
+        if fields == [""] and self._open:
+            # (a blank line would be no row at all)
+            fields = [self._open + self._close]
+        self._file.write(self._delim.join(fields) + self._lineterm)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
@@ -0,0 +1,333 @@
+import time
+from collections import deque
+
+# rough overhead (in bytes) of each cell recorded by a command, on top
+# of the text of its values
+_CELL_BYTES = 100
+
+
+def _text_size(value):
+    return len(value) if value else 0
+
+
+class Command:
+    """
+    An undoable change to a CSVTableModel, recorded as just the values
+    it replaced and the values it set. Rows and columns are those of the
+    model's store (not the displayed ones), so a command still applies
+    after the table is sorted or its columns are moved.
+    """
+
+    # for the Undo/Redo actions ("Undo <text>")
+    text = ""
+
+    def undo(self, model):
+        raise NotImplementedError
+
+    def redo(self, model):
+        raise NotImplementedError
+
+    def size(self):
+        """Approximate memory used by the command, in bytes"""
+        return 0
+
+    def merge(self, other, interval):
+        """
+        Absorb `other`, a command done right after this one, if the two
+        make sense as a single step
+
+        :param interval: how long apart (in seconds) edits can be made to
+            still be merged
+        :return: True if merged
+        """
+        return False
+
+
+class CellEdits(Command):
+    """Edits of individual cells, as (row, slot, old value, new value) tuples"""
+
+    text = "Edit"
+
+    def __init__(self, edits):
+        self.edits = list(edits)
+        # when the last of the edits was made
+        self.time = time.monotonic()
+        self._size = sum(_CELL_BYTES + _text_size(old) + _text_size(new)
+                         for _, _, old, new in self.edits)
+
+    def undo(self, model):
+        model._set_cells([(row, slot, old) for row, slot, old, _ in reversed(self.edits)])
+
+    def redo(self, model):
+        model._set_cells([(row, slot, new) for row, slot, _, new in self.edits])
+
+    def size(self):
+        return self._size
+
+    def merge(self, other, interval):
+        # (typing into a cell, one change after another; an edit of
+        # another cell is a step of its own)
+        if not isinstance(other, CellEdits) or other.time - self.time > interval:
+            return False
+        cell = self.edits[-1][:2]
+        if any(edit[:2] != cell for edit in other.edits):
+            return False
+        self.edits.extend(other.edits)
+        self.time = other.time
+        self._size += other._size
+        return True
+
+
+class RangeEdit(Command):
+    """
+    An edit of a block of cells at once (a paste, say): the cells of the
+    given rows and slots, with the old and new values as a list of values
+    per slot
+    """
+
+    text = "Paste"
+
+    def __init__(self, rows, slots, old, new, text=None):
+        self.rows = rows
+        self.slots = slots
+        self.old = old
+        self.new = new
+        if text is not None:
+            self.text = text
+        self._size = None
+
+    def undo(self, model):
+        model._set_range(self.rows, self.slots, self.old)
+
+    def redo(self, model):
+        model._set_range(self.rows, self.slots, self.new)
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(_CELL_BYTES * len(column) + sum(map(_text_size, column))
+                             for values in (self.old, self.new) for column in values)
+        return self._size
+
+
+class HeaderRename(Command):
+    """Renaming the column of the given slot"""
+
+    text = "Rename Column"
+
+    def __init__(self, slot, old, new):
+        self.slot = slot
+        self.old = old
+        self.new = new
+
+    def undo(self, model):
+        model._rename_slot(self.slot, self.old)
+
+    def redo(self, model):
+        model._rename_slot(self.slot, self.new)
+
+    def size(self):
+        return _CELL_BYTES + _text_size(self.old) + _text_size(self.new)
+
+
+class RowInsert(Command):
+    """
+    Inserting rows into the table: the pieces of store rows (see
+    pieces.py) put in at a position in the order of the table (which
+    sorting doesn't change)
+    """
+
+    text = "Insert Rows"
+
+    def __init__(self, pos, pieces):
+        self.pos = pos
+        self.pieces = pieces
+
+    def undo(self, model):
+        model._remove_rows(self.pos, sum(n for _, n in self.pieces))
+
+    def redo(self, model):
+        model._insert_rows(self.pos, self.pieces)
+
+    def size(self):
+        return _CELL_BYTES * len(self.pieces)
+
+
+class RowRemove(Command):
+    """
+    Removing rows from the table, as (position, pieces) steps in the
+    order they were taken out. The rows stay in the store, so putting
+    them back only takes their pieces.
+    """
+
+    text = "Remove Rows"
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def undo(self, model):
+        for pos, pieces in reversed(self.steps):
+            model._insert_rows(pos, pieces)
+
+    def redo(self, model):
+        for pos, pieces in self.steps:
+            model._remove_rows(pos, sum(n for _, n in pieces))
+
+    def size(self):
+        return _CELL_BYTES * sum(len(pieces) for _, pieces in self.steps)
+
+
+class RowMove(Command):
+    """Moving `count` rows of the table from `pos` to before `dest` (see PieceTable.move())"""
+
+    text = "Move Rows"
+
+    def __init__(self, pos, count, dest):
+        self.pos = pos
+        self.count = count
+        self.dest = dest
+
+    def undo(self, model):
+        # (where the rows ended up, and where they came from, as seen
+        # from there)
+        moved = self.dest if self.dest <= self.pos else self.dest - self.count
+        back = self.pos if self.pos <= moved else self.pos + self.count
+        model._move_rows(moved, self.count, back)
+
+    def redo(self, model):
+        model._move_rows(self.pos, self.count, self.dest)
+
+
+class ColumnInsert(Command):
+    """Inserting columns (of the given store slots and names) at a display position"""
+
+    text = "Insert Columns"
+
+    def __init__(self, pos, slots, names):
+        self.pos = pos
+        self.slots = slots
+        self.names = names
+
+    def undo(self, model):
+        model._remove_columns(self.pos, len(self.slots))
+
+    def redo(self, model):
+        model._insert_columns(self.pos, self.slots, self.names)
+
+    def size(self):
+        return sum(_CELL_BYTES + _text_size(name) for name in self.names)
+
+
+class ColumnRemove(ColumnInsert):
+    """Removing columns (of the given store slots and names) from a display position"""
+
+    text = "Remove Columns"
+
+    def undo(self, model):
+        super().redo(model)
+
+    def redo(self, model):
+        super().undo(model)
+
+
+class UndoStack:
+    """
+    The history of the changes made to a table, as a stack of Commands.
+
+    Commands are pushed once they've been done. Consecutive edits of the
+    same cell made within `merge_interval` seconds of each other are
+    merged into one step. The oldest commands are dropped once the
+    history takes up more than `max_bytes` (the latest one is always
+    kept).
+
+    The stack also tracks the "clean" state (the table as it was loaded
+    or last saved), so undoing back to it can tell the table is
+    unmodified again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, merge_interval=2.0):
+        self.max_bytes = max_bytes
+        self.merge_interval = merge_interval
+
+        self._done = deque()
+        self._undone = []
+        self._bytes = 0
+        # how many of the commands in _done had been done in the clean
+        # state; None if it can't be got back to
+        self._clean = 0
+
+    def clear(self):
+        """Forget the history and make the current state the clean one"""
+        self._done.clear()
+        self._undone.clear()
+        self._bytes = 0
+        self._clean = 0
+
+    @property
+    def clean(self):
+        return self._clean == len(self._done)
+
+    def set_clean(self):
+        self._clean = len(self._done)
+
+    @property
+    def can_undo(self):
+        return bool(self._done)
+
+    @property
+    def can_redo(self):
+        return bool(self._undone)
+
+    @property
+    def undo_text(self):
+        return self._done[-1].text if self._done else ""
+
+    @property
+    def redo_text(self):
+        return self._undone[-1].text if self._undone else ""
+
+    def push(self, command):
+        """Record a command that has just been done"""
+        for undone in self._undone:
+            self._bytes -= undone.size()
+        self._undone.clear()
+        if self._clean is not None and self._clean > len(self._done):
+            # the clean state was undone, and is gone now
+            self._clean = None
+
+        top = self._done[-1] if self._done else None
+        # (merging into the clean state would make it unreachable)
+        if top is not None and not self.clean:
+            before = top.size()
+            if top.merge(command, self.merge_interval):
+                self._bytes += top.size() - before
+                self._trim()
+                return
+
+        self._done.append(command)
+        self._bytes += command.size()
+        self._trim()
+
+    def _trim(self):
+        """Drop the oldest commands while the history is too big"""
+        while self._bytes > self.max_bytes and len(self._done) > 1:
+            self._bytes -= self._done.popleft().size()
+            if self._clean is not None:
+                self._clean -= 1
+                if self._clean < 0:
+                    self._clean = None
+
+    def undo(self):
+        """:return: the command to undo, or None"""
+        if not self._done:
+            return None
+        command = self._done.pop()
+        self._undone.append(command)
+        return command
+
+    def redo(self):
+        """:return: the command to redo, or None"""
+        if not self._undone:
+            return None
+        command = self._undone.pop()
+        self._done.append(command)
+        return command
@@ -0,0 +1,221 @@
+import codecs
+import io
+import locale
+import operator
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from itertools import count, groupby
+
+import tokenizer
+from compressed import compressing_writer, compression_for_name
+
+# serialised rows are buffered up to (about) this many characters before
+# being written out
+_BUFFER_CHARS = 1024 * 1024
+
+# copy unchanged parts of the original file in pieces of this size
+_COPY_BYTES = 16 * 1024 * 1024
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Context manager that yields a binary file to write the new contents
+    of `path` to. The file is created next to `path` and only replaces it
+    (atomically) if the block completes without an exception.
+    """
+    path = os.path.abspath(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix="." + os.path.basename(path) + ".",
+                               suffix=".tmp")
+    try:
+        with open(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+def _copy_range(src_fd, dst, start, end):
+    """Copy bytes [start, end) of file descriptor `src_fd` to the file `dst`"""
+    while start < end:
+        count = min(end - start, _COPY_BYTES)
+        try:
+            # let the kernel do the copying, if it can
+            dst.flush()
+            copied = os.copy_file_range(src_fd, dst.fileno(), count, start)
+        except (AttributeError, OSError):
+            copied = 0
+
+        if not copied:
+            data = os.pread(src_fd, count, start)
+            if not data:
+                raise IOError("unexpected end of the original file")
+            copied = dst.write(data)
+        start += copied
+
+
+def _unterminated(src_fd, end):
+    """True if the line that ends at byte `end` of file descriptor `src_fd` has no line break"""
+    return os.pread(src_fd, 1, end - 1) != b'\n'
+
+
+class _RowWriter:
+    """Serialise rows with csv.writer (or the tokenizer's) into a buffer that's flushed (as bytes) to a file"""
+
+    def __init__(self, f, dialect, lineterminator, encoding):
+        self._file = f
+        self._buf = io.StringIO()
+        # (which writes a BOM, for an encoding that has one, only once;
+        # and characters that were undecodable bytes as those bytes)
+        self._encode = codecs.getincrementalencoder(encoding)('surrogateescape').encode
+        self._writer = tokenizer.writer(self._buf, dialect, lineterminator=lineterminator)
+        self._lineterminator = lineterminator
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+        if self._buf.tell() > _BUFFER_CHARS:
+            self.flush()
+
+    def end_line(self):
+        """End a line that was copied without a line terminator"""
+        self._buf.write(self._lineterminator)
+
+    def flush(self):
+        if self._buf.tell():
+            self._file.write(self._encode(self._buf.getvalue()))
+            self._buf.seek(0)
+            self._buf.truncate()
+
+
+def save_csv(path, get_row, nrows, dialect, headers=None, source=None, dirty=None, encoding=None,
+             records=None):
+    """
+    Write a table to `path`, replacing any existing file atomically. Rows
+    are streamed out one at a time, so the table is never serialised in
+    memory as a whole.
+
+    :param get_row: callable that returns the list of values for row i
+    :param int nrows: number of rows in the table
+    :param dialect: csv dialect for the rows that are (re-)serialised
+    :param headers: header names to write before the rows; None to write
+        no header (or, with a `source` that has a header, to copy it)
+    :param source: a (fully indexed) LazyRows for the file that the table
+        was read from. Any lines skipped before the header are copied from
+        it, as are the records of all the rows that aren't in `dirty`,
+        byte for byte. Row i of the table must be record i of the source,
+        unless `records` says otherwise.
+    :param dirty: set of rows that have changed since the source was
+        written. Ignored if there's no source.
+    :param encoding: defaults to that of `source`, or the locale's
+    :param records: the record of the source that each row of the table
+        is (a sequence), or -1 for a row that isn't in the source or has
+        changed since; `dirty` is ignored then
+
+    A file whose name ends in .gz, .bz2, .xz or .zst is compressed (and
+    nothing is copied from the source then).
+    """
+    kind = compression_for_name(path)
+    if kind is not None:
+        source = None
+
+    if source is None:
+        dirty = None
+        lineterm = dialect.lineterminator
+    else:
+        encoding = encoding or source.encoding
+        lineterm = source.line_terminator()
+        src_fd = source.fileno()
+        if codecs.lookup(encoding).name == "utf-8-sig":
+            # (the BOM is copied along with any skipped lines)
+            encoding = "utf-8"
+
+    encoding = encoding or locale.getpreferredencoding(False)
+
+    with atomic_write(path) as f:
+        if kind is not None:
+            with compressing_writer(f, kind) as cf:
+                out = _RowWriter(cf, dialect, lineterm, encoding)
+                if headers is not None:
+                    out.writerow(headers)
+                for i in range(nrows):
+                    out.writerow(get_row(i))
+                out.flush()
+            return
+
+        out = _RowWriter(f, dialect, lineterm, encoding)
+
+        # True if what was copied last was the source's last record, and
+        # the file ended it without a line break: one is added if anything
+        # follows it
+        cut = False
+
+        def copy(start, end):
+            nonlocal cut
+            if start < end:
+                if cut:
+                    out.end_line()
+                out.flush()
+                _copy_range(src_fd, f, start, end)
+                cut = end == src_size and _unterminated(src_fd, end)
+
+        def write(row):
+            nonlocal cut
+            if cut:
+                out.end_line()
+                cut = False
+            out.writerow(row)
+
+        if source is not None:
+            src_size = os.fstat(src_fd).st_size
+            hstart, hend = source.header_range
+            # skipped lines
+            copy(0, hstart)
+
+            if headers is None:
+                copy(hstart, hend)
+
+        if headers is not None:
+            write(headers)
+
+        if dirty is None:
+            for i in range(nrows):
+                write(get_row(i))
+        elif records is not None:
+            # runs of rows whose records follow on from each other have
+            # the same difference between record and row
+            i = 0
+            for _, run in groupby(map(operator.sub, records, count())):
+                n = len(list(run))
+                if records[i] < 0:
+                    # (a row that isn't copied can only start a run, of
+                    # records 0, 1... after it)
+                    write(get_row(i))
+                    i, n = i + 1, n - 1
+                if n:
+                    copy(*source.record_range(records[i], records[i] + n - 1))
+                    i += n
+        else:
+            def copy_rows(first, end):
+                # copy the records of rows [first, end) from the source
+                if first < end:
+                    copy(*source.record_range(first, end - 1))
+
+            prev = 0
+            for i in sorted(dirty):
+                if i >= nrows:
+                    break
+                copy_rows(prev, i)
+                write(get_row(i))
+                prev = i + 1
+            copy_rows(prev, nrows)
+
+        out.flush()